@@ -60,6 +60,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'portal.middleware.ApplicantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
@@ -121,6 +122,25 @@ DATABASES = {
 # }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Set REDIS_URL in production so every worker shares cached exchange rates
+# and the price table (needs the redis package).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -171,6 +191,16 @@ MEDIA_URL = '/media/'
 # The absolute path to the directory where media files will be stored
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Applicants' documents and photographs are stored under the hash of their
+# content (portal/storage.py). Those names never change content, so a web
+# server serving MEDIA_ROOT can send portal.storage.IMMUTABLE_CACHE_CONTROL
+# for them, as the DEBUG media view does.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'blobs': {'BACKEND': 'portal.storage.ContentAddressedStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -182,6 +212,65 @@ ACCOUNT_LOGOUT_ON_GET = False
 
 FLUTTERWAVE_SECRET_KEY = os.environ.get('FLUTTERWAVE_SECRET_KEY')
 FLUTTERWAVE_PUBLIC_KEY = os.environ.get('FLUTTERWAVE_PUBLIC_KEY')
+# Point this at the local stub (`python manage.py flutterwave_stub`) to work offline.
+FLUTTERWAVE_BASE_URL = os.environ.get('FLUTTERWAVE_BASE_URL', 'https://api.flutterwave.com/v3')
+FLUTTERWAVE_CONNECT_TIMEOUT = 3.05  # seconds
+FLUTTERWAVE_READ_TIMEOUT = 10  # seconds
+FLUTTERWAVE_MAX_RETRIES = 2
+FLUTTERWAVE_RETRY_BACKOFF = 0.5  # seconds, doubled on every retry
+# Upper bound on one API call, retries and backoff included.
+FLUTTERWAVE_TOTAL_TIMEOUT = 12  # seconds
+FLUTTERWAVE_POOL_MAXSIZE = 10
+
+# --- UPLOADS ---
+# Resumable uploads (portal/uploads.py) are assembled here, outside MEDIA_ROOT,
+# until their last chunk arrives. Sessions idle for longer than
+# UPLOAD_SESSION_TTL are removed by `python manage.py clear_upload_sessions`.
+CHUNKED_UPLOAD_DIR = os.environ.get('CHUNKED_UPLOAD_DIR', os.path.join(BASE_DIR, 'tmp_uploads'))
+UPLOAD_CHUNK_SIZE = 512 * 1024  # bytes, sent by the browser per request
+UPLOAD_CHUNK_MAX_SIZE = 4 * 1024 * 1024  # bytes, largest chunk accepted
+UPLOAD_SESSION_TTL = 24 * 3600  # seconds
+# Media files no FileField refers to any more are found by
+# `python manage.py collect_media_garbage`; files younger than the grace
+# period are left alone, and quarantined files are moved here, outside
+# MEDIA_ROOT, so they can be restored.
+MEDIA_GC_GRACE_PERIOD = 7 * 24 * 3600  # seconds
+MEDIA_QUARANTINE_DIR = os.environ.get('MEDIA_QUARANTINE_DIR', os.path.join(BASE_DIR, 'media_quarantine'))
+
+# --- EXCHANGE RATE CONFIGURATION ---
+# How long a fetched USD->NGN rate is considered fresh. Older rates are still
+# served while one worker refreshes them in the background.
+EXCHANGE_RATE_TTL = int(os.environ.get('EXCHANGE_RATE_TTL', 900))  # seconds
+EXCHANGE_RATE_REFRESH_LOCK_TIMEOUT = 30  # seconds
+# Last-resort USD->NGN rate, used only before any rate has been recorded.
+EXCHANGE_RATE_FALLBACK = os.environ.get('EXCHANGE_RATE_FALLBACK', '1650.00')
+# How long the fallback is cached before the database is checked again.
+EXCHANGE_RATE_FALLBACK_TTL = 60  # seconds
+
+# --- REFERENCE DATA ---
+# How often (seconds) each worker checks the ReferenceDataVersion row for
+# fee/country edits made on other workers. This bounds how long a worker can
+# serve stale fees, with or without a shared cache.
+REFERENCE_DATA_CHECK_INTERVAL = 5
+
+# --- CIRCUIT BREAKERS ---
+# After this many consecutive failures a dependency (Flutterwave, GeoIP, SMTP)
+# is skipped for CIRCUIT_BREAKER_RESET_TIMEOUT seconds and fallbacks are used.
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_TIMEOUT = 30  # seconds
+
+# --- GEOIP CONFIGURATION ---
+# Request header in which a trusted CDN/load balancer passes the visitor's
+# country code, e.g. 'CF-IPCountry' behind Cloudflare. When present it is used
+# instead of a GeoIP lookup. Only set this if the proxy always overwrites it.
+GEOIP_COUNTRY_HEADER = os.environ.get('GEOIP_COUNTRY_HEADER')
+# Path to the MaxMind GeoLite2/GeoIP2 Country database used to detect Nigerian visitors.
+GEOIP_PATH = os.environ.get('GEOIP_PATH', os.path.join(BASE_DIR, 'geoip', 'GeoLite2-Country.mmdb'))
+# Per-worker cache of IP -> country lookups.
+GEOIP_CACHE_SIZE = int(os.environ.get('GEOIP_CACHE_SIZE', 10000))
+GEOIP_CACHE_TTL = int(os.environ.get('GEOIP_CACHE_TTL', 3600))  # seconds
+# Cache by /24 (IPv4) or /48 (IPv6) network instead of by individual address.
+GEOIP_CACHE_BY_PREFIX = True
 
 # --- ALLAUTH CONFIGURATION ---
 ACCOUNT_EMAIL_REQUIRED = True
@@ -205,6 +294,8 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
+# Don't let a hung SMTP server hold a request open.
+EMAIL_TIMEOUT = 10  # seconds
 
 # The default email address for outgoing mail.
 DEFAULT_FROM_EMAIL = 'Hadey Travels Global <info@hadeytravelsglobal.com>'
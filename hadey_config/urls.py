@@ -1,12 +1,11 @@
 # hadey_config/urls.py
 
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
 # Import our custom admin site
 from portal.admin import hadey_admin_site
 # Import the custom view for the signup choice page
-from portal.views import signup_choice_view
+from portal.views import media_view, signup_choice_view
 
 urlpatterns = [
     path('admin/', hadey_admin_site.urls),
@@ -22,6 +21,7 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Like static(), with far-future caching of content-addressed files
+    urlpatterns += [re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), media_view)]
     # The static root is for production, STATICFILES_DIRS is for development
     # urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
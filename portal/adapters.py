@@ -2,16 +2,18 @@
 
 from allauth.account.adapter import DefaultAccountAdapter
 from django.conf import settings
-from django.core.mail import send_mail
+from django.db import transaction
+from .utils import guarded_send_mail
 from django.template.loader import render_to_string
-from .models import UserProfile
+from .models import Application, UserProfile, WorkApplication
 
 class CustomAccountAdapter(DefaultAccountAdapter):
 
     def save_user(self, request, user, form, commit=True):
         """
-        This is called when a user signs up. We override it to create a
-        UserProfile object.
+        This is called when a user signs up. We override it to create the
+        UserProfile and the application for the chosen path, so later page
+        views only ever read them.
         """
         # First, let the default save_user run to create the user
         user = super().save_user(request, user, form, commit=False)
@@ -20,12 +22,17 @@ class CustomAccountAdapter(DefaultAccountAdapter):
         account_type = request.POST.get('account_type')
         
         if commit:
-            user.save()
-            # Create the UserProfile if the account_type was provided
-            if account_type:
-                UserProfile.objects.create(user=user, account_type=account_type)
-
-            send_mail(
+            with transaction.atomic():
+                user.save()
+                # Create the UserProfile and application if a valid account_type was provided
+                if account_type in UserProfile.AccountType.values:
+                    UserProfile.objects.create(user=user, account_type=account_type)
+                    if account_type == UserProfile.AccountType.STUDENT:
+                        Application.objects.create(user=user)
+                    else:
+                        WorkApplication.objects.create(user=user)
+
+            guarded_send_mail(
                 f'New User Signup: {user.email}',
                 f"""Hello Admin,
 
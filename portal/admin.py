@@ -1,14 +1,17 @@
 # portal/admin.py
 
 from django.contrib import admin
+from django.db import transaction
 from django.utils.html import format_html
 from django.urls import reverse
 from .models import (
     Application, Document, Payment, VisaUpdate, Testimonial, 
-    UserProfile, WorkApplication, Country, FeeStructure
+    UserProfile, WorkApplication, Country, FeeStructure, ExchangeRate
 )
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User, Group
+from .ledger import SUMMARY_FIELDS, matching_masks, refresh_payment_summary
+from .pricing import STUDENT_PURPOSES, WORK_PURPOSES
 
 # --- Custom Admin Site ---
 class HadeyAdminSite(admin.AdminSite):
@@ -45,7 +48,7 @@ class StudentDocumentInline(admin.TabularInline):
 class StudentPaymentInline(admin.TabularInline):
     model = Payment
     extra = 0
-    readonly_fields = ('amount', 'status', 'purpose', 'tx_ref', 'created_at')
+    readonly_fields = ('amount', 'currency', 'amount_usd', 'status', 'purpose', 'tx_ref', 'created_at')
     can_delete = False
     exclude = ('work_application',)
     verbose_name = "Student Payment"
@@ -73,16 +76,58 @@ class WorkerDocumentInline(admin.TabularInline):
 class WorkerPaymentInline(admin.TabularInline):
     model = Payment
     extra = 0
-    readonly_fields = ('amount', 'status', 'purpose', 'tx_ref', 'created_at')
+    readonly_fields = ('amount', 'currency', 'amount_usd', 'status', 'purpose', 'tx_ref', 'created_at')
     can_delete = False
     exclude = ('application',)
     verbose_name = "Worker Payment"
     verbose_name_plural = "Worker Payments"
 
+# --- Payment summary ---
+class PaidPurposeFilter(admin.SimpleListFilter):
+    """
+    Filters applications on their paid_purposes bitmask, e.g. "paid the
+    admission fee" combined with "has not paid the agency fee (full)".
+    """
+    title = 'paid'
+    parameter_name = 'paid'
+    paid = True
+
+    def __init__(self, request, params, model, model_admin):
+        self.purposes = model_admin.payment_purposes
+        super().__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        return [(purpose, Payment.PaymentPurpose(purpose).label) for purpose in self.purposes]
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.purposes:
+            return queryset
+        if self.paid:
+            masks = matching_masks(self.purposes, paid=[self.value()])
+        else:
+            masks = matching_masks(self.purposes, unpaid=[self.value()])
+        return queryset.filter(paid_purposes__in=masks)
+
+class UnpaidPurposeFilter(PaidPurposeFilter):
+    title = 'not paid'
+    parameter_name = 'unpaid'
+    paid = False
+
+class PaymentSummaryMixin:
+    """List column for the applications' payment summary."""
+    def paid_fees(self, obj):
+        labels = [
+            Payment.PaymentPurpose(purpose).label for purpose in self.payment_purposes
+            if obj.paid_purposes & Payment.PURPOSE_BITS[purpose]
+        ]
+        return ', '.join(labels) or '-'
+    paid_fees.short_description = 'Paid'
+
 # --- ModelAdmins ---
-class ApplicationAdmin(admin.ModelAdmin): # Student Application Admin
-    list_display = ('user', 'full_name', 'email', 'status', 'visa_status', 'updated_at', 'download_pdf_link')
-    list_filter = ('status', 'visa_status', 'country_of_interest')
+class ApplicationAdmin(PaymentSummaryMixin, admin.ModelAdmin): # Student Application Admin
+    payment_purposes = [purpose for purpose in Payment.PaymentPurpose if purpose in STUDENT_PURPOSES]
+    list_display = ('user', 'full_name', 'email', 'status', 'visa_status', 'paid_fees', 'total_paid_usd', 'last_payment_at', 'updated_at', 'download_pdf_link')
+    list_filter = ('status', 'visa_status', PaidPurposeFilter, UnpaidPurposeFilter, 'country_of_interest')
     search_fields = ('user__username', 'full_name', 'email')
     ordering = ('-updated_at',)
     inlines = [StudentVisaUpdateInline, StudentDocumentInline, StudentPaymentInline]
@@ -92,6 +137,7 @@ class ApplicationAdmin(admin.ModelAdmin): # Student Application Admin
             'fields': ('custom_application_fee', 'custom_admission_fee', 'custom_agency_fee')
         }),
         ('Core Info', {'fields': ('user', 'status', 'visa_status', 'passport_photograph')}),
+        ('Payments', {'fields': ('total_paid_usd', 'last_payment_at')}),
         ('Personal Information', {
             'classes': ('collapse',),
             'fields': ('full_name', 'date_of_birth', 'place_of_birth', 'gender', 'nationality', 'address', 'city', 'postal_code', 'phone_number', 'email', 'passport_number', 'passport_issue_date', 'passport_expiry_date')
@@ -102,7 +148,7 @@ class ApplicationAdmin(admin.ModelAdmin): # Student Application Admin
         }),
         ('Academic Information', {
             'classes': ('collapse',),
-            'fields': ('grade_level', 'preferred_program', 'previous_school', 'country_applying_from', 'country_of_interest', 'achievements')
+            'fields': ('grade_level', 'preferred_program', 'previous_school', 'country_applying_from', 'country_of_interest', 'country_of_interest_legacy', 'achievements')
         }),
         ('Emergency & Medical', {
             'classes': ('collapse',),
@@ -117,16 +163,17 @@ class ApplicationAdmin(admin.ModelAdmin): # Student Application Admin
             'fields': ('created_at', 'updated_at')
         }),
     )
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'total_paid_usd', 'last_payment_at', 'country_of_interest_legacy')
 
     def download_pdf_link(self, obj):
         url = reverse('portal:generate_pdf', args=['student', obj.id])
         return format_html('<a href="{}" target="_blank">Print to PDF</a>', url)
     download_pdf_link.short_description = 'Print PDF'
 
-class WorkApplicationAdmin(admin.ModelAdmin):
-    list_display = ('user', 'full_name', 'email', 'status', 'destination_country', 'updated_at', 'download_pdf_link')
-    list_filter = ('status', 'destination_country')
+class WorkApplicationAdmin(PaymentSummaryMixin, admin.ModelAdmin):
+    payment_purposes = [purpose for purpose in Payment.PaymentPurpose if purpose in WORK_PURPOSES]
+    list_display = ('user', 'full_name', 'email', 'status', 'destination_country', 'paid_fees', 'total_paid_usd', 'last_payment_at', 'updated_at', 'download_pdf_link')
+    list_filter = ('status', PaidPurposeFilter, UnpaidPurposeFilter, 'destination_country')
     search_fields = ('user__username', 'full_name', 'email')
     ordering = ('-updated_at',)
     inlines = [WorkerVisaUpdateInline, WorkerDocumentInline, WorkerPaymentInline]
@@ -137,13 +184,14 @@ class WorkApplicationAdmin(admin.ModelAdmin):
             'fields': ('custom_application_fee',)
         }),
         ('Core Info', {'fields': ('user', 'status', 'visa_status', 'passport_photograph')}),
+        ('Payments', {'fields': ('total_paid_usd', 'last_payment_at')}),
         ('Personal Information', {'classes': ('collapse',), 'fields': ('full_name', 'gender', 'date_of_birth', 'place_of_birth', 'nationality', 'passport_number', 'passport_issue_date', 'passport_expiry_date', 'marital_status', 'current_address', 'contact_number', 'email')}),
         ('Employment & Visa Details', {'classes': ('collapse',), 'fields': ('job_title', 'sponsor', 'destination_country', 'applied_before', 'previous_application_details')}),
         ('Professional Background', {'classes': ('collapse',), 'fields': ('highest_qualification', 'field_of_study', 'years_of_experience', 'skills_certifications')}),
         ('Consent', {'fields': ('declaration_agreed', 'job_offer_accepted')}),
         ('Timestamps', {'classes': ('collapse',), 'fields': ('created_at', 'updated_at')}),
     )
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'total_paid_usd', 'last_payment_at')
 
     def download_pdf_link(self, obj):
         url = reverse('portal:generate_pdf', args=['work', obj.id])
@@ -178,15 +226,78 @@ class UserProfileAdmin(admin.ModelAdmin):
 class FeeStructureAdmin(admin.ModelAdmin):
     list_display = ('get_fee_type_display', 'amount')
 
+# Payments and documents of both application paths, listed through their applicant
+class PaymentAdmin(admin.ModelAdmin):
+    list_display = ('tx_ref', 'applicant', 'purpose', 'amount', 'currency', 'amount_usd', 'status', 'created_at')
+    list_filter = ('status', 'purpose')
+    list_select_related = ('applicant',)
+    search_fields = ('tx_ref', 'applicant__username', 'applicant__email')
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
+
+    # A payment changed, moved or removed here must show in the summary of
+    # every application it belonged to
+    def save_model(self, request, obj, form, change):
+        previous = self._owners(form.initial.get('application'), form.initial.get('work_application')) if change else []
+        super().save_model(request, obj, form, change)
+        self._refresh_summaries([*previous, *self._owners(obj.application_id, obj.work_application_id)])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self._refresh_summaries(self._owners(obj.application_id, obj.work_application_id))
+
+    def delete_queryset(self, request, queryset):
+        owners = [
+            owner for application_id, work_application_id in queryset.values_list('application_id', 'work_application_id')
+            for owner in self._owners(application_id, work_application_id)
+        ]
+        super().delete_queryset(request, queryset)
+        self._refresh_summaries(owners)
+
+    @staticmethod
+    def _owners(application_id, work_application_id):
+        return [(model, pk) for model, pk in ((Application, application_id), (WorkApplication, work_application_id)) if pk]
+
+    @staticmethod
+    def _refresh_summaries(owners):
+        for model, pk in set(owners):
+            with transaction.atomic():
+                application = model.objects.filter(pk=pk).first()
+                if application:
+                    refresh_payment_summary(application)
+                    application.save(update_fields=SUMMARY_FIELDS)
+
+class DocumentAdmin(admin.ModelAdmin):
+    list_display = ('document_type', 'applicant', 'is_admin_upload', 'uploaded_at')
+    list_filter = ('is_admin_upload', 'document_type')
+    list_select_related = ('applicant',)
+    search_fields = ('applicant__username', 'applicant__email')
+    date_hierarchy = 'uploaded_at'
+    ordering = ('-uploaded_at',)
+
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('fetched_at', 'base_currency', 'quote_currency', 'rate', 'source')
+    list_filter = ('base_currency', 'quote_currency', 'source')
+    date_hierarchy = 'fetched_at'
+    ordering = ('-fetched_at',)
+
+    # Rates are recorded by the refresh job; the history is read-only here.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # --- Registration ---
 hadey_admin_site.register(Application, ApplicationAdmin)
 hadey_admin_site.register(WorkApplication, WorkApplicationAdmin)
 hadey_admin_site.register(Country, CountryAdmin)
 hadey_admin_site.register(Testimonial)
-hadey_admin_site.register(Document)
-hadey_admin_site.register(Payment)
+hadey_admin_site.register(Document, DocumentAdmin)
+hadey_admin_site.register(Payment, PaymentAdmin)
 hadey_admin_site.register(UserProfile, UserProfileAdmin)
 hadey_admin_site.register(FeeStructure, FeeStructureAdmin) # ADDED THIS LINE
+hadey_admin_site.register(ExchangeRate, ExchangeRateAdmin)
 
 
 # Re-register User to our custom site, unregistering the base one first
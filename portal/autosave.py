@@ -0,0 +1,62 @@
+# portal/autosave.py
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from .middleware import Applicant
+
+# JSON values a form field can be cleaned from; objects and arrays are refused.
+AUTOSAVE_VALUE_TYPES = (str, bool, int, float, type(None))
+
+
+def autosave_fields(form):
+    """Names of the form's fields that map onto model columns, i.e. everything but the uploads."""
+    model = form._meta.model
+    names = set()
+    for name in form.fields:
+        try:
+            model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        names.add(name)
+    return names
+
+
+def apply_changes(form_class, application, changes):
+    """
+    Validate only the changed fields of an application form and write the
+    valid ones with save(update_fields=...). Drafts may leave fields empty:
+    required fields are enforced by the full form save that precedes payment.
+    Returns (saved field names, errors by field).
+    """
+    # Unbound and without an instance, so the deferred columns of the
+    # application aren't loaded just to build the form
+    form = form_class()
+    allowed = autosave_fields(form)
+
+    errors = {name: ['This field cannot be autosaved.'] for name in changes if name not in allowed}
+    cleaned = {}
+    for name, value in changes.items():
+        if name in errors:
+            continue
+        if not isinstance(value, AUTOSAVE_VALUE_TYPES):
+            errors[name] = ['Invalid value.']
+            continue
+        field = form.fields[name]
+        field.required = False
+        try:
+            cleaned[name] = field.clean(value)
+        except ValidationError as e:
+            errors[name] = e.messages
+        except (AttributeError, TypeError):
+            # e.g. a number for a date field, whose parsing expects a string
+            errors[name] = ['Invalid value.']
+
+    # Nothing to write, so no application row is inserted either
+    if not cleaned:
+        return [], errors
+    if application.pk is None:
+        # Inserted first, so a row a parallel request just created is updated instead
+        Applicant.save_if_new(application)
+    for name, value in cleaned.items():
+        application._meta.get_field(name).save_form_data(application, value)
+    application.save(update_fields=[*cleaned, 'updated_at'])
+    return sorted(cleaned), errors
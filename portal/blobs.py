@@ -0,0 +1,70 @@
+# portal/blobs.py
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Application, Document, StoredBlob, WorkApplication
+from .storage import blob_storage, is_content_addressed
+
+# File fields kept in blob_storage, by model.
+BLOB_FIELDS = {
+    Document: ['file'],
+    Application: ['passport_photograph'],
+    WorkApplication: ['passport_photograph'],
+}
+
+
+def _stored_name(instance, field_name):
+    # Read from __dict__ so a name loaded from the database isn't wrapped in a FieldFile
+    value = instance.__dict__.get(field_name)
+    return getattr(value, 'name', value) or ''
+
+
+def remember_blob_names(instance):
+    """Note the stored names of the instance's loaded blob fields, to spot replaced files on save."""
+    instance._blob_names = {
+        field_name: _stored_name(instance, field_name)
+        for field_name in BLOB_FIELDS[type(instance)] if field_name in instance.__dict__
+    }
+
+
+def update_blob_references(instance, update_fields=None):
+    """After a save: count a reference to each new blob and drop the one to each replaced blob."""
+    old_names = getattr(instance, '_blob_names', {})
+    for field_name in BLOB_FIELDS[type(instance)]:
+        if update_fields is not None and field_name not in update_fields:
+            continue
+        name = _stored_name(instance, field_name)
+        old_name = old_names.get(field_name, '')
+        if name != old_name:
+            add_reference(name, 1)
+            add_reference(old_name, -1)
+    remember_blob_names(instance)
+
+
+def release_blob_references(instance):
+    """After a delete: drop the references of its blob fields."""
+    for field_name in BLOB_FIELDS[type(instance)]:
+        add_reference(_stored_name(instance, field_name), -1)
+
+
+def add_reference(name, delta):
+    """
+    Change the reference count of a stored blob by delta, registering it on
+    its first reference. Names saved before content-addressed storage are
+    not counted.
+    """
+    if not is_content_addressed(name):
+        return
+    blobs = StoredBlob.objects.filter(name=name)
+    if delta < 0:
+        blobs.filter(ref_count__gt=0).update(ref_count=F('ref_count') + delta, updated_at=timezone.now())
+        return
+    if blobs.update(ref_count=F('ref_count') + delta, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            StoredBlob.objects.create(name=name, size=blob_storage().size(name), ref_count=delta)
+    except IntegrityError:
+        # Registered by a concurrent save of the same content
+        blobs.update(ref_count=F('ref_count') + delta, updated_at=timezone.now())
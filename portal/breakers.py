@@ -0,0 +1,127 @@
+# portal/breakers.py
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Guards calls to an external dependency in this worker process.
+
+    After `failure_threshold` consecutive failures the circuit trips open and
+    every call fails fast with CircuitOpenError for `reset_timeout` seconds.
+    The next call after that is let through as a trial (half-open), and the
+    others keep failing fast until it finishes: success closes the circuit
+    again, failure re-opens it.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold, reset_timeout, is_failure=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # Decides whether an exception means the dependency is unhealthy.
+        self.is_failure = is_failure or (lambda exc: True)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def _allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            elif self.state == self.CLOSED:
+                return True
+            # Half-open lets a single trial call through at a time
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def _record_success(self):
+        with self._lock:
+            self._trial_in_flight = False
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.state = self.CLOSED
+
+    def _record_failure(self):
+        with self._lock:
+            self._trial_in_flight = False
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    logger.warning(f"Circuit '{self.name}' opened after {self.consecutive_failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        if not self._allow():
+            raise CircuitOpenError(f"Circuit '{self.name}' is open")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as exc:
+            if self.is_failure(exc):
+                self._record_failure()
+            else:
+                self._record_success()
+            raise
+        self._record_success()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'trips': self.trips,
+                'successes': self.successes,
+                'failures': self.failures,
+                'rejected': self.rejected,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, is_failure=None):
+    """Return the named breaker of this process, creating it on first use."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name,
+                    failure_threshold=getattr(settings, 'CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5),
+                    reset_timeout=getattr(settings, 'CIRCUIT_BREAKER_RESET_TIMEOUT', 30),
+                    is_failure=is_failure,
+                )
+                _breakers[name] = breaker
+    return breaker
+
+
+def breaker_metrics():
+    """State and counters of every breaker created in this process."""
+    return {name: breaker.stats() for name, breaker in sorted(_breakers.items())}
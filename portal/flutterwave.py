@@ -0,0 +1,106 @@
+# portal/flutterwave.py
+
+import threading
+import time
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from .breakers import get_breaker
+
+
+class FlutterwaveError(Exception):
+    """Raised when Flutterwave answers but does not report success."""
+
+
+def is_outage_error(exc):
+    """
+    True if an exception means Flutterwave itself is unhealthy (network
+    failure, timeout or 5xx), as opposed to a rejected request such as an
+    unknown transaction id.
+    """
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is None or exc.response.status_code >= 500
+    return isinstance(exc, requests.RequestException)
+
+
+class FlutterwaveClient:
+    """
+    A thin client for the Flutterwave v3 API.
+
+    All calls share one pooled keep-alive requests.Session, use bounded
+    connect/read timeouts, verify TLS and retry network errors and 429/5xx
+    answers with exponential backoff. Each endpoint sits behind its own
+    circuit breaker, and every attempt is a separate breaker call, so an open
+    circuit stops the retries too. A call, retries and backoff included, is
+    cut short after FLUTTERWAVE_TOTAL_TIMEOUT seconds. Point FLUTTERWAVE_BASE_URL
+    at the local stub (`python manage.py flutterwave_stub`) to work offline.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, secret_key=None, base_url=None):
+        self.secret_key = secret_key or settings.FLUTTERWAVE_SECRET_KEY
+        self.base_url = (base_url or settings.FLUTTERWAVE_BASE_URL).rstrip('/')
+        self.timeout = (settings.FLUTTERWAVE_CONNECT_TIMEOUT, settings.FLUTTERWAVE_READ_TIMEOUT)
+        self.total_timeout = settings.FLUTTERWAVE_TOTAL_TIMEOUT
+        self.max_retries = settings.FLUTTERWAVE_MAX_RETRIES
+        self.retry_backoff = settings.FLUTTERWAVE_RETRY_BACKOFF
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.FLUTTERWAVE_POOL_MAXSIZE)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Authorization': f"Bearer {self.secret_key}"})
+
+    def _request(self, path, params, deadline):
+        # Neither timeout may run past what is left of the call's time budget
+        remaining = max(deadline - time.monotonic(), 0.001)
+        timeout = tuple(min(limit, remaining) for limit in self.timeout)
+        response = self.session.get(f"{self.base_url}/{path.lstrip('/')}", params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _is_retryable(self, exc):
+        if isinstance(exc, requests.HTTPError):
+            return exc.response is not None and exc.response.status_code in self.RETRY_STATUSES
+        return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+    def _get(self, path, params=None, breaker='flutterwave'):
+        breaker = get_breaker(breaker, is_failure=is_outage_error)
+        deadline = time.monotonic() + self.total_timeout
+        for attempt in range(self.max_retries + 1):
+            try:
+                data = breaker.call(self._request, path, params, deadline)
+                break
+            except requests.RequestException as exc:
+                delay = self.retry_backoff * 2 ** attempt
+                if attempt == self.max_retries or not self._is_retryable(exc) or time.monotonic() + delay >= deadline:
+                    raise
+                time.sleep(delay)
+        if data.get('status') != 'success':
+            raise FlutterwaveError(data.get('message') or f"Flutterwave returned status {data.get('status')!r}")
+        return data
+
+    def get_rate(self, source='USD', destination='NGN', amount=1):
+        """Return how many `destination` units one `source` unit buys."""
+        data = self._get('rates', params={'from': source, 'to': destination, 'amount': str(amount)}, breaker='flutterwave_rates')
+        return Decimal(str(data['data']['to']['rate']))
+
+    def verify_transaction(self, transaction_id):
+        """Return the verified transaction payload (the `data` object)."""
+        return self._get(f"transactions/{transaction_id}/verify", breaker='flutterwave_verify').get('data', {})
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_flutterwave_client():
+    """Return the process-wide FlutterwaveClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = FlutterwaveClient()
+    return _client
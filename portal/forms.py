@@ -2,7 +2,8 @@
 
 from django import forms
 from allauth.account.forms import SignupForm
-from .models import Application, Document, Testimonial, UserProfile, WorkApplication, Country
+from .models import Application, Document, Testimonial, UserProfile, WorkApplication
+from .reference import get_reference_data
 
 class CustomSignupForm(SignupForm):
     """
@@ -24,7 +25,7 @@ class StudentApplicationForm(forms.ModelForm):
     class Meta:
         model = Application
         exclude = ['user', 'status', 'visa_status', 'passport_photograph',
-            'custom_application_fee', 'custom_admission_fee', 'custom_agency_fee']
+            'custom_application_fee', 'custom_admission_fee', 'custom_agency_fee', 'country_of_interest_legacy']
         widgets = {
             'date_of_birth': forms.DateInput(attrs={'type': 'date'}),
             'passport_issue_date': forms.DateInput(attrs={'type': 'date'}),
@@ -41,6 +42,8 @@ class StudentApplicationForm(forms.ModelForm):
         for field_name, field in self.fields.items():
             if 'upload' not in field_name and not isinstance(field.widget, forms.CheckboxInput):
                 field.widget.attrs.update({'class': base_classes})
+        # Render the options from the in-memory snapshot instead of querying Country
+        self.fields['country_of_interest'].choices = get_reference_data().country_choices()
         
         # CORRECTED: Explicitly set which fields are required, overriding the model
         optional_fields = [
@@ -76,7 +79,8 @@ class WorkApplicationForm(forms.ModelForm):
         for field_name, field in self.fields.items():
             if 'upload' not in field_name and not isinstance(field.widget, forms.CheckboxInput):
                 field.widget.attrs.update({'class': base_classes})
-        self.fields['destination_country'].queryset = Country.objects.all()
+        # Render the options from the in-memory snapshot instead of querying Country
+        self.fields['destination_country'].choices = get_reference_data().country_choices()
         self.fields['destination_country'].widget.attrs.update({'class': base_classes})
 
         optional_fields = [
@@ -0,0 +1,76 @@
+# portal/inventory.py
+
+from django.utils.functional import cached_property
+from .models import Application, Document
+
+DocumentType = Document.DocumentType
+
+# Upload fields of the application forms and the document type each one stores.
+STUDENT_DOCUMENT_UPLOADS = {
+    'international_passport_upload': DocumentType.INTERNATIONAL_PASSPORT,
+    'school_certificate_upload': DocumentType.SCHOOL_CERTIFICATE,
+    'birth_certificate_upload': DocumentType.BIRTH_CERTIFICATE,
+}
+WORK_DOCUMENT_UPLOADS = {
+    'international_passport_upload': DocumentType.INTERNATIONAL_PASSPORT,
+    'educational_certificate_upload': DocumentType.SCHOOL_CERTIFICATE,
+    'work_experience_upload': DocumentType.WORK_EXPERIENCE_LETTER,
+}
+
+# Upload fields that must be filled (now or earlier) before paying the application fee.
+STUDENT_REQUIRED_UPLOADS = {
+    'international_passport_upload': 'International passport is required to proceed.',
+    'school_certificate_upload': 'School certificate is required to proceed.',
+    'birth_certificate_upload': 'Birth certificate is required to proceed.',
+}
+WORK_REQUIRED_UPLOADS = {
+    'international_passport_upload': 'International passport is required to proceed.',
+}
+
+
+class DocumentInventory:
+    """
+    The documents of one student or work application, fetched with a single
+    query the first time they are needed and keyed by document type. Views
+    use it both to validate required uploads and for the template context,
+    so the number of document queries doesn't grow with the required types.
+    """
+    def __init__(self, application):
+        self.application = application
+        self.is_student = isinstance(application, Application)
+
+    @cached_property
+    def documents(self):
+        # An application that hasn't been saved yet has no documents
+        if self.application.pk is None:
+            return []
+        owner = 'application' if self.is_student else 'work_application'
+        return list(Document.objects.filter(**{owner: self.application}).order_by('uploaded_at', 'pk'))
+
+    @cached_property
+    def by_type(self):
+        """Latest document of each type, as used by the templates' existing_docs."""
+        return {doc.document_type: doc for doc in self.documents}
+
+    def has(self, document_type):
+        return document_type in self.by_type
+
+    def latest(self, document_type, is_admin_upload=None):
+        """Most recent document of a type, optionally only admin (or only applicant) uploads."""
+        for doc in reversed(self.documents):
+            if doc.document_type != document_type:
+                continue
+            if is_admin_upload is None or doc.is_admin_upload == is_admin_upload:
+                return doc
+        return None
+
+    def missing_uploads(self, required, files):
+        """
+        (field name, error message) for each required upload that has neither
+        been stored before nor been sent with this request.
+        """
+        uploads = STUDENT_DOCUMENT_UPLOADS if self.is_student else WORK_DOCUMENT_UPLOADS
+        return [
+            (field_name, message) for field_name, message in required.items()
+            if not self.has(uploads[field_name]) and field_name not in files
+        ]
@@ -0,0 +1,210 @@
+# portal/ledger.py
+
+from decimal import Decimal
+
+from django.db.models import Count, Max, Sum
+from .models import Application, Payment, WorkApplication
+from .pricing import price_for_purpose
+
+Purpose = Payment.PaymentPurpose
+
+# Share of the agency fee (students) or destination country processing fee
+# (workers) that one payment of each purpose covers.
+FEE_SHARES = {
+    Purpose.AGENCY_FEE_FULL: Decimal('1.00'),
+    Purpose.AGENCY_FEE_HALF: Decimal('0.50'),
+    Purpose.WORK_VISA_50_PERCENT: Decimal('0.50'),
+    Purpose.WORK_VISA_FINAL_50_PERCENT: Decimal('0.50'),
+    Purpose.WORK_VISA_25_PERCENT: Decimal('0.25'),
+    Purpose.WORK_VISA_REMAINING_25_PERCENT: Decimal('0.25'),
+}
+
+# The application step each payment unlocks.
+STUDENT_STATUS_AFTER = {
+    Purpose.STUDENT_APP_FEE: Application.ApplicationStatus.STEP_2_ADMISSION_FEE,
+    Purpose.ADMISSION_FEE: Application.ApplicationStatus.STEP_3_AGENCY_FEE,
+    Purpose.AGENCY_FEE_FULL: Application.ApplicationStatus.STEP_4_VISA_APPLICATION,
+    Purpose.AGENCY_FEE_HALF: Application.ApplicationStatus.STEP_4_VISA_APPLICATION,
+}
+WORK_STATUS_AFTER = {
+    Purpose.WORK_APP_FEE: WorkApplication.WorkApplicationStatus.STEP_2_EMPLOYMENT_FORM,
+    Purpose.WORK_VISA_50_PERCENT: WorkApplication.WorkApplicationStatus.STEP_3_JOB_OFFER,
+    Purpose.WORK_VISA_FINAL_50_PERCENT: WorkApplication.WorkApplicationStatus.STEP_4_VISA_APPLICATION,
+    Purpose.WORK_VISA_25_PERCENT: WorkApplication.WorkApplicationStatus.STEP_4_VISA_APPLICATION,
+    Purpose.WORK_VISA_REMAINING_25_PERCENT: WorkApplication.WorkApplicationStatus.STEP_4_VISA_APPLICATION,
+}
+
+# Denormalised payment columns on Application and WorkApplication.
+SUMMARY_FIELDS = ['total_paid_usd', 'paid_purposes', 'last_payment_at']
+
+
+class PaymentLedger:
+    """
+    The successful payments of one student or work application, loaded with a
+    single grouped query. Every "has this been paid?" question a step view or
+    the webhook asks is then answered in memory.
+    """
+    def __init__(self, application):
+        self.application = application
+        self.is_student = isinstance(application, Application)
+        self._counts = {}
+        self._totals_usd = {}
+        self._last_paid_at = {}
+        # An application that hasn't been saved yet has no payments
+        if application.pk is not None:
+            owner = 'application' if self.is_student else 'work_application'
+            rows = (
+                Payment.objects
+                .filter(**{owner: application}, status=Payment.PaymentStatus.SUCCESSFUL)
+                .values('purpose')
+                .annotate(count=Count('id'), total_usd=Sum('amount_usd'), last_paid_at=Max('updated_at'))
+                .order_by()
+            )
+            for row in rows:
+                self._counts[row['purpose']] = row['count']
+                self._totals_usd[row['purpose']] = row['total_usd'] or Decimal('0.00')
+                self._last_paid_at[row['purpose']] = row['last_paid_at']
+
+    def count(self, *purposes):
+        """How many successful payments were made for any of the purposes."""
+        return sum(self._counts.get(purpose, 0) for purpose in purposes)
+
+    def is_paid(self, *purposes):
+        return self.count(*purposes) > 0
+
+    def total_paid_usd(self):
+        """USD paid so far. Payments made before amount_usd was recorded count as 0."""
+        return sum(self._totals_usd.values(), Decimal('0.00'))
+
+    def paid_mask(self):
+        """Bitmask of the purposes paid at least once, see Payment.PURPOSE_BITS."""
+        mask = 0
+        for purpose in self._counts:
+            # Purposes retired from PaymentPurpose have no bit
+            mask |= Payment.PURPOSE_BITS.get(purpose, 0)
+        return mask
+
+    def last_paid_at(self):
+        return max(self._last_paid_at.values(), default=None)
+
+    def share_paid(self):
+        """Share (0 to 1) of the agency fee or country processing fee paid so far."""
+        paid = sum(share * self.count(purpose) for purpose, share in FEE_SHARES.items())
+        return min(paid, Decimal('1.00'))
+
+    def agency_fee_status(self):
+        """'full_paid', 'half_paid' or 'none' for the student agency fee."""
+        if self.is_paid(Purpose.AGENCY_FEE_FULL) or self.count(Purpose.AGENCY_FEE_HALF) >= 2:
+            return 'full_paid'
+        if self.count(Purpose.AGENCY_FEE_HALF) == 1:
+            return 'half_paid'
+        return 'none'
+
+    def job_offer_status(self):
+        """'full_paid', 'half_paid' or 'none' for the worker processing fee."""
+        if self.is_paid(Purpose.WORK_VISA_FINAL_50_PERCENT) or self.count(Purpose.WORK_VISA_25_PERCENT) >= 2:
+            return 'full_paid'
+        if self.is_paid(Purpose.WORK_VISA_50_PERCENT):
+            return 'half_paid'
+        return 'none'
+
+    def next_payable_purpose(self):
+        """The next payment the applicant should make, or None when fully paid."""
+        if self.is_student:
+            if not self.is_paid(Purpose.STUDENT_APP_FEE):
+                return Purpose.STUDENT_APP_FEE
+            if not self.is_paid(Purpose.ADMISSION_FEE):
+                return Purpose.ADMISSION_FEE
+            share = self.share_paid()
+            if share == 0:
+                return Purpose.AGENCY_FEE_FULL
+            return Purpose.AGENCY_FEE_HALF if share < 1 else None
+        if not self.is_paid(Purpose.WORK_APP_FEE):
+            return Purpose.WORK_APP_FEE
+        share = self.share_paid()
+        if share == 0:
+            return Purpose.WORK_VISA_50_PERCENT
+        if share == Decimal('0.50'):
+            return Purpose.WORK_VISA_FINAL_50_PERCENT
+        if share < 1:
+            return Purpose.WORK_VISA_REMAINING_25_PERCENT
+        return None
+
+    def amount_outstanding(self):
+        """
+        USD still to be paid across the whole path, at current fees. Work
+        processing fees are only counted once a destination country is chosen.
+        """
+        if self.is_student:
+            one_off = [Purpose.STUDENT_APP_FEE, Purpose.ADMISSION_FEE]
+            shared_fee = price_for_purpose(Purpose.AGENCY_FEE_FULL, self.application)
+        else:
+            one_off = [Purpose.WORK_APP_FEE]
+            country_half = price_for_purpose(Purpose.WORK_VISA_50_PERCENT, self.application)
+            shared_fee = {'usd': country_half['usd'] * 2} if country_half else None
+        outstanding = sum(
+            (price_for_purpose(purpose, self.application)['usd'] for purpose in one_off if not self.is_paid(purpose)),
+            Decimal('0.00'),
+        )
+        if shared_fee:
+            outstanding += (shared_fee['usd'] * (1 - self.share_paid())).quantize(Decimal('0.01'))
+        return outstanding
+
+    def _status_order(self):
+        statuses = Application.ApplicationStatus if self.is_student else WorkApplication.WorkApplicationStatus
+        return list(statuses.values)
+
+    def unlocked_status(self):
+        """The furthest application step unlocked by the payments made so far, or None."""
+        status_after = STUDENT_STATUS_AFTER if self.is_student else WORK_STATUS_AFTER
+        unlocked = [status for purpose, status in status_after.items() if self.is_paid(purpose)]
+        return max(unlocked, key=self._status_order().index) if unlocked else None
+
+    def advance_status(self):
+        """
+        Move the application forward to the step its payments unlock. It is
+        never moved backwards, e.g. out of COMPLETED by a late webhook.
+        Returns True if the status changed.
+        """
+        order = self._status_order()
+        unlocked = self.unlocked_status()
+        if unlocked is None:
+            return False
+        if self.application.status in order and order.index(unlocked) <= order.index(self.application.status):
+            return False
+        self.application.status = unlocked
+        return True
+
+
+def refresh_payment_summary(application):
+    """
+    Recompute the application's payment summary columns (total_paid_usd,
+    paid_purposes, last_payment_at) from its successful payments. Must run
+    inside transaction.atomic(): the application row is locked first so two
+    payments settling at once can't overwrite each other's summary. The
+    caller saves the application. Returns the ledger it was computed from.
+    """
+    type(application).objects.select_for_update().filter(pk=application.pk).exists()
+    ledger = PaymentLedger(application)
+    application.total_paid_usd = ledger.total_paid_usd()
+    application.paid_purposes = ledger.paid_mask()
+    application.last_payment_at = ledger.last_paid_at()
+    return ledger
+
+
+def matching_masks(purposes, paid=(), unpaid=()):
+    """
+    Every paid_purposes value, over the given purposes' bits, that has all of
+    `paid` and none of `unpaid`. Filtering with paid_purposes__in on this list
+    lets the database use the paid_purposes index instead of evaluating a
+    bitwise expression on every row.
+    """
+    bits = [Payment.PURPOSE_BITS[purpose] for purpose in purposes]
+    required = sum(Payment.PURPOSE_BITS[purpose] for purpose in paid)
+    excluded = sum(Payment.PURPOSE_BITS[purpose] for purpose in unpaid)
+    masks = []
+    for subset in range(1 << len(bits)):
+        mask = sum(bit for index, bit in enumerate(bits) if subset & (1 << index))
+        if mask & required == required and not mask & excluded:
+            masks.append(mask)
+    return masks
@@ -0,0 +1,25 @@
+# portal/management/commands/clear_upload_sessions.py
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from portal.models import UploadSession
+from portal.uploads import discard_session
+
+
+class Command(BaseCommand):
+    help = (
+        "Removes resumable uploads that received no chunk for UPLOAD_SESSION_TTL "
+        "seconds, along with their part files in CHUNKED_UPLOAD_DIR. Schedule it "
+        "with cron, e.g. hourly: 0 * * * * python manage.py clear_upload_sessions"
+    )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+        cleared = 0
+        for session in UploadSession.objects.filter(updated_at__lt=cutoff).order_by('updated_at').iterator():
+            discard_session(session)
+            cleared += 1
+        self.stdout.write(self.style.SUCCESS(f"Cleared {cleared} abandoned upload(s)."))
@@ -0,0 +1,57 @@
+# portal/management/commands/collect_media_garbage.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from portal.media_gc import MediaGarbageCollector
+
+
+class Command(BaseCommand):
+    help = (
+        "Finds media files no FileField refers to any more and, with --delete or "
+        "--quarantine, removes them; without either it only reports. Files modified "
+        "within the grace period (MEDIA_GC_GRACE_PERIOD) are kept. Schedule it with "
+        "cron, e.g. nightly: 30 3 * * * python manage.py collect_media_garbage --quarantine"
+    )
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument('--delete', action='store_const', const='delete', dest='action', help="Delete orphaned files.")
+        action.add_argument(
+            '--quarantine', action='store_const', const='quarantine', dest='action',
+            help="Move orphaned files to MEDIA_QUARANTINE_DIR."
+        )
+        parser.add_argument(
+            '--grace-hours', type=float, default=settings.MEDIA_GC_GRACE_PERIOD / 3600,
+            help="Keep files modified within this many hours (default: MEDIA_GC_GRACE_PERIOD)."
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help="Files listed and checked per batch.")
+
+    def handle(self, *args, **options):
+        if options['grace_hours'] < 0 or options['batch_size'] < 1:
+            raise CommandError("--grace-hours must be 0 or more and --batch-size at least 1.")
+        verbosity = options['verbosity']
+        collector = MediaGarbageCollector(
+            grace_period=options['grace_hours'] * 3600,
+            batch_size=options['batch_size'],
+            action=options['action'],
+            quarantine_dir=settings.MEDIA_QUARANTINE_DIR,
+            log=self.stdout.write if verbosity > 1 else None,
+        )
+        try:
+            collector.run()
+        except NotImplementedError:
+            # Storage without local paths, e.g. an object store
+            raise CommandError("--quarantine needs a storage with local file paths; use --delete instead.")
+
+        megabytes = collector.reclaimed_bytes / (1024 * 1024)
+        self.stdout.write(
+            f"Scanned {collector.scanned} file(s), {collector.scanned_bytes} bytes; "
+            f"{collector.in_grace} unreferenced file(s) within the grace period kept."
+        )
+        if options['action'] == 'delete':
+            summary = f"Deleted {collector.orphans} orphaned file(s), reclaiming {megabytes:.1f} MB."
+        elif options['action'] == 'quarantine':
+            summary = f"Quarantined {collector.orphans} orphaned file(s), reclaiming {megabytes:.1f} MB."
+        else:
+            summary = f"Found {collector.orphans} orphaned file(s), {megabytes:.1f} MB. Run with --delete or --quarantine to remove them."
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,79 @@
+# portal/management/commands/flutterwave_stub.py
+
+import json
+import re
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from portal.models import Payment
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a local stand-in for the Flutterwave v3 API so the rate and payment "
+        "verification paths can be tested and benchmarked offline. Start it, then set "
+        "FLUTTERWAVE_BASE_URL=http://127.0.0.1:8009/v3. The transaction id passed to "
+        "/transactions/<id>/verify is treated as the tx_ref of a stored Payment."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8009)
+        parser.add_argument('--rate', default='1500.00', help="USD to NGN rate to report.")
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds to wait before every response.")
+
+    def handle(self, *args, **options):
+        rate = Decimal(options['rate'])
+        latency = options['latency']
+        stdout = self.stdout
+
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if latency:
+                    time.sleep(latency)
+                path = urlparse(self.path).path
+                if path.rstrip('/').endswith('/rates'):
+                    self._send(200, {
+                        'status': 'success', 'message': 'Transfer amount fetched',
+                        'data': {'rate': float(rate), 'from': {'currency': 'USD', 'amount': 1}, 'to': {'currency': 'NGN', 'amount': float(rate), 'rate': float(rate)}},
+                    })
+                    return
+                match = re.search(r'/transactions/([^/]+)/verify/?$', path)
+                if match:
+                    self._send(*self._verify(match.group(1)))
+                    return
+                self._send(404, {'status': 'error', 'message': 'Not found'})
+
+            def _verify(self, transaction_id):
+                close_old_connections()
+                payment = Payment.objects.filter(tx_ref=transaction_id).first()
+                if payment is None:
+                    return 404, {'status': 'error', 'message': 'No transaction was found for this id'}
+                return 200, {
+                    'status': 'success', 'message': 'Transaction fetched successfully',
+                    'data': {'id': transaction_id, 'tx_ref': payment.tx_ref, 'amount': float(payment.amount), 'status': 'successful'},
+                }
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                stdout.write(f"[flutterwave-stub] {format % args}")
+
+        server = ThreadingHTTPServer((options['host'], options['port']), StubHandler)
+        self.stdout.write(self.style.SUCCESS(f"Flutterwave stub listening on http://{options['host']}:{options['port']}/v3"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
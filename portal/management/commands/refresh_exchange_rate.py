@@ -0,0 +1,18 @@
+# portal/management/commands/refresh_exchange_rate.py
+
+from django.core.management.base import BaseCommand, CommandError
+from portal.rates import refresh_usd_to_ngn_rate
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetches the current USD to NGN rate from Flutterwave, records it in the "
+        "ExchangeRate history and refreshes the rate cache. Schedule it with cron, "
+        "e.g. every 15 minutes: */15 * * * * python manage.py refresh_exchange_rate"
+    )
+
+    def handle(self, *args, **options):
+        rate = refresh_usd_to_ngn_rate()
+        if rate is None:
+            raise CommandError("Could not fetch the exchange rate; the last stored rate is still in use.")
+        self.stdout.write(self.style.SUCCESS(f"Recorded exchange rate: 1 USD = {rate} NGN"))
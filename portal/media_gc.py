@@ -0,0 +1,136 @@
+# portal/media_gc.py
+
+import os
+import posixpath
+import shutil
+from datetime import timedelta
+
+from django.apps import apps
+from django.db.models import FileField
+from django.utils import timezone
+from .models import StoredBlob
+
+
+def file_fields():
+    """(model, field) for every FileField and ImageField of the installed apps."""
+    return [
+        (model, field)
+        for model in apps.get_models()
+        for field in model._meta.get_fields()
+        if isinstance(field, FileField)
+    ]
+
+
+def media_directories(fields):
+    """(storage, directory) pairs holding the fields' files, from their upload_to."""
+    directories = {}
+    for model, field in fields:
+        # A callable upload_to can put files anywhere; those directories aren't scanned
+        if not isinstance(field.upload_to, str):
+            continue
+        directory = field.upload_to.split('/', 1)[0]
+        directories[(id(field.storage), directory)] = (field.storage, directory)
+    return list(directories.values())
+
+
+def walk(storage, directory):
+    """Names of all files below a storage directory, depth first."""
+    try:
+        subdirectories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in sorted(files):
+        yield posixpath.join(directory, name)
+    for subdirectory in sorted(subdirectories):
+        yield from walk(storage, posixpath.join(directory, subdirectory))
+
+
+def referenced_names(fields, names=None, batch_size=2000):
+    """
+    The stored names the fields refer to, read batch_size rows at a time.
+    Limited to `names` when given, to re-check a batch of candidates.
+    """
+    referenced = set()
+    for model, field in fields:
+        queryset = model._base_manager.exclude(**{field.attname: ''}).exclude(**{f'{field.attname}__isnull': True})
+        if names is not None:
+            queryset = queryset.filter(**{f'{field.attname}__in': names})
+        referenced.update(queryset.values_list(field.attname, flat=True).iterator(chunk_size=batch_size))
+    return referenced
+
+
+class MediaGarbageCollector:
+    """
+    Finds files in media storage that no FileField refers to any more:
+    replaced documents and photographs, and files of deleted applications.
+
+    The storage listing is walked in batches and diffed against a snapshot of
+    the referenced names. Files modified within the grace period are kept, so
+    uploads not yet saved to their record (and blobs just reused by a
+    deduplicated upload) are never taken. Each batch's candidates are checked
+    against the database again right before they are removed.
+    """
+    def __init__(self, grace_period, batch_size=500, action=None, quarantine_dir=None, log=None):
+        self.grace_period = grace_period
+        self.batch_size = batch_size
+        self.action = action  # None (report only), 'delete' or 'quarantine'
+        self.quarantine_dir = quarantine_dir
+        self.log = log or (lambda message: None)
+        self.scanned = self.scanned_bytes = 0
+        self.orphans = self.reclaimed_bytes = 0
+        self.in_grace = 0
+
+    def run(self):
+        fields = file_fields()
+        self.cutoff = timezone.now() - timedelta(seconds=self.grace_period)
+        referenced = referenced_names(fields)
+        for storage, directory in media_directories(fields):
+            batch = []
+            for name in walk(storage, directory):
+                batch.append(name)
+                if len(batch) >= self.batch_size:
+                    self._collect_batch(storage, batch, referenced, fields)
+                    batch = []
+            if batch:
+                self._collect_batch(storage, batch, referenced, fields)
+
+    def _collect_batch(self, storage, names, referenced, fields):
+        candidates = []
+        for name in names:
+            size = storage.size(name)
+            self.scanned += 1
+            self.scanned_bytes += size
+            if name in referenced:
+                continue
+            if storage.get_modified_time(name) > self.cutoff:
+                self.in_grace += 1
+                continue
+            candidates.append((name, size))
+        if not candidates:
+            return
+
+        # Referenced since the snapshot was taken
+        still_referenced = referenced_names(fields, [name for name, _ in candidates])
+        collected = []
+        for name, size in candidates:
+            if name in still_referenced:
+                continue
+            if self.action and storage.get_modified_time(name) > self.cutoff:
+                self.in_grace += 1
+                continue
+            self.orphans += 1
+            self.reclaimed_bytes += size
+            self.log(f"{name} ({size} bytes)")
+            if self.action == 'delete':
+                storage.delete(name)
+            elif self.action == 'quarantine':
+                self._quarantine(storage, name)
+            collected.append(name)
+        if self.action and collected:
+            StoredBlob.objects.filter(name__in=collected).delete()
+
+    def _quarantine(self, storage, name):
+        # Moved out of MEDIA_ROOT with its relative path, so it is no longer served but can be restored
+        target = os.path.join(self.quarantine_dir, *name.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(storage.path(name), target)
@@ -0,0 +1,123 @@
+# portal/middleware.py
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.utils.functional import SimpleLazyObject
+from .models import Application, UserProfile, WorkApplication, profile_fields
+
+
+def full_application(view_func):
+    """
+    Mark a view that reads the whole application (e.g. to render its form).
+    Other views get request.applicant with the profile columns deferred.
+    """
+    view_func.full_application = True
+    return view_func
+
+
+def _related(obj, name):
+    """Return a reverse one-to-one relation already loaded by select_related, or None."""
+    try:
+        return getattr(obj, name)
+    except ObjectDoesNotExist:
+        return None
+
+
+class Applicant:
+    """
+    The logged-in user with their profile, student or work application and
+    destination country, loaded together by a single select_related query.
+    Unless full is set, only the applications' WORKFLOW_FIELDS are read.
+    """
+    def __init__(self, user):
+        self.user = user
+        self.profile = _related(user, 'profile')
+        self.student_application = _related(user, 'student_application')
+        self.work_application = _related(user, 'work_application')
+
+    @classmethod
+    def load(cls, user, full=False):
+        queryset = get_user_model().objects.select_related(
+            'profile', 'student_application', 'work_application', 'work_application__destination_country',
+        )
+        if not full:
+            queryset = queryset.defer(
+                *profile_fields(Application, 'student_application__'),
+                *profile_fields(WorkApplication, 'work_application__'),
+            )
+        return cls(queryset.get(pk=user.pk))
+
+    @property
+    def is_student(self):
+        return self.profile is not None and self.profile.account_type == UserProfile.AccountType.STUDENT
+
+    @property
+    def application(self):
+        """The application matching the account type, if it exists."""
+        return self.student_application if self.is_student else self.work_application
+
+    @property
+    def destination_country(self):
+        return self.work_application.destination_country if self.work_application else None
+
+    # Profiles and applications are created at signup. For users without one
+    # these return an unsaved default, so that read paths never write.
+
+    def get_profile(self):
+        if self.profile is None:
+            self.profile = UserProfile(user=self.user)
+        return self.profile
+
+    def get_student_application(self):
+        if self.student_application is None:
+            self.student_application = Application(user=self.user)
+        return self.student_application
+
+    def get_work_application(self):
+        if self.work_application is None:
+            self.work_application = WorkApplication(user=self.user)
+        return self.work_application
+
+    @staticmethod
+    def save_if_new(application):
+        """
+        Insert an unsaved default application, before a POST attaches documents
+        or payments to it. If a parallel request of the same user (e.g. another
+        file upload) inserted it first, the instance is loaded from that row.
+        """
+        if application.pk is None:
+            try:
+                with transaction.atomic():
+                    application.save()
+            except IntegrityError:
+                existing_pk = type(application)._base_manager.filter(user_id=application.user_id).values_list('pk', flat=True).first()
+                if existing_pk is None:
+                    raise
+                application.pk = existing_pk
+                application._state.adding = False
+                application.refresh_from_db()
+        return application
+
+
+class ApplicantMiddleware:
+    """
+    Exposes the logged-in user's Applicant as `request.applicant`. It is
+    loaded lazily, on first access, so requests that don't need it pay nothing.
+    Must come after AuthenticationMiddleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.applicant = SimpleLazyObject(lambda: self._load(request))
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._full_application = getattr(view_func, 'full_application', False)
+
+    @staticmethod
+    def _load(request):
+        if not request.user.is_authenticated:
+            return None
+        return Applicant.load(request.user, full=getattr(request, '_full_application', False))
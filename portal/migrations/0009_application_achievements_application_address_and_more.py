@@ -1,5 +1,6 @@
 # Generated by Django 5.2.4 on 2025-08-14 00:00
 
+import datetime
 from django.db import migrations, models
 
 
@@ -41,7 +42,7 @@ class Migration(migrations.Migration):
         migrations.AddField(
             model_name='application',
             name='date_of_birth',
-            field=models.DateField(default=''),
+            field=models.DateField(default=datetime.date(2000, 1, 1)),
             preserve_default=False,
         ),
         migrations.AddField(
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0020_alter_feestructure_fee_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_currency', models.CharField(default='USD', max_length=3)),
+                ('quote_currency', models.CharField(default='NGN', max_length=3)),
+                ('rate', models.DecimalField(decimal_places=6, max_digits=14)),
+                ('source', models.CharField(default='flutterwave', max_length=50)),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-fetched_at'],
+                'get_latest_by': 'fetched_at',
+                'indexes': [models.Index(fields=['base_currency', 'quote_currency', '-fetched_at'], name='exchangerate_pair_latest_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0021_exchangerate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['application', 'document_type', 'uploaded_at'], name='document_app_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['work_application', 'document_type', 'uploaded_at'], name='document_work_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['application', 'status', 'purpose', 'amount'], name='payment_app_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['work_application', 'status', 'purpose', 'amount'], name='payment_work_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['created_at'], name='payment_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visaupdate',
+            index=models.Index(fields=['application', '-created_at'], name='visaupdate_app_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visaupdate',
+            index=models.Index(fields=['work_application', '-created_at'], name='visaupdate_work_created_idx'),
+        ),
+    ]
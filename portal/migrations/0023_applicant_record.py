@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_applicant(apps, schema_editor):
+    Application = apps.get_model('portal', 'Application')
+    WorkApplication = apps.get_model('portal', 'WorkApplication')
+    for model_name in ('Document', 'Payment', 'Testimonial', 'VisaUpdate'):
+        model = apps.get_model('portal', model_name)
+        model.objects.filter(application__isnull=False).update(
+            applicant=Subquery(Application.objects.filter(pk=OuterRef('application')).values('user')[:1])
+        )
+        model.objects.filter(application__isnull=True, work_application__isnull=False).update(
+            applicant=Subquery(WorkApplication.objects.filter(pk=OuterRef('work_application')).values('user')[:1])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0022_payment_document_visaupdate_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='applicant',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='applicant',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='testimonial',
+            name='applicant',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='visaupdate',
+            name='applicant',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_applicant, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['applicant', 'document_type', 'uploaded_at'], name='document_applicant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_admin_upload', True)), fields=['uploaded_at'], name='document_admin_upload_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['applicant', 'status', 'created_at'], name='payment_applicant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testimonial',
+            index=models.Index(fields=['applicant'], name='testimonial_applicant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visaupdate',
+            index=models.Index(fields=['applicant', '-created_at'], name='visaupdate_applicant_idx'),
+        ),
+    ]
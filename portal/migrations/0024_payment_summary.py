@@ -0,0 +1,206 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:44
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Sum
+
+# Payment.PURPOSE_BITS as of this migration
+PURPOSE_BITS = {
+    'STUDENT_APP_FEE': 1 << 0,
+    'ADMISSION_FEE': 1 << 1,
+    'AGENCY_FEE_FULL': 1 << 2,
+    'AGENCY_FEE_HALF': 1 << 3,
+    'WORK_APP_FEE': 1 << 4,
+    'WORK_VISA_50_PERCENT': 1 << 5,
+    'WORK_VISA_25_PERCENT': 1 << 6,
+    'WORK_VISA_FINAL_50_PERCENT': 1 << 7,
+    'WORK_VISA_REMAINING_25_PERCENT': 1 << 8,
+}
+
+
+# portal/pricing.py's default fees and purpose pricing as of this migration:
+# purpose -> (fee type, or None for the destination country's processing
+# fee; share of it; per-application override field)
+DEFAULT_FEES = {
+    'STUDENT_APP_FEE': Decimal('15.00'),
+    'ADMISSION_FEE': Decimal('1000.00'),
+    'AGENCY_FEE': Decimal('500.00'),
+    'WORK_APP_FEE': Decimal('30.00'),
+}
+PURPOSE_PRICING = {
+    # The student application fee's purpose before 0011 renamed it
+    'APPLICATION_FEE': ('STUDENT_APP_FEE', Decimal('1.00'), 'custom_application_fee'),
+    'STUDENT_APP_FEE': ('STUDENT_APP_FEE', Decimal('1.00'), 'custom_application_fee'),
+    'ADMISSION_FEE': ('ADMISSION_FEE', Decimal('1.00'), 'custom_admission_fee'),
+    'AGENCY_FEE_FULL': ('AGENCY_FEE', Decimal('1.00'), 'custom_agency_fee'),
+    'AGENCY_FEE_HALF': ('AGENCY_FEE', Decimal('0.50'), 'custom_agency_fee'),
+    'WORK_APP_FEE': ('WORK_APP_FEE', Decimal('1.00'), 'custom_application_fee'),
+    'WORK_VISA_50_PERCENT': (None, Decimal('0.50'), None),
+    'WORK_VISA_FINAL_50_PERCENT': (None, Decimal('0.50'), None),
+    'WORK_VISA_25_PERCENT': (None, Decimal('0.25'), None),
+    'WORK_VISA_REMAINING_25_PERCENT': (None, Decimal('0.25'), None),
+}
+# Amounts above this are taken as NGN when a payment's price can't be worked
+# out; no USD fee comes close, and NGN amounts of the smallest fee exceed it.
+NGN_AMOUNT_THRESHOLD = Decimal('20000')
+
+
+def _price_usd(payment, fees):
+    """The USD price of the payment's purpose at today's fees, or None."""
+    if payment.purpose not in PURPOSE_PRICING:
+        return None
+    fee_type, share, override_field = PURPOSE_PRICING[payment.purpose]
+    owner = payment.application or payment.work_application
+    if fee_type is None:
+        country = getattr(owner, 'destination_country', None)
+        fee = country.processing_fee if country else None
+    else:
+        fee = (getattr(owner, override_field, None) if owner else None) or fees.get(fee_type, DEFAULT_FEES[fee_type])
+    return (fee * share).quantize(Decimal('0.01')) if fee else None
+
+
+def backfill_payment_currency(apps):
+    """
+    Payments made before this migration recorded neither the currency they
+    were charged in nor their USD price. An NGN amount is the USD price times
+    the exchange rate, so whichever reading lands nearer the purpose's price
+    is taken; NGN payments are then counted at that price.
+    """
+    Payment = apps.get_model('portal', 'Payment')
+    FeeStructure = apps.get_model('portal', 'FeeStructure')
+    ExchangeRate = apps.get_model('portal', 'ExchangeRate')
+    fees = dict(FeeStructure.objects.values_list('fee_type', 'amount'))
+    latest_rate = ExchangeRate.objects.filter(base_currency='USD', quote_currency='NGN').order_by('-fetched_at').first()
+    rate = latest_rate.rate if latest_rate else Decimal(str(getattr(settings, 'EXCHANGE_RATE_FALLBACK', '1650.00')))
+
+    payments = (
+        Payment.objects.filter(amount_usd__isnull=True)
+        .select_related('application', 'work_application__destination_country')
+    )
+    for payment in payments.iterator():
+        price = _price_usd(payment, fees)
+        as_ngn = (payment.amount / rate).quantize(Decimal('0.01'))
+        if price is not None:
+            is_ngn = abs(as_ngn - price) < abs(payment.amount - price)
+        else:
+            is_ngn = payment.amount > NGN_AMOUNT_THRESHOLD
+        payment.currency = 'NGN' if is_ngn else 'USD'
+        payment.amount_usd = (price or as_ngn) if is_ngn else payment.amount
+        payment.save(update_fields=['currency', 'amount_usd'])
+
+
+def backfill_payment_summary(apps, schema_editor):
+    backfill_payment_currency(apps)
+    Payment = apps.get_model('portal', 'Payment')
+    for owner, model_name in (('application', 'Application'), ('work_application', 'WorkApplication')):
+        model = apps.get_model('portal', model_name)
+        summaries = {}
+        rows = (
+            Payment.objects
+            .filter(**{f'{owner}__isnull': False}, status='SUCCESSFUL')
+            .values(owner, 'purpose')
+            .annotate(total_usd=Sum('amount_usd'), last_paid_at=Max('updated_at'))
+            .order_by()
+        )
+        for row in rows:
+            mask, total_usd, last_paid_at = summaries.get(row[owner], (0, Decimal('0.00'), None))
+            mask |= PURPOSE_BITS.get(row['purpose'], 0)
+            total_usd += row['total_usd'] or Decimal('0.00')
+            last_paid_at = max(filter(None, [last_paid_at, row['last_paid_at']]), default=None)
+            summaries[row[owner]] = (mask, total_usd, last_paid_at)
+        for pk, (mask, total_usd, last_paid_at) in summaries.items():
+            model.objects.filter(pk=pk).update(paid_purposes=mask, total_paid_usd=total_usd, last_payment_at=last_paid_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0023_applicant_record'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payment_app_status_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payment_work_status_idx',
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='last_payment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='paid_purposes',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Bitmask of Payment.PURPOSE_BITS paid at least once.'),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='total_paid_usd',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='amount_usd',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='USD price of the payment, whatever currency it was charged in.', max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='currency',
+            field=models.CharField(blank=True, help_text='Currency of amount. Blank on payments made before it was recorded.', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='workapplication',
+            name='last_payment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='workapplication',
+            name='paid_purposes',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Bitmask of Payment.PURPOSE_BITS paid at least once.'),
+        ),
+        migrations.AddField(
+            model_name='workapplication',
+            name='total_paid_usd',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(backfill_payment_summary, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['paid_purposes'], name='application_paid_purposes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['total_paid_usd'], name='application_total_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['last_payment_at'], name='application_last_payment_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['application', 'status', 'purpose', 'amount_usd', 'updated_at'], name='payment_app_ledger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['work_application', 'status', 'purpose', 'amount_usd', 'updated_at'], name='payment_work_ledger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workapplication',
+            index=models.Index(fields=['paid_purposes'], name='workapp_paid_purposes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workapplication',
+            index=models.Index(fields=['total_paid_usd'], name='workapp_total_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workapplication',
+            index=models.Index(fields=['last_payment_at'], name='workapp_last_payment_idx'),
+        ),
+    ]
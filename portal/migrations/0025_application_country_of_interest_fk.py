@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def map_country_of_interest(apps, schema_editor):
+    # Match the free-text values to the catalogue case-insensitively; values
+    # that match no Country stay in country_of_interest_legacy.
+    Application = apps.get_model('portal', 'Application')
+    Country = apps.get_model('portal', 'Country')
+    countries = {name.strip().lower(): pk for pk, name in Country.objects.values_list('pk', 'name')}
+    legacy_values = (
+        Application.objects
+        .exclude(country_of_interest_legacy__isnull=True)
+        .values_list('country_of_interest_legacy', flat=True)
+        .distinct()
+    )
+    for value in legacy_values:
+        country_id = countries.get(value.strip().lower())
+        if country_id is not None:
+            Application.objects.filter(country_of_interest_legacy=value).update(
+                country_of_interest_id=country_id, country_of_interest_legacy=None,
+            )
+        elif not value.strip():
+            Application.objects.filter(country_of_interest_legacy=value).update(country_of_interest_legacy=None)
+
+
+def unmap_country_of_interest(apps, schema_editor):
+    Application = apps.get_model('portal', 'Application')
+    for application in Application.objects.filter(country_of_interest__isnull=False).select_related('country_of_interest'):
+        application.country_of_interest_legacy = application.country_of_interest.name
+        application.save(update_fields=['country_of_interest_legacy'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0024_payment_summary'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='application',
+            old_name='country_of_interest',
+            new_name='country_of_interest_legacy',
+        ),
+        migrations.AlterField(
+            model_name='application',
+            name='country_of_interest_legacy',
+            field=models.CharField(blank=True, help_text='Free-text country entered before countries came from the catalogue and that matched no Country.', max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='country_of_interest',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='student_applications', to='portal.country'),
+        ),
+        migrations.RunPython(map_country_of_interest, unmap_country_of_interest),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:58
+
+import portal.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0026_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='original_name',
+            field=models.CharField(blank=True, editable=False, help_text='Name of the file as uploaded; the stored name is its content hash.', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='application',
+            name='passport_photograph',
+            field=models.ImageField(blank=True, null=True, storage=portal.storage.blob_storage, upload_to='passport_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='file',
+            field=models.FileField(storage=portal.storage.blob_storage, upload_to='documents/'),
+        ),
+        migrations.AlterField(
+            model_name='workapplication',
+            name='passport_photograph',
+            field=models.ImageField(blank=True, null=True, storage=portal.storage.blob_storage, upload_to='passport_photos/'),
+        ),
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('ref_count', 0)), fields=['updated_at'], name='storedblob_unreferenced_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+def create_version_row(apps, schema_editor):
+    ReferenceDataVersion = apps.get_model('portal', 'ReferenceDataVersion')
+    ReferenceDataVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0027_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenceDataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
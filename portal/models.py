@@ -1,7 +1,12 @@
 # portal/models.py
 
+import os
+import uuid
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+from .storage import blob_storage
 
 class UserProfile(models.Model):
     class AccountType(models.TextChoices):
@@ -26,6 +31,20 @@ class Application(models.Model): # STUDENT Application
         # This sets the display name in the admin panel
         verbose_name = "Student Application"
         verbose_name_plural = "Student Applications"
+        indexes = [
+            models.Index(fields=['paid_purposes'], name='application_paid_purposes_idx'),
+            models.Index(fields=['total_paid_usd'], name='application_total_paid_idx'),
+            models.Index(fields=['last_payment_at'], name='application_last_payment_idx'),
+        ]
+
+    # Columns the dashboard, step pages, payments and webhook read. The other
+    # (profile) columns are only needed by the application form and the PDF.
+    WORKFLOW_FIELDS = (
+        'id', 'user', 'status', 'visa_status', 'passport_photograph',
+        'custom_application_fee', 'custom_admission_fee', 'custom_agency_fee',
+        'full_name', 'email', 'phone_number', 'total_paid_usd', 'paid_purposes', 'last_payment_at',
+        'created_at', 'updated_at',
+    )
 
     class ApplicationStatus(models.TextChoices):
         STEP_1_APPLICATION_FORM = 'STEP_1_APPLICATION_FORM', 'Step 1: Application Form'
@@ -42,7 +61,7 @@ class Application(models.Model): # STUDENT Application
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='student_application')
     status = models.CharField(max_length=50, choices=ApplicationStatus.choices, default=ApplicationStatus.STEP_1_APPLICATION_FORM)
     visa_status = models.CharField(max_length=50, choices=VisaStatus.choices, default=VisaStatus.NOT_STARTED)
-    passport_photograph = models.ImageField(upload_to='passport_photos/', blank=True, null=True)
+    passport_photograph = models.ImageField(upload_to='passport_photos/', storage=blob_storage, blank=True, null=True)
 
     custom_application_fee = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, help_text="Overrides the default student application fee (USD).")
     custom_admission_fee = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, help_text="Overrides the default admission fee (USD).")
@@ -74,7 +93,8 @@ class Application(models.Model): # STUDENT Application
     preferred_program = models.CharField(max_length=100, blank=True, null=True)
     previous_school = models.CharField(max_length=255, blank=True, null=True)
     country_applying_from = models.CharField(max_length=100, blank=True, null=True)
-    country_of_interest = models.CharField(max_length=100, blank=True, null=True)
+    country_of_interest = models.ForeignKey(Country, on_delete=models.SET_NULL, null=True, blank=True, related_name='student_applications')
+    country_of_interest_legacy = models.CharField(max_length=100, blank=True, null=True, help_text="Free-text country entered before countries came from the catalogue and that matched no Country.")
     achievements = models.TextField(blank=True)
     emergency_contact_name = models.CharField(max_length=255, blank=True, null=True)
     emergency_contact_relationship = models.CharField(max_length=50, blank=True, null=True)
@@ -83,6 +103,11 @@ class Application(models.Model): # STUDENT Application
     allergies = models.TextField(blank=True)
     how_did_you_hear = models.CharField(max_length=255, blank=True, null=True)
     declaration_agreed = models.BooleanField(default=False)
+
+    # Payment summary, kept in step with the successful payments by ledger.refresh_payment_summary()
+    total_paid_usd = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    paid_purposes = models.PositiveIntegerField(default=0, editable=False, help_text="Bitmask of Payment.PURPOSE_BITS paid at least once.")
+    last_payment_at = models.DateTimeField(blank=True, null=True, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -94,7 +119,20 @@ class WorkApplication(models.Model):
         # This sets the display name in the admin panel
         verbose_name = "Work Application"
         verbose_name_plural = "Work Applications"
-        
+        indexes = [
+            models.Index(fields=['paid_purposes'], name='workapp_paid_purposes_idx'),
+            models.Index(fields=['total_paid_usd'], name='workapp_total_paid_idx'),
+            models.Index(fields=['last_payment_at'], name='workapp_last_payment_idx'),
+        ]
+
+    # Columns the dashboard, step pages, payments and webhook read. The other
+    # (profile) columns are only needed by the application form and the PDF.
+    WORKFLOW_FIELDS = (
+        'id', 'user', 'status', 'visa_status', 'passport_photograph', 'custom_application_fee',
+        'destination_country', 'job_offer_accepted', 'full_name', 'email', 'contact_number',
+        'total_paid_usd', 'paid_purposes', 'last_payment_at', 'created_at', 'updated_at',
+    )
+
     class WorkApplicationStatus(models.TextChoices):
         STEP_1_APPLICATION_FORM = 'STEP_1_APPLICATION_FORM', 'Step 1: Application Form'
         STEP_2_EMPLOYMENT_FORM = 'STEP_2_EMPLOYMENT_FORM', 'Step 2: Employment Form & 50% Fee'
@@ -110,7 +148,7 @@ class WorkApplication(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='work_application')
     status = models.CharField(max_length=50, choices=WorkApplicationStatus.choices, default=WorkApplicationStatus.STEP_1_APPLICATION_FORM)
     visa_status = models.CharField(max_length=50, choices=VisaStatus.choices, default=VisaStatus.NOT_STARTED)
-    passport_photograph = models.ImageField(upload_to='passport_photos/', blank=True, null=True)
+    passport_photograph = models.ImageField(upload_to='passport_photos/', storage=blob_storage, blank=True, null=True)
     custom_application_fee = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, help_text="Overrides the default work application fee (USD).")
 
     full_name = models.CharField(max_length=255, blank=True, null=True)
@@ -136,12 +174,44 @@ class WorkApplication(models.Model):
     skills_certifications = models.TextField(blank=True)
     declaration_agreed = models.BooleanField(default=False)
     job_offer_accepted = models.BooleanField(default=False)
+
+    # Payment summary, kept in step with the successful payments by ledger.refresh_payment_summary()
+    total_paid_usd = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    paid_purposes = models.PositiveIntegerField(default=0, editable=False, help_text="Bitmask of Payment.PURPOSE_BITS paid at least once.")
+    last_payment_at = models.DateTimeField(blank=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     def __str__(self):
         return f"Work Application for {self.user.username}"
 
-class Document(models.Model):
+def profile_fields(model, prefix=''):
+    """
+    Names of the application columns outside model.WORKFLOW_FIELDS, for
+    .defer() on reads that only need the workflow state. prefix is the
+    select_related path, e.g. 'student_application__'.
+    """
+    return [prefix + field.name for field in model._meta.concrete_fields if field.name not in model.WORKFLOW_FIELDS]
+
+class ApplicantRecord(models.Model):
+    """
+    Base for records that belong to either a student or a work application.
+    applicant is the user behind whichever of the two is set, kept in sync on
+    save, so listings across both paths filter one indexed column.
+    """
+    applicant = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='%(class)ss',
+        null=True, blank=True, editable=False, db_index=False,
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        owner = self.application if self.application_id else self.work_application if self.work_application_id else None
+        self.applicant_id = owner.user_id if owner else None
+        super().save(*args, **kwargs)
+
+class Document(ApplicantRecord):
     class DocumentType(models.TextChoices):
         # Student Path
         INTERNATIONAL_PASSPORT = 'INTERNATIONAL_PASSPORT', 'International Passport'
@@ -163,15 +233,37 @@ class Document(models.Model):
     work_application = models.ForeignKey(WorkApplication, on_delete=models.CASCADE, related_name='documents', blank=True, null=True)
     
     document_type = models.CharField(max_length=50, choices=DocumentType.choices)
-    file = models.FileField(upload_to='documents/')
+    file = models.FileField(upload_to='documents/', storage=blob_storage)
+    original_name = models.CharField(max_length=255, blank=True, editable=False, help_text="Name of the file as uploaded; the stored name is its content hash.")
     is_admin_upload = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [
+            # An application's documents by type, oldest first (DocumentInventory, update_or_create)
+            models.Index(fields=['application', 'document_type', 'uploaded_at'], name='document_app_type_idx'),
+            models.Index(fields=['work_application', 'document_type', 'uploaded_at'], name='document_work_type_idx'),
+            models.Index(fields=['applicant', 'document_type', 'uploaded_at'], name='document_applicant_idx'),
+            # Recent admin uploads across all applicants
+            models.Index(fields=['uploaded_at'], name='document_admin_upload_idx', condition=models.Q(is_admin_upload=True)),
+        ]
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:
+            self.original_name = os.path.basename(self.file.name)[:255]
+            # update_or_create saves only the fields it was given
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'original_name'}
+        super().save(*args, **kwargs)
+
+    @property
+    def display_name(self):
+        return self.original_name or os.path.basename(self.file.name)
+
     def __str__(self):
         if self.application: return f"{self.get_document_type_display()} for {self.application.user.username}"
         if self.work_application: return f"{self.get_document_type_display()} for {self.work_application.user.username}"
         return f"Global Document: {self.get_document_type_display()}"
 
-class VisaUpdate(models.Model):
+class VisaUpdate(ApplicantRecord):
     application = models.ForeignKey(Application, on_delete=models.CASCADE, related_name='visa_updates', null=True, blank=True)
     work_application = models.ForeignKey(WorkApplication, on_delete=models.CASCADE, related_name='visa_updates', null=True, blank=True)
     status_title = models.CharField(max_length=255)
@@ -180,21 +272,29 @@ class VisaUpdate(models.Model):
     send_email_notification = models.BooleanField(default=False, help_text="Check this box to send an email notification to the user about this update.")
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['application', '-created_at'], name='visaupdate_app_created_idx'),
+            models.Index(fields=['work_application', '-created_at'], name='visaupdate_work_created_idx'),
+            models.Index(fields=['applicant', '-created_at'], name='visaupdate_applicant_idx'),
+        ]
     def __str__(self):
-        return f"Update for {self.application.user.username if self.application else self.work_application.user.username}: {self.status_title}"
+        return f"Update for {self.applicant.username}: {self.status_title}"
 
-class Testimonial(models.Model):
+class Testimonial(ApplicantRecord):
     application = models.OneToOneField(Application, on_delete=models.CASCADE, related_name='testimonial', null=True, blank=True)
     work_application = models.OneToOneField(WorkApplication, on_delete=models.CASCADE, related_name='testimonial', null=True, blank=True)
     content = models.TextField()
     rating = models.PositiveIntegerField(default=5)
     is_approved = models.BooleanField(default=False, help_text="Check this box to feature the testimonial on the public website.")
     created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['applicant'], name='testimonial_applicant_idx'),
+        ]
     def __str__(self):
-        user = self.application.user if self.application else self.work_application.user
-        return f"Testimonial from {user.username}"
+        return f"Testimonial from {self.applicant.username}"
 
-class Payment(models.Model):
+class Payment(ApplicantRecord):
     class PaymentStatus(models.TextChoices):
         PENDING = 'PENDING', 'Pending'
         SUCCESSFUL = 'SUCCESSFUL', 'Successful'
@@ -211,17 +311,85 @@ class Payment(models.Model):
         WORK_VISA_FINAL_50_PERCENT = 'WORK_VISA_FINAL_50_PERCENT', 'Work Visa Fee (Final 50%)'
         WORK_VISA_REMAINING_25_PERCENT = 'WORK_VISA_REMAINING_25_PERCENT', 'Work Visa Fee (Remaining 25%)'
 
+    # Bit of each purpose in the applications' paid_purposes. These are
+    # stored, so never renumber them; give a new purpose the next free bit.
+    PURPOSE_BITS = {
+        PaymentPurpose.STUDENT_APP_FEE: 1 << 0,
+        PaymentPurpose.ADMISSION_FEE: 1 << 1,
+        PaymentPurpose.AGENCY_FEE_FULL: 1 << 2,
+        PaymentPurpose.AGENCY_FEE_HALF: 1 << 3,
+        PaymentPurpose.WORK_APP_FEE: 1 << 4,
+        PaymentPurpose.WORK_VISA_50_PERCENT: 1 << 5,
+        PaymentPurpose.WORK_VISA_25_PERCENT: 1 << 6,
+        PaymentPurpose.WORK_VISA_FINAL_50_PERCENT: 1 << 7,
+        PaymentPurpose.WORK_VISA_REMAINING_25_PERCENT: 1 << 8,
+    }
+
     application = models.ForeignKey(Application, on_delete=models.CASCADE, related_name='payments', null=True, blank=True)
     work_application = models.ForeignKey(WorkApplication, on_delete=models.CASCADE, related_name='payments', null=True, blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, blank=True, help_text="Currency of amount. Blank on payments made before it was recorded.")
+    amount_usd = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, help_text="USD price of the payment, whatever currency it was charged in.")
     status = models.CharField(max_length=20, choices=PaymentStatus.choices, default=PaymentStatus.PENDING)
     purpose = models.CharField(max_length=50, choices=PaymentPurpose.choices)
     tx_ref = models.CharField(max_length=100, unique=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        indexes = [
+            # Payments per application, status and purpose; includes the summed
+            # columns so the PaymentLedger query is answered from the index alone
+            models.Index(fields=['application', 'status', 'purpose', 'amount_usd', 'updated_at'], name='payment_app_ledger_idx'),
+            models.Index(fields=['work_application', 'status', 'purpose', 'amount_usd', 'updated_at'], name='payment_work_ledger_idx'),
+            # Payments of one applicant by status, across both application paths
+            models.Index(fields=['applicant', 'status', 'created_at'], name='payment_applicant_idx'),
+            # Payments still waiting for their webhook, oldest first
+            models.Index(fields=['created_at'], name='payment_pending_idx', condition=models.Q(status='PENDING')),
+        ]
     def __str__(self):
         return f"{self.purpose} - {self.status}"
 
+class StoredBlob(models.Model):
+    """
+    A file in content-addressed storage (portal/storage.py), shared by every
+    document or photograph with the same content. ref_count is the number of
+    those references; a blob left at 0 is removed by the media garbage collector.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        indexes = [
+            # Unreferenced blobs, oldest first
+            models.Index(fields=['updated_at'], name='storedblob_unreferenced_idx', condition=models.Q(ref_count=0)),
+        ]
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+class UploadSession(ApplicantRecord):
+    """
+    A resumable upload of one application form file, received in chunks and
+    appended to a part file until `offset` reaches `size` (see portal/uploads.py).
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    application = models.ForeignKey(Application, on_delete=models.CASCADE, related_name='upload_sessions', null=True, blank=True)
+    work_application = models.ForeignKey(WorkApplication, on_delete=models.CASCADE, related_name='upload_sessions', null=True, blank=True)
+    field_name = models.CharField(max_length=50, help_text="Upload field of the application form the file is for.")
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(help_text="Total size of the file in bytes.")
+    offset = models.PositiveBigIntegerField(default=0, help_text="Bytes received so far.")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        indexes = [
+            # Abandoned sessions, oldest first (clear_upload_sessions)
+            models.Index(fields=['updated_at'], name='uploadsession_updated_idx'),
+        ]
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size} bytes)"
+
 
 
 class FeeStructure(models.Model):
@@ -238,4 +406,39 @@ class FeeStructure(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
 
     def __str__(self):
-        return f"{self.get_fee_type_display()}: {self.amount}"
\ No newline at end of file
+        return f"{self.get_fee_type_display()}: {self.amount}"
+
+
+class ReferenceDataVersion(models.Model):
+    """
+    A single row counting edits to FeeStructure and Country. Each worker
+    compares it with the version of its reference data snapshot (see
+    portal/reference.py), so an edit reaches every worker on every node
+    through the database they already share.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Reference data version {self.version}"
+
+
+class ExchangeRate(models.Model):
+    """
+    A history of exchange rates fetched from Flutterwave. The latest row for a
+    currency pair is used whenever the rate cache is cold or the API is down.
+    """
+    base_currency = models.CharField(max_length=3, default='USD')
+    quote_currency = models.CharField(max_length=3, default='NGN')
+    rate = models.DecimalField(max_digits=14, decimal_places=6)
+    source = models.CharField(max_length=50, default='flutterwave')
+    fetched_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-fetched_at']
+        get_latest_by = 'fetched_at'
+        indexes = [
+            models.Index(fields=['base_currency', 'quote_currency', '-fetched_at'], name='exchangerate_pair_latest_idx'),
+        ]
+
+    def __str__(self):
+        return f"1 {self.base_currency} = {self.rate} {self.quote_currency} ({self.fetched_at:%Y-%m-%d %H:%M})"
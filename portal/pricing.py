@@ -0,0 +1,126 @@
+# portal/pricing.py
+
+from decimal import Decimal
+
+from django.core.cache import cache
+from .models import FeeStructure, Payment
+from .rates import get_usd_to_ngn_rate
+from .reference import get_reference_data
+
+PRICE_TABLE_CACHE_KEY = 'portal:price_table'
+
+# Used when a fee type has no FeeStructure row yet.
+DEFAULT_FEES = {
+    FeeStructure.FeeType.STUDENT_APP_FEE: Decimal('15.00'),
+    FeeStructure.FeeType.ADMISSION_FEE: Decimal('1000.00'),
+    FeeStructure.FeeType.AGENCY_FEE: Decimal('500.00'),
+    FeeStructure.FeeType.WORK_APP_FEE: Decimal('30.00'),
+}
+
+# Percentage of a fee -> multiplier
+SPLITS = {
+    100: Decimal('1.00'),
+    50: Decimal('0.50'),
+    25: Decimal('0.25'),
+}
+
+# Marks purposes priced from the applicant's destination Country.
+COUNTRY_FEE = 'COUNTRY'
+
+# Payment purpose -> (fee key, split, per-application override field)
+PURPOSE_PRICING = {
+    Payment.PaymentPurpose.STUDENT_APP_FEE: (FeeStructure.FeeType.STUDENT_APP_FEE, 100, 'custom_application_fee'),
+    Payment.PaymentPurpose.ADMISSION_FEE: (FeeStructure.FeeType.ADMISSION_FEE, 100, 'custom_admission_fee'),
+    Payment.PaymentPurpose.AGENCY_FEE_FULL: (FeeStructure.FeeType.AGENCY_FEE, 100, 'custom_agency_fee'),
+    Payment.PaymentPurpose.AGENCY_FEE_HALF: (FeeStructure.FeeType.AGENCY_FEE, 50, 'custom_agency_fee'),
+    Payment.PaymentPurpose.WORK_APP_FEE: (FeeStructure.FeeType.WORK_APP_FEE, 100, 'custom_application_fee'),
+    Payment.PaymentPurpose.WORK_VISA_50_PERCENT: (COUNTRY_FEE, 50, None),
+    Payment.PaymentPurpose.WORK_VISA_FINAL_50_PERCENT: (COUNTRY_FEE, 50, None),
+    Payment.PaymentPurpose.WORK_VISA_25_PERCENT: (COUNTRY_FEE, 25, None),
+    Payment.PaymentPurpose.WORK_VISA_REMAINING_25_PERCENT: (COUNTRY_FEE, 25, None),
+}
+
+STUDENT_PURPOSES = {
+    Payment.PaymentPurpose.STUDENT_APP_FEE, Payment.PaymentPurpose.ADMISSION_FEE,
+    Payment.PaymentPurpose.AGENCY_FEE_FULL, Payment.PaymentPurpose.AGENCY_FEE_HALF,
+}
+WORK_PURPOSES = set(PURPOSE_PRICING) - STUDENT_PURPOSES
+
+
+def country_fee_key(country_id):
+    return f"{COUNTRY_FEE}:{country_id}"
+
+
+def _price(usd_total, split, rate):
+    usd = (Decimal(str(usd_total)) * SPLITS[split]).quantize(Decimal('0.01'))
+    return {'usd': usd, 'ngn': (usd * rate).quantize(Decimal('0.01'))}
+
+
+def _price_splits(usd_total, rate):
+    return {split: _price(usd_total, split, rate) for split in SPLITS}
+
+
+def build_price_table(rate=None, reference=None):
+    """
+    Price every fee type and every country's processing fee, at every split,
+    in USD and NGN, and store the table in the shared cache along with the
+    reference data version it was priced from.
+    """
+    if rate is None:
+        rate = get_usd_to_ngn_rate()
+    if reference is None:
+        reference = get_reference_data()
+    fees = dict(DEFAULT_FEES)
+    fees.update(reference.fees)
+    prices = {fee_type: _price_splits(amount, rate) for fee_type, amount in fees.items()}
+    for country in reference.countries:
+        prices[country_fee_key(country.pk)] = _price_splits(country.processing_fee, rate)
+    table = {'rate': rate, 'version': reference.version, 'prices': prices}
+    cache.set(PRICE_TABLE_CACHE_KEY, table, timeout=None)
+    return table
+
+
+def get_price_table():
+    """
+    Return the price table, rebuilding it if it is missing, priced at an old
+    rate or from older fees than this worker's reference data.
+    """
+    table = cache.get(PRICE_TABLE_CACHE_KEY)
+    rate = get_usd_to_ngn_rate()
+    reference = get_reference_data()
+    if table is not None and table.get('version', 0) > reference.version:
+        # Built by a worker that has seen a newer edit; catch up rather than
+        # overwrite it with this worker's older fees
+        reference = get_reference_data(refresh=True)
+    if table is None or table['rate'] != rate or table.get('version') != reference.version:
+        table = build_price_table(rate, reference)
+    return table
+
+
+def price_for_purpose(purpose, application):
+    """
+    Return {'usd': ..., 'ngn': ...} for paying `purpose` on a student or work
+    application, or None if it can't be priced yet (no destination country).
+
+    Fee overrides on the application are priced at the table's rate; all
+    other amounts are read straight from the table.
+    """
+    fee_key, split, override_field = PURPOSE_PRICING[purpose]
+    table = get_price_table()
+
+    override = getattr(application, override_field, None) if override_field else None
+    if override:
+        return _price(override, split, table['rate'])
+
+    if fee_key == COUNTRY_FEE:
+        country_id = getattr(application, 'destination_country_id', None)
+        if not country_id:
+            return None
+        fee_key = country_fee_key(country_id)
+        if fee_key not in table['prices']:
+            table = build_price_table(table['rate'])
+        if fee_key not in table['prices']:
+            # This worker's reference data doesn't have the country yet (e.g.
+            # it was just added on another worker): price it from the row
+            return _price(application.destination_country.processing_fee, split, table['rate'])
+    return table['prices'][fee_key][split]
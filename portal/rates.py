@@ -0,0 +1,102 @@
+# portal/rates.py
+
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from .breakers import CircuitOpenError
+from .flutterwave import get_flutterwave_client
+from .models import ExchangeRate
+
+logger = logging.getLogger(__name__)
+
+RATE_CACHE_KEY = 'portal:rates:USD:NGN'
+REFRESH_LOCK_KEY = 'portal:rates:USD:NGN:refreshing'
+
+
+def fetch_usd_to_ngn_rate():
+    """
+    Fetch the current USD to NGN exchange rate from Flutterwave.
+    Returns the rate, or None if the API call fails.
+    """
+    try:
+        return get_flutterwave_client().get_rate('USD', 'NGN')
+    except CircuitOpenError:
+        logger.info("Flutterwave rates circuit is open; keeping the last known rate")
+    except Exception as e:
+        logger.error(f"Error fetching exchange rate: {e}")
+    return None
+
+
+def _cache_rate(rate, fetched_at, timeout=None):
+    cache.set(RATE_CACHE_KEY, {'rate': rate, 'fetched_at': fetched_at}, timeout=timeout)
+
+
+def refresh_usd_to_ngn_rate():
+    """
+    Fetch the rate, record it in the ExchangeRate history and store it in the
+    shared cache. Returns the new rate, or None if the fetch failed (the
+    cached and stored values are kept).
+    """
+    rate = fetch_usd_to_ngn_rate()
+    if rate is not None:
+        stored = ExchangeRate.objects.create(base_currency='USD', quote_currency='NGN', rate=rate)
+        _cache_rate(stored.rate, stored.fetched_at.timestamp())
+        from .pricing import build_price_table
+        build_price_table(stored.rate)
+    return rate
+
+
+def get_stored_usd_to_ngn_rate():
+    """Return the most recently recorded USD to NGN ExchangeRate, or None."""
+    return ExchangeRate.objects.filter(base_currency='USD', quote_currency='NGN').order_by('-fetched_at').first()
+
+
+def _refresh_in_background():
+    """
+    Start a background refresh unless another worker is already doing one.
+    cache.add() is atomic, so only one worker wins the refresh lock.
+    """
+    lock_timeout = getattr(settings, 'EXCHANGE_RATE_REFRESH_LOCK_TIMEOUT', 30)
+    if not cache.add(REFRESH_LOCK_KEY, True, timeout=lock_timeout):
+        return
+
+    def run():
+        try:
+            refresh_usd_to_ngn_rate()
+        finally:
+            cache.delete(REFRESH_LOCK_KEY)
+            close_old_connections()
+
+    threading.Thread(target=run, name='usd-ngn-rate-refresh', daemon=True).start()
+
+
+def get_usd_to_ngn_rate():
+    """
+    Return the USD to NGN rate without ever waiting on the network.
+
+    A fresh cached rate is returned as is. A rate older than EXCHANGE_RATE_TTL
+    is still returned, while one worker refreshes it in the background. On a
+    cold cache the latest stored ExchangeRate is used, and EXCHANGE_RATE_FALLBACK
+    only if no rate has ever been recorded. The fallback is cached for
+    EXCHANGE_RATE_FALLBACK_TTL seconds, so until the first fetch succeeds the
+    database is checked (and a refresh started) once per interval, not on
+    every request.
+    """
+    entry = cache.get(RATE_CACHE_KEY)
+    if entry is None:
+        stored = get_stored_usd_to_ngn_rate()
+        if stored is None:
+            _refresh_in_background()
+            rate = Decimal(str(getattr(settings, 'EXCHANGE_RATE_FALLBACK', '1650.00')))
+            _cache_rate(rate, time.time(), timeout=getattr(settings, 'EXCHANGE_RATE_FALLBACK_TTL', 60))
+            return rate
+        entry = {'rate': stored.rate, 'fetched_at': stored.fetched_at.timestamp()}
+        _cache_rate(entry['rate'], entry['fetched_at'])
+    if time.time() - entry['fetched_at'] > getattr(settings, 'EXCHANGE_RATE_TTL', 900):
+        _refresh_in_background()
+    return entry['rate']
@@ -0,0 +1,70 @@
+# portal/reference.py
+
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F
+from .models import Country, FeeStructure, ReferenceDataVersion
+
+
+class ReferenceData:
+    """
+    An immutable snapshot of the fee and country tables. These change a few
+    times a year, so each worker keeps one in memory and rebuilds it only
+    when a FeeStructure or Country row is saved or deleted, on any worker.
+    """
+    def __init__(self, version):
+        self.version = version
+        self.fees = dict(FeeStructure.objects.values_list('fee_type', 'amount'))
+        self.countries = tuple(Country.objects.all())
+
+    def country_choices(self):
+        return [('', '---------')] + [(country.pk, country.name) for country in self.countries]
+
+
+# ReferenceDataVersion is a single row with this primary key.
+VERSION_ROW_PK = 1
+
+_snapshot = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _shared_version():
+    """The reference data version in the database, 0 before the first edit."""
+    return ReferenceDataVersion.objects.filter(pk=VERSION_ROW_PK).values_list('version', flat=True).first() or 0
+
+
+def get_reference_data(refresh=False):
+    """
+    Return this worker's reference data snapshot, building it on first use.
+
+    At most every REFERENCE_DATA_CHECK_INTERVAL seconds (or now, with refresh)
+    the worker compares its snapshot with the version in the database, a
+    single primary key lookup, so an admin edit made on any worker or node is
+    picked up everywhere within that delay.
+    """
+    global _snapshot, _checked_at
+    snapshot = _snapshot
+    interval = getattr(settings, 'REFERENCE_DATA_CHECK_INTERVAL', 5)
+    if not refresh and snapshot is not None and time.monotonic() - _checked_at < interval:
+        return snapshot
+    with _lock:
+        version = _shared_version()
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = ReferenceData(version)
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+def invalidate_reference_data():
+    """
+    Count an edit in ReferenceDataVersion so every worker drops its snapshot,
+    and drop this worker's immediately.
+    """
+    global _snapshot
+    with _lock:
+        ReferenceDataVersion.objects.get_or_create(pk=VERSION_ROW_PK)
+        ReferenceDataVersion.objects.filter(pk=VERSION_ROW_PK).update(version=F('version') + 1)
+        _snapshot = None
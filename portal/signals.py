@@ -1,12 +1,16 @@
 # portal/signals.py
 
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
-from django.core.mail import send_mail
+from .utils import guarded_send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.urls import reverse
-from .models import Document, VisaUpdate, WorkApplication
+from .blobs import release_blob_references, remember_blob_names, update_blob_references
+from .models import Application, Country, Document, FeeStructure, VisaUpdate, WorkApplication
+from .pricing import build_price_table
+from .reference import invalidate_reference_data
 
 @receiver(post_save, sender=Document)
 def send_email_on_admission_letter_upload(sender, instance, created, **kwargs):
@@ -19,7 +23,7 @@ def send_email_on_admission_letter_upload(sender, instance, created, **kwargs):
         dashboard_url = f"http://127.0.0.1:8000{reverse('portal:dashboard')}"
         context = {'user': user, 'dashboard_url': dashboard_url}
         email_body = render_to_string('portal/emails/admission_letter_ready.txt', context)
-        send_mail(
+        guarded_send_mail(
             subject='Your Admission Letter is Ready!',
             message=email_body,
             from_email=settings.DEFAULT_FROM_EMAIL,
@@ -66,7 +70,7 @@ def send_email_on_admin_upload(sender, instance, created, **kwargs):
 
     if user and subject and template_name:
         email_body = render_to_string(template_name, context)
-        send_mail(
+        guarded_send_mail(
             subject=subject,
             message=email_body,
             from_email=settings.DEFAULT_FROM_EMAIL,
@@ -83,11 +87,7 @@ def send_email_on_visa_update(sender, instance, created, **kwargs):
     """
     # We only care about newly created updates where the admin opted to send an email
     if created and instance.send_email_notification:
-        user = None
-        if instance.application:
-            user = instance.application.user
-        elif instance.work_application:
-            user = instance.work_application.user
+        user = instance.applicant
         
         # If we couldn't find a user, exit early
         if not user:
@@ -103,10 +103,55 @@ def send_email_on_visa_update(sender, instance, created, **kwargs):
         
         email_body = render_to_string('portal/emails/visa_update_notification.txt', context)
         
-        send_mail(
+        guarded_send_mail(
             subject='An Update on Your Visa Application',
             message=email_body,
             from_email=settings.DEFAULT_FROM_EMAIL,
             recipient_list=[user.email],
             fail_silently=False
         )
+
+
+@receiver(post_save, sender=FeeStructure)
+@receiver(post_delete, sender=FeeStructure)
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+def refresh_reference_data_on_change(sender, **kwargs):
+    """
+    Fees or countries changed in the admin; drop the cached reference data
+    snapshot and re-price the precomputed USD/NGN table so pages and
+    payments pick up the new amounts.
+
+    Both run once the admin's transaction commits: published earlier, another
+    worker could rebuild its snapshot (and this one the table) from the rows
+    committed before the edit, and keep them under the new version.
+    """
+    transaction.on_commit(refresh_reference_data)
+
+
+def refresh_reference_data():
+    invalidate_reference_data()
+    build_price_table()
+
+
+# --- Stored blob references ---
+# Documents and passport photographs share content-addressed files
+# (portal/storage.py); StoredBlob.ref_count follows the records using each.
+
+@receiver(post_init, sender=Document)
+@receiver(post_init, sender=Application)
+@receiver(post_init, sender=WorkApplication)
+def remember_stored_files(sender, instance, **kwargs):
+    remember_blob_names(instance)
+
+@receiver(post_save, sender=Document)
+@receiver(post_save, sender=Application)
+@receiver(post_save, sender=WorkApplication)
+def count_stored_file_references(sender, instance, update_fields=None, **kwargs):
+    update_blob_references(instance, update_fields)
+
+@receiver(post_delete, sender=Document)
+@receiver(post_delete, sender=Application)
+@receiver(post_delete, sender=WorkApplication)
+def release_stored_file_references(sender, instance, **kwargs):
+    release_blob_references(instance)
@@ -0,0 +1,79 @@
+# portal/storage.py
+
+import hashlib
+import os
+import posixpath
+import re
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+
+# Read size while hashing a file that arrived without a content_hash.
+HASH_READ_SIZE = 64 * 1024
+
+# <upload_to>/<2 hex>/<2 hex>/<sha256>[.ext], e.g. documents/3f/a2/3fa2...9c.pdf
+CONTENT_ADDRESSED_NAME = re.compile(r'^(?:[\w-]+/)*[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(?:\.[a-z0-9]{1,10})?$')
+
+# Content-addressed files never change, so browsers may keep them for good.
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+def file_hash(file):
+    """sha256 hex digest of an open file, read in HASH_READ_SIZE blocks."""
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for block in iter(lambda: file.read(HASH_READ_SIZE), b''):
+        sha256.update(block)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def is_content_addressed(name):
+    return bool(name and CONTENT_ADDRESSED_NAME.match(name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every file under the sha256 of its content, sharded two levels
+    deep below its upload_to directory so no directory grows past 65536
+    entries. Saving content that is already stored writes nothing and
+    returns the existing name, so identical uploads share one file (see
+    StoredBlob for the references to it). Files saved before this storage
+    was used keep their names and are read as before.
+    """
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        # Set by InspectingUploadHandler and the resumable upload path
+        content_hash = getattr(content, 'content_hash', None) or file_hash(content)
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        extension = os.path.splitext(name)[1].lower()
+        if not re.fullmatch(r'\.[a-z0-9]{1,10}', extension):
+            extension = ''
+        name = posixpath.join(directory, content_hash[:2], content_hash[2:4], content_hash + extension)
+        return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # The same name means the same content, so it is never suffixed
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            # Touched so the media garbage collector's grace period restarts
+            # for a blob that is about to be referenced again
+            os.utime(self.path(name))
+            return name
+        # Written under a unique temporary name and renamed into place, so a
+        # concurrent save of the same content never sees a partial file
+        temporary_name = f'{name}.{uuid.uuid4().hex}.tmp'
+        temporary_name = super()._save(temporary_name, content)
+        os.replace(self.path(temporary_name), self.path(name))
+        return name
+
+
+def blob_storage():
+    """Storage of applicants' documents and photographs, the STORAGES 'blobs' alias."""
+    return storages['blobs']
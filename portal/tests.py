@@ -1,3 +1,750 @@
-from django.test import TestCase
+import base64
+import hashlib
+import importlib
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import geoip2.errors
+import requests
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, F, Max, Sum
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .admin import hadey_admin_site
+from .autosave import apply_changes
+from .breakers import CircuitBreaker, CircuitOpenError, _breakers
+from .flutterwave import FlutterwaveClient
+from .forms import StudentApplicationForm
+from .ledger import PaymentLedger
+from .media_gc import MediaGarbageCollector
+from .middleware import Applicant
+from .models import (
+    Application, Country, Document, ExchangeRate, FeeStructure, Payment, ReferenceDataVersion, StoredBlob,
+    UploadSession, VisaUpdate, WorkApplication,
+)
+from .pricing import PRICE_TABLE_CACHE_KEY, build_price_table, get_price_table, price_for_purpose
+from .rates import RATE_CACHE_KEY, get_usd_to_ngn_rate, refresh_usd_to_ngn_rate
+from .reference import get_reference_data, invalidate_reference_data
+from .uploads import InspectingUploadHandler, UploadError, append_chunk, part_path
+from .utils import CountryLookupCache, country_cache, get_country_code
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Checks SQLite EXPLAIN QUERY PLAN output')
+class HotQueryPlanTests(TestCase):
+    """
+    The per-application lookups made on every step view must be resolved
+    through an index rather than a scan of the whole table, so they stay
+    cheap as Payment, Document and VisaUpdate grow.
+    """
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotRegex(plan, rf'SCAN {queryset.model._meta.db_table}\b(?! USING)')
+
+    def test_payment_ledger_is_answered_from_the_index(self):
+        for owner, index_name in [('application', 'payment_app_ledger_idx'), ('work_application', 'payment_work_ledger_idx')]:
+            queryset = (
+                Payment.objects
+                .filter(**{f'{owner}_id': 1}, status=Payment.PaymentStatus.SUCCESSFUL)
+                .values('purpose')
+                .annotate(count=Count('id'), total_usd=Sum('amount_usd'), last_paid_at=Max('updated_at'))
+                .order_by()
+            )
+            self.assertUsesIndex(queryset, index_name)
+            self.assertIn('COVERING INDEX', queryset.explain())
+
+    def test_pending_payments_use_partial_index(self):
+        queryset = Payment.objects.filter(status=Payment.PaymentStatus.PENDING).order_by('created_at')
+        self.assertUsesIndex(queryset, 'payment_pending_idx')
+
+    def test_document_lookup_by_type(self):
+        for owner, index_name in [('application', 'document_app_type_idx'), ('work_application', 'document_work_type_idx')]:
+            queryset = Document.objects.filter(
+                **{f'{owner}_id': 1}, document_type=Document.DocumentType.INTERNATIONAL_PASSPORT,
+            )
+            self.assertUsesIndex(queryset, index_name)
+
+    def test_visa_updates_newest_first(self):
+        for owner, index_name in [('application', 'visaupdate_app_created_idx'), ('work_application', 'visaupdate_work_created_idx')]:
+            queryset = VisaUpdate.objects.filter(**{f'{owner}_id': 1})
+            self.assertUsesIndex(queryset, index_name)
+            self.assertNotIn('TEMP B-TREE', queryset.explain())
+
+    def test_cross_path_listings_use_applicant_indexes(self):
+        self.assertUsesIndex(
+            Payment.objects.filter(applicant_id=1, status=Payment.PaymentStatus.PENDING).order_by('created_at'),
+            'payment_applicant_idx',
+        )
+        self.assertUsesIndex(VisaUpdate.objects.filter(applicant_id=1), 'visaupdate_applicant_idx')
+        self.assertUsesIndex(
+            Document.objects.filter(is_admin_upload=True, uploaded_at__gte=timezone.now() - timedelta(days=7)),
+            'document_admin_upload_idx',
+        )
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        invalidate_reference_data()
+        cache.set(RATE_CACHE_KEY, {'rate': Decimal('1500'), 'fetched_at': time.time()})
+
+    def test_country_missing_from_the_snapshot_is_priced_from_its_row(self):
+        build_price_table()
+        # Added on another worker: this worker's reference data hasn't seen it
+        country = Country.objects.create(name='Malta', processing_fee=Decimal('2000.00'))
+        application = WorkApplication.objects.create(user=User.objects.create_user('worker'), destination_country=country)
+        price = price_for_purpose(Payment.PaymentPurpose.WORK_VISA_25_PERCENT, application)
+        self.assertEqual(price, {'usd': Decimal('500.00'), 'ngn': Decimal('750000.00')})
+
+    @override_settings(REFERENCE_DATA_CHECK_INTERVAL=0)
+    def test_fee_edit_on_another_worker_rebuilds_the_table(self):
+        build_price_table()
+        FeeStructure.objects.update_or_create(fee_type=FeeStructure.FeeType.STUDENT_APP_FEE, defaults={'amount': Decimal('20.00')})
+        # Counted by the other worker; this one's snapshot is untouched
+        ReferenceDataVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        application = Application(user=User.objects.create_user('student'))
+        price = price_for_purpose(Payment.PaymentPurpose.STUDENT_APP_FEE, application)
+        self.assertEqual(price['usd'], Decimal('20.00'))
+
+    @override_settings(REFERENCE_DATA_CHECK_INTERVAL=3600)
+    def test_stale_worker_does_not_overwrite_a_newer_table(self):
+        stale = get_reference_data()
+        ReferenceDataVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        newer = {**build_price_table(reference=stale), 'version': stale.version + 1}
+        cache.set(PRICE_TABLE_CACHE_KEY, newer)
+        self.assertEqual(get_price_table(), newer)
+        self.assertEqual(get_reference_data().version, stale.version + 1)
+
+
+class PaymentLedgerTests(TestCase):
+    def pay(self, application, purpose, status=Payment.PaymentStatus.SUCCESSFUL):
+        owner = 'application' if isinstance(application, Application) else 'work_application'
+        Payment.objects.create(
+            **{owner: application}, purpose=purpose, status=status, amount=Decimal('100.00'),
+            tx_ref=f'test-{Payment.objects.count()}',
+        )
+        return PaymentLedger(application)
+
+    def test_agency_fee_status(self):
+        Purpose = Payment.PaymentPurpose
+        application = Application.objects.create(user=User.objects.create_user('student'))
+        self.assertEqual(PaymentLedger(application).agency_fee_status(), 'none')
+        self.assertEqual(self.pay(application, Purpose.AGENCY_FEE_HALF, Payment.PaymentStatus.FAILED).agency_fee_status(), 'none')
+        self.assertEqual(self.pay(application, Purpose.AGENCY_FEE_HALF).agency_fee_status(), 'half_paid')
+        self.assertEqual(self.pay(application, Purpose.AGENCY_FEE_HALF).agency_fee_status(), 'full_paid')
+
+        other = Application.objects.create(user=User.objects.create_user('other'))
+        self.assertEqual(self.pay(other, Purpose.AGENCY_FEE_FULL).agency_fee_status(), 'full_paid')
+
+    def test_job_offer_status(self):
+        Purpose = Payment.PaymentPurpose
+        application = WorkApplication.objects.create(user=User.objects.create_user('worker'))
+        self.assertEqual(self.pay(application, Purpose.WORK_APP_FEE).job_offer_status(), 'none')
+        self.assertEqual(self.pay(application, Purpose.WORK_VISA_50_PERCENT).job_offer_status(), 'half_paid')
+        self.assertEqual(self.pay(application, Purpose.WORK_VISA_FINAL_50_PERCENT).job_offer_status(), 'full_paid')
+
+        split = WorkApplication.objects.create(user=User.objects.create_user('split'))
+        self.assertEqual(self.pay(split, Purpose.WORK_VISA_25_PERCENT).job_offer_status(), 'none')
+        self.assertEqual(self.pay(split, Purpose.WORK_VISA_25_PERCENT).job_offer_status(), 'full_paid')
+
+    def test_next_payable_purpose_and_amount_outstanding_on_the_work_path(self):
+        Purpose = Payment.PaymentPurpose
+        cache.clear()
+        self.addCleanup(cache.clear)
+        cache.set(RATE_CACHE_KEY, {'rate': Decimal('1500'), 'fetched_at': time.time()})
+        country = Country.objects.create(name='Malta', processing_fee=Decimal('2000.00'))
+        invalidate_reference_data()
+        application = WorkApplication.objects.create(user=User.objects.create_user('worker'), destination_country=country)
+        app_fee = price_for_purpose(Purpose.WORK_APP_FEE, application)['usd']
+
+        ledger = PaymentLedger(application)
+        self.assertEqual((ledger.next_payable_purpose(), ledger.amount_outstanding()), (Purpose.WORK_APP_FEE, app_fee + 2000))
+        for paid, next_purpose, outstanding in [
+            (Purpose.WORK_APP_FEE, Purpose.WORK_VISA_50_PERCENT, 2000),
+            (Purpose.WORK_VISA_50_PERCENT, Purpose.WORK_VISA_FINAL_50_PERCENT, 1000),
+            (Purpose.WORK_VISA_25_PERCENT, Purpose.WORK_VISA_REMAINING_25_PERCENT, 500),
+            (Purpose.WORK_VISA_REMAINING_25_PERCENT, None, 0),
+        ]:
+            ledger = self.pay(application, paid)
+            self.assertEqual(ledger.next_payable_purpose(), next_purpose)
+            self.assertEqual(ledger.amount_outstanding(), Decimal(outstanding))
+
+    def test_next_payable_purpose_on_the_student_path(self):
+        Purpose = Payment.PaymentPurpose
+        application = Application.objects.create(user=User.objects.create_user('student'))
+        self.assertEqual(PaymentLedger(application).next_payable_purpose(), Purpose.STUDENT_APP_FEE)
+        self.assertEqual(self.pay(application, Purpose.STUDENT_APP_FEE).next_payable_purpose(), Purpose.ADMISSION_FEE)
+        self.assertEqual(self.pay(application, Purpose.ADMISSION_FEE).next_payable_purpose(), Purpose.AGENCY_FEE_FULL)
+        self.assertEqual(self.pay(application, Purpose.AGENCY_FEE_HALF).next_payable_purpose(), Purpose.AGENCY_FEE_HALF)
+        self.assertIsNone(self.pay(application, Purpose.AGENCY_FEE_HALF).next_payable_purpose())
+
+    def test_advance_status_only_moves_forward(self):
+        Purpose = Payment.PaymentPurpose
+        Status = Application.ApplicationStatus
+        application = Application.objects.create(user=User.objects.create_user('student'))
+        self.assertFalse(PaymentLedger(application).advance_status())
+
+        ledger = self.pay(application, Purpose.STUDENT_APP_FEE)
+        ledger = self.pay(application, Purpose.ADMISSION_FEE)
+        self.assertTrue(ledger.advance_status())
+        self.assertEqual(application.status, Status.STEP_3_AGENCY_FEE)
+        self.assertFalse(ledger.advance_status())
+
+        application.status = Status.COMPLETED
+        self.assertFalse(self.pay(application, Purpose.AGENCY_FEE_FULL).advance_status())
+        self.assertEqual(application.status, Status.COMPLETED)
+
+
+class PaymentSummaryTests(TestCase):
+    def setUp(self):
+        self.first = Application.objects.create(user=User.objects.create_user('first'))
+        self.second = Application.objects.create(user=User.objects.create_user('second'))
+        self.payment = Payment.objects.create(
+            application=self.first, purpose=Payment.PaymentPurpose.STUDENT_APP_FEE, amount=Decimal('15.00'),
+            currency='USD', amount_usd=Decimal('15.00'), status=Payment.PaymentStatus.SUCCESSFUL, tx_ref='HTG-1',
+        )
+        self.admin = hadey_admin_site._registry[Payment]
+        self.request = RequestFactory().post('/')
+        self.request.user = User.objects.create_superuser('admin')
+        self.admin._refresh_summaries(self.admin._owners(self.first.pk, None))
+
+    def summary(self, application):
+        application.refresh_from_db()
+        return application.total_paid_usd, application.paid_purposes
+
+    def test_moving_a_payment_refreshes_both_applications(self):
+        form = self.admin.get_form(self.request, self.payment)(instance=self.payment)
+        self.payment.application = self.second
+        self.admin.save_model(self.request, self.payment, form, change=True)
+        self.assertEqual(self.summary(self.first), (Decimal('0.00'), 0))
+        self.assertEqual(self.summary(self.second), (Decimal('15.00'), Payment.PURPOSE_BITS[Payment.PaymentPurpose.STUDENT_APP_FEE]))
+
+    def test_bulk_delete_refreshes_the_applications(self):
+        self.assertEqual(self.summary(self.first)[0], Decimal('15.00'))
+        self.admin.delete_queryset(self.request, Payment.objects.filter(pk=self.payment.pk))
+        self.assertEqual(self.summary(self.first), (Decimal('0.00'), 0))
+
+    def test_backfill_infers_the_currency_of_earlier_payments(self):
+        Payment.objects.filter(pk=self.payment.pk).update(currency='', amount_usd=None)
+        Payment.objects.create(
+            application=self.first, purpose=Payment.PaymentPurpose.ADMISSION_FEE, amount=Decimal('1650000.00'),
+            status=Payment.PaymentStatus.SUCCESSFUL, tx_ref='HTG-2',
+        )
+        Application.objects.filter(pk=self.first.pk).update(total_paid_usd=0, paid_purposes=0)
+        migration = importlib.import_module('portal.migrations.0024_payment_summary')
+        with override_settings(EXCHANGE_RATE_FALLBACK='1650.00'):
+            migration.backfill_payment_summary(apps, None)
+        self.assertEqual(
+            sorted(Payment.objects.values_list('currency', 'amount_usd')),
+            [('NGN', Decimal('1000.00')), ('USD', Decimal('15.00'))],
+        )
+        self.assertEqual(self.summary(self.first)[0], Decimal('1015.00'))
+
+
+class AutosaveTests(TestCase):
+    def test_values_of_the_wrong_json_type_are_field_errors(self):
+        application = Application(user=User.objects.create_user('applicant'))
+        saved, errors = apply_changes(StudentApplicationForm, application, {
+            'date_of_birth': 5, 'place_of_birth': ['Lagos'], 'city': 'Ibadan',
+        })
+        self.assertEqual(saved, ['city'])
+        self.assertEqual(errors, {'date_of_birth': ['Invalid value.'], 'place_of_birth': ['Invalid value.']})
+        application.refresh_from_db()
+        self.assertEqual(application.city, 'Ibadan')
+
+    def test_no_row_is_inserted_when_no_change_is_valid(self):
+        application = Application(user=User.objects.create_user('applicant'))
+        saved, errors = apply_changes(StudentApplicationForm, application, {'date_of_birth': 'soon', 'user': 1})
+        self.assertEqual(saved, [])
+        self.assertEqual(set(errors), {'date_of_birth', 'user'})
+        self.assertIsNone(application.pk)
+        self.assertFalse(Application.objects.exists())
+
+    def test_first_save_loads_the_row_a_parallel_request_inserted(self):
+        user = User.objects.create_user('applicant')
+        application = Application(user=user)
+        inserted = Application.objects.create(user=user, city='Lagos')
+        saved, errors = apply_changes(StudentApplicationForm, application, {'place_of_birth': 'Abuja'})
+        self.assertEqual((saved, errors), (['place_of_birth'], {}))
+        self.assertEqual(application.pk, inserted.pk)
+        inserted.refresh_from_db()
+        self.assertEqual((inserted.city, inserted.place_of_birth), ('Lagos', 'Abuja'))
+        self.assertEqual(Applicant.save_if_new(Application(user=user)).pk, inserted.pk)
+
+
+
+class ApplicationFormTests(TestCase):
+    def form_data(self, country):
+        data = {}
+        for name, field in StudentApplicationForm().fields.items():
+            if field.required:
+                data[name] = 'x'
+        data.update(
+            passport_issue_date='2020-01-01', passport_expiry_date='2030-01-01', date_of_birth='2008-05-01',
+            email='applicant@example.com', country_of_interest=country.pk, declaration_agreed='on', city='Abuja',
+        )
+        return data
+
+    def test_submit_saves_onto_the_row_a_parallel_request_inserted(self):
+        user = User.objects.create_user('applicant', password='secret')
+        country = Country.objects.create(name='Canada', processing_fee=Decimal('1000.00'))
+        cache.clear()
+        self.addCleanup(cache.clear)
+        cache.set(RATE_CACHE_KEY, {'rate': Decimal('1500'), 'fetched_at': time.time()})
+        client = Client()
+        client.login(username='applicant', password='secret')
+        # The request loaded no application, then an upload of the same user inserted it
+        inserted = Application.objects.create(user=user, city='Lagos')
+        with mock.patch.object(Applicant, 'get_student_application', lambda applicant: Application(user=applicant.user)):
+            response = client.post(reverse('portal:student_application_form'), self.form_data(country))
+        self.assertEqual(response.status_code, 200, response.content)
+        inserted.refresh_from_db()
+        self.assertEqual(inserted.city, 'Abuja')
+        self.assertEqual(Application.objects.filter(user=user).count(), 1)
+
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        self.upload_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.upload_dir.cleanup)
+        upload_dir_setting = override_settings(CHUNKED_UPLOAD_DIR=self.upload_dir.name)
+        upload_dir_setting.enable()
+        self.addCleanup(upload_dir_setting.disable)
+        application = Application.objects.create(user=User.objects.create_user('applicant'))
+        self.session = UploadSession.objects.create(
+            application=application, field_name='birth_certificate_upload', filename='birth.pdf', size=8,
+        )
+
+    def append(self, offset, chunk, checksum=None):
+        digest = checksum or base64.b64encode(hashlib.sha256(chunk).digest()).decode()
+        append_chunk(self.session, io.BytesIO(chunk), offset, f'sha256 {digest}')
+
+    def test_chunks_are_appended_at_the_received_offset(self):
+        self.append(0, b'%PDF-1')
+        self.append(6, b'.4')
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.offset, 8)
+        with open(part_path(self.session), 'rb') as part:
+            self.assertEqual(part.read(), b'%PDF-1.4')
+
+    def test_rejected_chunks_leave_the_part_file_unchanged(self):
+        self.append(0, b'%PDF-1')
+        for offset, chunk, checksum, status in [
+            (0, b'%PDF-1', None, 409),
+            (6, b'.4', base64.b64encode(hashlib.sha256(b'other').digest()).decode(), 460),
+            (6, b'.4 and more', None, 413),
+        ]:
+            with self.assertRaises(UploadError) as raised:
+                self.append(offset, chunk, checksum)
+            self.assertEqual(raised.exception.status, status)
+        self.assertEqual(self.session.offset, 6)
+        with open(part_path(self.session), 'rb') as part:
+            self.assertEqual(part.read(), b'%PDF-1')
+
+    def test_chunk_raced_by_another_request_is_refused(self):
+        stale_session = UploadSession.objects.get(pk=self.session.pk)
+        self.append(0, b'%PDF-1')
+        digest = base64.b64encode(hashlib.sha256(b'%PDF-7').digest()).decode()
+        with self.assertRaises(UploadError) as raised:
+            append_chunk(stale_session, io.BytesIO(b'%PDF-7'), 0, f'sha256 {digest}')
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(stale_session.offset, 6)
+        with open(part_path(self.session), 'rb') as part:
+            self.assertEqual(part.read(), b'%PDF-1')
+        self.assertEqual(os.listdir(self.upload_dir.name), [os.path.basename(part_path(self.session))])
+
+    def test_first_chunk_must_be_an_allowed_type(self):
+        with self.assertRaises(UploadError) as raised:
+            self.append(0, b'PK\x03\x04zip')
+        self.assertEqual(raised.exception.status, 415)
+        self.assertEqual(self.session.offset, 0)
+
+
+class InspectingUploadHandlerTests(TestCase):
+    def post(self, field_name, content):
+        request = RequestFactory().post('/', {field_name: SimpleUploadedFile('upload', content)})
+        request.upload_handlers = [InspectingUploadHandler(request)]
+        return request
+
+    def test_accepted_files_are_hashed(self):
+        request = self.post('birth_certificate_upload', b'%PDF-1.4 birth certificate')
+        uploaded_file = request.FILES['birth_certificate_upload']
+        self.assertEqual(uploaded_file.content_hash, hashlib.sha256(b'%PDF-1.4 birth certificate').hexdigest())
+
+    def test_wrong_type_and_oversized_files_are_dropped(self):
+        for field_name, content, message in [
+            ('passport_photograph_upload', b'%PDF-1.4 not a photograph', 'File type not allowed'),
+            ('school_certificate_upload', b'PK\x03\x04 a zip archive', 'File type not allowed'),
+            ('international_passport_upload', b'%PDF-' + b'0' * (10 * 1024 * 1024), 'File is too large'),
+        ]:
+            request = self.post(field_name, content)
+            self.assertNotIn(field_name, request.FILES)
+            self.assertIn(message, request.rejected_uploads[field_name][0])
+
+    def test_upload_views_inspect_files_after_the_csrf_check(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(User.objects.create_user('applicant'))
+        url = reverse('portal:student_application_upload', args=['birth_certificate_upload'])
+        upload = lambda: {'birth_certificate_upload': SimpleUploadedFile('birth.pdf', b'PK\x03\x04 a zip archive')}
+        self.assertEqual(client.post(url, upload()).status_code, 403)
+
+        client.cookies['csrftoken'] = token = 'a' * 32
+        response = client.post(url, upload(), HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('File type not allowed', response.json()['errors']['birth_certificate_upload'][0])
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_root_setting = override_settings(MEDIA_ROOT=media_root.name)
+        media_root_setting.enable()
+        self.addCleanup(media_root_setting.disable)
+        self.application = Application.objects.create(user=User.objects.create_user('applicant'))
+
+    def upload(self, document_type, content):
+        return Document.objects.create(
+            application=self.application, document_type=document_type,
+            file=SimpleUploadedFile('scan.PDF', content),
+        )
+
+    def test_identical_uploads_share_one_counted_blob(self):
+        passport = self.upload(Document.DocumentType.INTERNATIONAL_PASSPORT, b'%PDF-1.4 scan')
+        certificate = self.upload(Document.DocumentType.BIRTH_CERTIFICATE, b'%PDF-1.4 scan')
+        digest = hashlib.sha256(b'%PDF-1.4 scan').hexdigest()
+        self.assertEqual(passport.file.name, f'documents/{digest[:2]}/{digest[2:4]}/{digest}.pdf')
+        self.assertEqual(certificate.file.name, passport.file.name)
+        self.assertEqual(passport.display_name, 'scan.PDF')
+        self.assertEqual(StoredBlob.objects.get(name=passport.file.name).ref_count, 2)
+
+        certificate.file = SimpleUploadedFile('other.pdf', b'%PDF-1.4 other')
+        certificate.save()
+        passport.delete()
+        self.assertEqual(StoredBlob.objects.get(name=passport.file.name).ref_count, 0)
+        self.assertEqual(StoredBlob.objects.get(name=certificate.file.name).ref_count, 1)
+
+    def test_garbage_collector_removes_old_orphans_only(self):
+        document = self.upload(Document.DocumentType.INTERNATIONAL_PASSPORT, b'%PDF-1.4 first')
+        replaced_name = document.file.name
+        document.file = SimpleUploadedFile('second.pdf', b'%PDF-1.4 second')
+        document.save()
+        storage = document.file.storage
+        week_ago = (timezone.now() - timedelta(days=7)).timestamp()
+        for name in (replaced_name, document.file.name):
+            os.utime(storage.path(name), (week_ago, week_ago))
+
+        collector = MediaGarbageCollector(grace_period=8 * 24 * 3600, action='delete')
+        collector.run()
+        self.assertEqual((collector.orphans, collector.in_grace), (0, 1))
+
+        collector = MediaGarbageCollector(grace_period=24 * 3600, batch_size=1, action='delete')
+        collector.run()
+        self.assertEqual(collector.orphans, 1)
+        self.assertEqual(collector.reclaimed_bytes, len(b'%PDF-1.4 first'))
+        self.assertFalse(storage.exists(replaced_name))
+        self.assertTrue(storage.exists(document.file.name))
+        self.assertFalse(StoredBlob.objects.filter(name=replaced_name).exists())
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=30)
+
+    def fail(self):
+        raise ConnectionError('down')
+
+    def trip(self):
+        for _ in range(self.breaker.failure_threshold):
+            with self.assertRaises(ConnectionError):
+                self.breaker.call(self.fail)
+
+    def expire_reset_timeout(self):
+        self.breaker.opened_at -= self.breaker.reset_timeout
+
+    def test_opens_after_consecutive_failures(self):
+        with self.assertRaises(ConnectionError):
+            self.breaker.call(self.fail)
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+        self.trip()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda: 'ok')
+        self.assertEqual(self.breaker.stats()['trips'], 1)
+        self.assertEqual(self.breaker.stats()['rejected'], 1)
+
+    def test_stays_open_until_the_reset_timeout(self):
+        self.trip()
+        self.breaker.opened_at -= self.breaker.reset_timeout - 1
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda: 'ok')
+        self.breaker.opened_at -= 1
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+
+    def test_half_open_trial_success_closes_and_rejects_concurrent_calls(self):
+        self.trip()
+        self.expire_reset_timeout()
+
+        def trial():
+            self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.call(lambda: 'concurrent')
+            return 'ok'
+
+        self.assertEqual(self.breaker.call(trial), 'ok')
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.consecutive_failures, 0)
+
+    def test_half_open_trial_failure_reopens(self):
+        self.trip()
+        self.expire_reset_timeout()
+        with self.assertRaises(ConnectionError):
+            self.breaker.call(self.fail)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.stats()['trips'], 2)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda: 'ok')
+        self.expire_reset_timeout()
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+
+    def test_addresses_missing_from_the_geoip_database_do_not_trip_the_breaker(self):
+        _breakers.pop('geoip', None)
+        self.addCleanup(_breakers.pop, 'geoip', None)
+        country_cache.clear()
+        self.addCleanup(country_cache.clear)
+        reader = mock.Mock()
+        reader.country.side_effect = geoip2.errors.AddressNotFoundError('not found')
+        with mock.patch('portal.utils.get_geoip_reader', return_value=reader):
+            for network in range(10):
+                self.assertIsNone(get_country_code(f'10.0.{network}.1'))
+        self.assertEqual(reader.country.call_count, 10)
+        self.assertEqual(_breakers['geoip'].state, CircuitBreaker.CLOSED)
+
+
+@override_settings(EXCHANGE_RATE_TTL=900, EXCHANGE_RATE_FALLBACK='1650.00')
+class ExchangeRateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        thread_patcher = mock.patch('portal.rates.threading.Thread')
+        self.Thread = thread_patcher.start()
+        self.addCleanup(thread_patcher.stop)
+
+    def test_fresh_cached_rate_is_served_without_queries(self):
+        cache.set(RATE_CACHE_KEY, {'rate': Decimal('1500'), 'fetched_at': time.time()})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_usd_to_ngn_rate(), Decimal('1500'))
+        self.Thread.assert_not_called()
+
+    def test_cold_cache_uses_the_latest_stored_rate(self):
+        ExchangeRate.objects.create(rate=Decimal('1400'), fetched_at=timezone.now() - timedelta(hours=1))
+        ExchangeRate.objects.create(rate=Decimal('1450'))
+        self.assertEqual(get_usd_to_ngn_rate(), Decimal('1450'))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_usd_to_ngn_rate(), Decimal('1450'))
+        self.Thread.assert_not_called()
+
+    def test_fallback_is_cached_until_a_rate_is_recorded(self):
+        self.assertEqual(get_usd_to_ngn_rate(), Decimal('1650.00'))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_usd_to_ngn_rate(), Decimal('1650.00'))
+        self.assertEqual(self.Thread.call_count, 1)
+
+    def test_stale_rate_is_served_while_one_refresh_runs(self):
+        cache.set(RATE_CACHE_KEY, {'rate': Decimal('1500'), 'fetched_at': time.time() - 901})
+        self.assertEqual(get_usd_to_ngn_rate(), Decimal('1500'))
+        self.assertEqual(get_usd_to_ngn_rate(), Decimal('1500'))
+        self.assertEqual(self.Thread.call_count, 1)
+
+        with mock.patch('portal.rates.fetch_usd_to_ngn_rate', return_value=Decimal('1600')):
+            self.Thread.call_args.kwargs['target']()
+        self.assertEqual(get_usd_to_ngn_rate(), Decimal('1600'))
+        self.assertEqual(ExchangeRate.objects.get().rate, Decimal('1600'))
+        self.assertEqual(cache.get(PRICE_TABLE_CACHE_KEY)['rate'], Decimal('1600'))
+
+    def test_failed_refresh_keeps_the_cached_rate(self):
+        cache.set(RATE_CACHE_KEY, {'rate': Decimal('1500'), 'fetched_at': time.time() - 901})
+        with mock.patch('portal.rates.fetch_usd_to_ngn_rate', return_value=None):
+            self.assertIsNone(refresh_usd_to_ngn_rate())
+        self.assertEqual(get_usd_to_ngn_rate(), Decimal('1500'))
+        self.assertFalse(ExchangeRate.objects.exists())
+
+
+class CountryLookupCacheTests(TestCase):
+    def setUp(self):
+        country_cache.clear()
+        self.addCleanup(country_cache.clear)
+        self.reader = mock.Mock()
+        self.reader.country.return_value.country.iso_code = 'NG'
+        reader_patcher = mock.patch('portal.utils.get_geoip_reader', return_value=self.reader)
+        reader_patcher.start()
+        self.addCleanup(reader_patcher.stop)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        lookups = CountryLookupCache(max_size=2, ttl=60)
+        lookups.set('a', 'NG')
+        lookups.set('b', 'GH')
+        self.assertEqual(lookups.get('a'), (True, 'NG'))
+        lookups.set('c', 'KE')
+        self.assertEqual(lookups.get('b'), (False, None))
+        self.assertEqual(lookups.get('a'), (True, 'NG'))
+        self.assertEqual(lookups.get('c'), (True, 'KE'))
+        self.assertEqual(lookups.stats()['size'], 2)
+
+    def test_entries_expire_after_the_ttl(self):
+        lookups = CountryLookupCache(max_size=2, ttl=60)
+        with mock.patch('portal.utils.time') as clock:
+            clock.monotonic.return_value = 1000
+            lookups.set('a', 'NG')
+            clock.monotonic.return_value = 1059
+            self.assertEqual(lookups.get('a'), (True, 'NG'))
+            clock.monotonic.return_value = 1060
+            self.assertEqual(lookups.get('a'), (False, None))
+        self.assertEqual(lookups.stats()['size'], 0)
+        self.assertEqual((lookups.hits, lookups.misses), (1, 1))
+
+    @override_settings(GEOIP_CACHE_BY_PREFIX=True)
+    def test_addresses_in_one_network_share_a_lookup(self):
+        self.assertEqual(get_country_code('41.58.1.10'), 'NG')
+        self.assertEqual(get_country_code('41.58.1.200'), 'NG')
+        self.assertEqual(get_country_code('2c0f:f5c0:1::1'), 'NG')
+        self.assertEqual(get_country_code('2c0f:f5c0:1:ffff::2'), 'NG')
+        self.assertEqual(self.reader.country.call_count, 2)
+        self.assertEqual(country_cache.get('41.58.1.0/24'), (True, 'NG'))
+        self.assertEqual(country_cache.get('2c0f:f5c0:1::/48'), (True, 'NG'))
+
+        get_country_code('41.58.2.10')
+        get_country_code('2c0f:f5c0:2::1')
+        self.assertEqual(self.reader.country.call_count, 4)
+
+    @override_settings(GEOIP_CACHE_BY_PREFIX=False)
+    def test_addresses_are_keyed_individually_without_prefixes(self):
+        get_country_code('41.58.1.10')
+        get_country_code('41.58.1.200')
+        self.assertEqual(self.reader.country.call_count, 2)
+        self.assertEqual(country_cache.get('41.58.1.10'), (True, 'NG'))
+
+    def test_addresses_missing_from_the_database_are_cached(self):
+        self.reader.country.side_effect = geoip2.errors.AddressNotFoundError('not found')
+        self.assertIsNone(get_country_code('192.0.2.1'))
+        self.assertIsNone(get_country_code('192.0.2.1'))
+        self.assertEqual(self.reader.country.call_count, 1)
+        self.assertEqual(country_cache.get('192.0.2.0/24'), (True, None))
+
+
+@override_settings(
+    FLUTTERWAVE_CONNECT_TIMEOUT=3.05, FLUTTERWAVE_READ_TIMEOUT=10, FLUTTERWAVE_MAX_RETRIES=2,
+    FLUTTERWAVE_RETRY_BACKOFF=0.5, FLUTTERWAVE_TOTAL_TIMEOUT=12, CIRCUIT_BREAKER_FAILURE_THRESHOLD=5,
+)
+class FlutterwaveClientTests(TestCase):
+    def setUp(self):
+        for name in ('flutterwave_rates', 'flutterwave_verify'):
+            _breakers.pop(name, None)
+            self.addCleanup(_breakers.pop, name, None)
+        self.client = FlutterwaveClient(secret_key='test', base_url='http://flutterwave.test/v3')
+        self.now = 1000.0
+        clock_patcher = mock.patch('portal.flutterwave.time')
+        clock = clock_patcher.start()
+        self.addCleanup(clock_patcher.stop)
+        clock.monotonic.side_effect = lambda: self.now
+        clock.sleep.side_effect = self.sleep
+        self.sleeps = []
+        get_patcher = mock.patch.object(self.client.session, 'get')
+        self.get = get_patcher.start()
+        self.addCleanup(get_patcher.stop)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def response(self, status_code, payload):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(payload).encode()
+        return response
+
+    def rate_response(self):
+        return self.response(200, {'status': 'success', 'data': {'to': {'rate': 1500.5}}})
+
+    def test_retries_outages_with_backoff(self):
+        self.get.side_effect = [requests.ConnectionError(), self.response(503, {}), self.rate_response()]
+        self.assertEqual(self.client.get_rate(), Decimal('1500.5'))
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+        self.assertEqual(_breakers['flutterwave_rates'].stats()['failures'], 2)
+
+    def test_rejected_requests_are_not_retried(self):
+        self.get.return_value = self.response(404, {'status': 'error'})
+        with self.assertRaises(requests.HTTPError):
+            self.client.verify_transaction('unknown')
+        self.assertEqual(self.get.call_count, 1)
+        self.assertEqual(_breakers['flutterwave_verify'].state, CircuitBreaker.CLOSED)
+
+    def test_call_is_cut_short_at_the_total_timeout(self):
+        def time_out(*args, timeout, **kwargs):
+            self.now += max(timeout)
+            raise requests.Timeout()
+
+        self.get.side_effect = time_out
+        with self.assertRaises(requests.Timeout):
+            self.client.get_rate()
+        self.assertEqual(self.get.call_count, 2)
+        self.assertEqual(self.get.call_args_list[1].kwargs['timeout'], (1.5, 1.5))
+        self.assertLessEqual(self.now - 1000.0, 12)
+
+    def test_open_circuit_stops_the_retries(self):
+        breaker = _breakers.setdefault(
+            'flutterwave_rates', CircuitBreaker('flutterwave_rates', failure_threshold=1, reset_timeout=30),
+        )
+        self.get.side_effect = requests.ConnectionError()
+        with self.assertRaises(CircuitOpenError):
+            self.client.get_rate()
+        self.assertEqual(self.get.call_count, 1)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+class FlutterwaveWebhookTests(TestCase):
+    def setUp(self):
+        application = Application.objects.create(user=User.objects.create_user('applicant'))
+        self.payment = Payment.objects.create(
+            application=application, amount=Decimal('15.00'), currency='USD', amount_usd=Decimal('15.00'),
+            purpose=Payment.PaymentPurpose.STUDENT_APP_FEE, tx_ref='hadey-1',
+        )
+        client_patcher = mock.patch('portal.views.get_flutterwave_client')
+        self.verify = client_patcher.start().return_value.verify_transaction
+        self.addCleanup(client_patcher.stop)
+
+    def callback(self):
+        return self.client.get(reverse('portal:payment_callback'), {'tx_ref': 'hadey-1', 'transaction_id': '42'})
+
+    def test_verified_payment_is_marked_successful(self):
+        self.verify.return_value = {'tx_ref': 'hadey-1', 'amount': 15.0, 'status': 'successful'}
+        self.assertRedirects(self.callback(), reverse('portal:dashboard'), fetch_redirect_response=False)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.SUCCESSFUL)
+
+    def test_unreachable_flutterwave_asks_for_redelivery(self):
+        for error in (CircuitOpenError('open'), requests.ConnectTimeout()):
+            self.verify.side_effect = error
+            with self.assertLogs('portal.views', 'WARNING'):
+                self.assertEqual(self.callback().status_code, 503)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+
+    def test_unknown_transaction_is_refused(self):
+        self.verify.return_value = {'tx_ref': 'unknown', 'amount': 15.0}
+        with self.assertLogs('portal.views', 'WARNING') as logs:
+            self.assertEqual(self.callback().status_code, 400)
+        self.assertIn('DoesNotExist', logs.output[0])
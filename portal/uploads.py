@@ -0,0 +1,350 @@
+# portal/uploads.py
+
+import base64
+import binascii
+import hashlib
+import os
+import shutil
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import SkipFile, StopUpload, TemporaryFileUploadHandler
+from django.db import transaction
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from .inventory import STUDENT_DOCUMENT_UPLOADS, WORK_DOCUMENT_UPLOADS
+from .models import Application, Document, UploadSession
+from .storage import file_hash
+
+DocumentType = Document.DocumentType
+
+# Size of the reads from the request stream while a chunk is appended.
+READ_SIZE = 64 * 1024
+
+# Leading bytes of a file that identify its type.
+SNIFF_BYTES = 16
+SIGNATURES = {
+    'PDF': [b'%PDF-'],
+    'JPEG': [b'\xff\xd8\xff'],
+    'PNG': [b'\x89PNG\r\n\x1a\n'],
+    'DOCX': [b'PK\x03\x04'],
+    'DOC': [b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'],
+}
+IMAGE_KINDS = ('JPEG', 'PNG', 'WEBP')
+SCAN_KINDS = ('PDF', *IMAGE_KINDS)
+FORM_KINDS = (*SCAN_KINDS, 'DOCX', 'DOC')
+
+MB = 1024 * 1024
+
+
+class UploadError(Exception):
+    """A rejected upload or chunk, with the HTTP status the view answers with."""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def sniff(head):
+    """The kind of file ('PDF', 'JPEG', ...) its first SNIFF_BYTES bytes show, or None."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    for kind, signatures in SIGNATURES.items():
+        if any(head.startswith(signature) for signature in signatures):
+            return kind
+    return None
+
+
+class UploadLimit:
+    """The largest size and the kinds of file accepted for one upload."""
+    def __init__(self, max_size, kinds):
+        self.max_size = max_size
+        self.kinds = kinds
+
+    def check_size(self, size):
+        if size > self.max_size:
+            raise UploadError(f'File is too large, the limit is {self.max_size // MB} MB.', status=413)
+
+    def check_head(self, head):
+        if sniff(head) not in self.kinds:
+            raise UploadError(f'File type not allowed. Upload a {", ".join(self.kinds[:-1])} or {self.kinds[-1]} file.', status=415)
+
+
+PHOTOGRAPH_LIMIT = UploadLimit(5 * MB, IMAGE_KINDS)
+# Scans of identity documents and certificates, and forms or letters that
+# may also come as Word documents
+SCAN_LIMIT = UploadLimit(10 * MB, SCAN_KINDS)
+FORM_LIMIT = UploadLimit(10 * MB, FORM_KINDS)
+
+DOCUMENT_TYPE_LIMITS = {
+    DocumentType.INTERNATIONAL_PASSPORT: SCAN_LIMIT,
+    DocumentType.SCHOOL_CERTIFICATE: SCAN_LIMIT,
+    DocumentType.BIRTH_CERTIFICATE: SCAN_LIMIT,
+    DocumentType.WORK_EXPERIENCE_LETTER: FORM_LIMIT,
+    DocumentType.ADMISSION_LETTER: FORM_LIMIT,
+    DocumentType.BLANK_ADMISSION_FORM: FORM_LIMIT,
+    DocumentType.FILLED_ADMISSION_FORM: FORM_LIMIT,
+    DocumentType.RESUME_CV: FORM_LIMIT,
+    DocumentType.JOB_OFFER: FORM_LIMIT,
+    DocumentType.BLANK_EMPLOYMENT_FORM: FORM_LIMIT,
+    DocumentType.FILLED_EMPLOYMENT_FORM: FORM_LIMIT,
+}
+
+# Limit of each upload field by name: the application forms' uploads and the
+# `file` of DocumentUploadForm (any type).
+FIELD_UPLOAD_LIMITS = {
+    'passport_photograph_upload': PHOTOGRAPH_LIMIT,
+    **{field_name: DOCUMENT_TYPE_LIMITS[document_type] for field_name, document_type in STUDENT_DOCUMENT_UPLOADS.items()},
+    **{field_name: DOCUMENT_TYPE_LIMITS[document_type] for field_name, document_type in WORK_DOCUMENT_UPLOADS.items()},
+    'file': FORM_LIMIT,
+}
+
+
+class InspectingUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams uploaded files to a temporary file like Django's default handler,
+    checking each against its FIELD_UPLOAD_LIMITS entry as it arrives: the
+    type from the magic bytes of the first chunk, the size as bytes come in.
+    A file of the wrong type is dropped at that point; an oversized one stops
+    the upload without reading the rest of the body. The reason is left in
+    request.rejected_uploads (see add_rejected_upload_errors). Accepted files
+    get the sha256 hex digest of their content as `content_hash`.
+
+    Installed on the portal's upload views only, with inspect_uploads.
+
+    Small files go to a temporary file too, so storage can move it into
+    MEDIA_ROOT instead of copying it.
+    """
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.limit = FIELD_UPLOAD_LIMITS.get(field_name)
+        self.head = b''
+        self.received = 0
+        self.sha256 = hashlib.sha256()
+        if self.limit and content_length is not None:
+            self._check_size(content_length)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.limit:
+            self._check_size(self.received)
+            if len(self.head) < SNIFF_BYTES:
+                self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+                if len(self.head) == SNIFF_BYTES:
+                    self._check_head(self.head)
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        # Files shorter than SNIFF_BYTES are only checked once complete
+        if self.limit and len(self.head) < SNIFF_BYTES:
+            try:
+                self.limit.check_head(self.head)
+            except UploadError as e:
+                self._reject(e)
+                self.file.close()
+                return None
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.content_hash = self.sha256.hexdigest()
+        return uploaded_file
+
+    def _check_head(self, head):
+        try:
+            self.limit.check_head(head)
+        except UploadError as e:
+            self._reject(e)
+            # The parser closes (and so deletes) the temporary file and skips the rest of this file
+            raise SkipFile()
+
+    def _check_size(self, size):
+        try:
+            self.limit.check_size(size)
+        except UploadError as e:
+            self._reject(e)
+            # Stops parsing without reading (and discarding) the rest of the body
+            raise StopUpload(connection_reset=True)
+
+    def _reject(self, error):
+        if not hasattr(self.request, 'rejected_uploads'):
+            self.request.rejected_uploads = {}
+        self.request.rejected_uploads[self.field_name] = [error.message]
+
+
+def inspect_uploads(view_func):
+    """
+    Check the files uploaded to a view with InspectingUploadHandler. The view
+    must report request.rejected_uploads, e.g. with add_rejected_upload_errors.
+
+    The handler has to be in place before request.POST is read, which
+    CsrfViewMiddleware does, so the CSRF check is made here instead, after.
+    """
+    protected_view = csrf_protect(view_func)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers.insert(0, InspectingUploadHandler(request))
+        return protected_view(request, *args, **kwargs)
+    return csrf_exempt(wrapper)
+
+
+def add_rejected_upload_errors(request, form):
+    """
+    Report the files InspectingUploadHandler rejected as errors of their form
+    fields, in place of the "required" error their absence may have caused.
+    """
+    for field_name, messages in getattr(request, 'rejected_uploads', {}).items():
+        if field_name in form.fields:
+            form.errors.pop(field_name, None)
+            form.add_error(field_name, messages)
+
+
+def upload_fields(application):
+    """Upload fields of the application's form: the passport photograph and its documents."""
+    uploads = STUDENT_DOCUMENT_UPLOADS if isinstance(application, Application) else WORK_DOCUMENT_UPLOADS
+    return ['passport_photograph_upload', *uploads]
+
+
+def clean_upload(form_class, field_name, uploaded_file):
+    """
+    Validate an uploaded file with the form's own field, e.g. ImageField checks
+    the photograph is an image. Raises ValidationError.
+    """
+    field = form_class().fields[field_name]
+    field.required = True
+    return field.clean(uploaded_file)
+
+
+def store_upload(application, field_name, uploaded_file):
+    """
+    Store a validated upload of an application form: the passport photograph on
+    the application itself, anything else as the Document of its type.
+    Returns the stored FieldFile.
+    """
+    if field_name == 'passport_photograph_upload':
+        application.passport_photograph = uploaded_file
+        application.save(update_fields=['passport_photograph', 'updated_at'])
+        return application.passport_photograph
+    is_student = isinstance(application, Application)
+    uploads = STUDENT_DOCUMENT_UPLOADS if is_student else WORK_DOCUMENT_UPLOADS
+    owner = 'application' if is_student else 'work_application'
+    document, _ = Document.objects.update_or_create(
+        **{owner: application}, document_type=uploads[field_name],
+        defaults={'file': uploaded_file}
+    )
+    return document.file
+
+
+# --- Resumable uploads ---
+# A tus-style protocol: the browser creates an UploadSession for a file, then
+# PATCHes it in chunks, each with its Upload-Offset and an Upload-Checksum
+# ("sha256 <base64 digest>") of the chunk. Chunks are streamed to disk, then
+# appended to a part file, so worker memory stays flat. After a dropped connection the browser asks
+# for the offset (HEAD) and carries on from there.
+
+def part_path(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{session.pk}.part')
+
+
+def parse_checksum(header):
+    """The sha256 digest of an Upload-Checksum header, or UploadError."""
+    algorithm, _, encoded = (header or '').partition(' ')
+    if algorithm != 'sha256':
+        raise UploadError('Upload-Checksum must be "sha256 <base64 digest>".')
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        raise UploadError('Upload-Checksum digest is not valid base64.')
+
+
+def append_chunk(session, stream, offset, checksum):
+    """
+    Append one chunk, read from `stream`, to the session's part file. The
+    chunk must start at the session's current offset and match its checksum,
+    otherwise it is discarded and the part file left as it was.
+
+    The chunk is streamed to a file of its own with no transaction open, so a
+    slow client never holds a database lock. Only then is the offset advanced,
+    with an update conditional on the offset the chunk started at; of two
+    requests sending the same chunk, the second gets a 409.
+    """
+    if offset != session.offset:
+        raise UploadError(f'Upload-Offset {offset} does not match the received {session.offset} bytes.', status=409)
+    digest = parse_checksum(checksum)
+    # Same type check as InspectingUploadHandler, on the head of the first chunk
+    limit = FIELD_UPLOAD_LIMITS[session.field_name] if offset == 0 else None
+    head = b''
+
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    chunk_path = f'{part_path(session)}.{uuid.uuid4().hex}.chunk'
+    received = 0
+    sha256 = hashlib.sha256()
+    try:
+        with open(chunk_path, 'w+b') as chunk:
+            while True:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                received += len(data)
+                if received > settings.UPLOAD_CHUNK_MAX_SIZE or offset + received > session.size:
+                    raise UploadError('Chunk is larger than allowed.', status=413)
+                if limit and len(head) < SNIFF_BYTES:
+                    head += data[:SNIFF_BYTES - len(head)]
+                    if len(head) == SNIFF_BYTES:
+                        limit.check_head(head)
+                sha256.update(data)
+                chunk.write(data)
+            if not received:
+                raise UploadError('Chunk is empty.')
+            if limit and len(head) < SNIFF_BYTES:
+                limit.check_head(head)
+            if sha256.digest() != digest:
+                # The status tus uses for a checksum mismatch; the chunk is resent
+                raise UploadError('Chunk checksum does not match.', status=460)
+
+            with transaction.atomic():
+                claimed = UploadSession.objects.filter(pk=session.pk, offset=offset).update(
+                    offset=offset + received, updated_at=timezone.now()
+                )
+                if not claimed:
+                    session.refresh_from_db(fields=['offset'])
+                    raise UploadError(f'Upload-Offset {offset} does not match the received {session.offset} bytes.', status=409)
+                # A local copy of at most UPLOAD_CHUNK_MAX_SIZE; if it fails the offset is rolled back
+                chunk.seek(0)
+                path = part_path(session)
+                with open(path, 'r+b' if os.path.exists(path) else 'w+b') as part:
+                    # Drops the tail of an earlier chunk that was cut off mid-write
+                    part.seek(offset)
+                    part.truncate()
+                    shutil.copyfileobj(chunk, part, READ_SIZE)
+    finally:
+        os.remove(chunk_path)
+
+    session.offset = offset + received
+
+
+def complete_upload(session, form_class):
+    """
+    Validate and store a fully received upload. Returns the stored FieldFile,
+    or raises ValidationError if the form field rejects the file. Either way
+    the session and its part file are removed.
+    """
+    application = session.application or session.work_application
+    try:
+        with open(part_path(session), 'rb') as part:
+            uploaded_file = UploadedFile(part, name=session.filename, size=session.size)
+            uploaded_file.content_hash = file_hash(part)
+            clean_upload(form_class, session.field_name, uploaded_file)
+            part.seek(0)
+            return store_upload(application, session.field_name, uploaded_file)
+    finally:
+        discard_session(session)
+
+
+def discard_session(session):
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
@@ -11,20 +11,32 @@ urlpatterns = [
 
     # --- Student Application URLs ---
     path('student/application/', views.student_application_form_view, name='student_application_form'),
+    path('student/application/autosave/', views.student_application_autosave, name='student_application_autosave'),
+    path('student/application/upload/<str:field_name>/', views.student_application_upload, name='student_application_upload'),
+    path('student/application/uploads/', views.student_application_resumable_upload, name='student_application_resumable_upload'),
     path('student/documents/', views.student_document_submission_view, name='student_document_submission'),
     path('student/agency-fee/', views.student_agency_fee_view, name='student_agency_fee'),
     path('student/visa-application/', views.student_visa_application_view, name='student_visa_application'),
 
     # --- Worker Application URLs ---
     path('worker/application/', views.work_application_form_view, name='work_application_form'),
+    path('worker/application/autosave/', views.work_application_autosave, name='work_application_autosave'),
+    path('worker/application/upload/<str:field_name>/', views.work_application_upload, name='work_application_upload'),
+    path('worker/application/uploads/', views.work_application_resumable_upload, name='work_application_resumable_upload'),
     path('worker/employment-form/', views.work_employment_form_view, name='work_employment_form'),
     path('worker/job-offer/', views.work_job_offer_view, name='work_job_offer'),
     path('worker/visa-application/', views.work_visa_application_view, name='work_visa_application'),
 
+    # --- Resumable Upload URLs ---
+    path('uploads/<uuid:session_id>/', views.upload_session_view, name='upload_session'),
+
     # --- Generic Payment URLs ---
     path('payment/initiate/', views.initiate_payment, name='initiate_payment'),
     path('payment/callback/', views.flutterwave_webhook, name='payment_callback'),
 
     # --- Admin PDF Generation URL ---
     path('admins/pdf/<str:app_type>/<int:app_id>/', views.generate_pdf_view, name='generate_pdf'),
+
+    # --- Admin Runtime Metrics URL ---
+    path('admins/metrics/', views.metrics_view, name='metrics'),
 ]
@@ -1,12 +1,134 @@
 # portal/utils.py
 import geoip2.database
-import requests
+import geoip2.errors
+import ipaddress
+import threading
+import time
+from collections import OrderedDict
 from django.conf import settings
+from django.core.mail import send_mail
 from decimal import Decimal
 import logging
+from .breakers import CircuitOpenError, get_breaker
+from .rates import get_usd_to_ngn_rate
 
 logger = logging.getLogger(__name__)
 
+# --- GeoIP ---
+# One memory-mapped MaxMind reader is shared by every request served by this
+# worker process. It is opened lazily on the first lookup and never closed.
+_geoip_reader = None
+_geoip_reader_lock = threading.Lock()
+
+
+def get_geoip_reader():
+    """Return the process-wide GeoIP reader, opening it on first use."""
+    global _geoip_reader
+    if _geoip_reader is None:
+        with _geoip_reader_lock:
+            if _geoip_reader is None:
+                _geoip_reader = geoip2.database.Reader(settings.GEOIP_PATH, mode=geoip2.database.MODE_MMAP)
+    return _geoip_reader
+
+
+class CountryLookupCache:
+    """
+    A small thread-safe LRU cache of IP (or network prefix) -> country code,
+    with a time-to-live on every entry and hit/miss counters.
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, country_code) for the key."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, country_code):
+        with self._lock:
+            self._entries[key] = (country_code, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+country_cache = CountryLookupCache(
+    max_size=getattr(settings, 'GEOIP_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'GEOIP_CACHE_TTL', 3600),
+)
+
+
+def _country_cache_key(ip_address):
+    """
+    Key the cache on the IP itself, or on its /24 (IPv4) or /48 (IPv6)
+    network when GEOIP_CACHE_BY_PREFIX is on, since neighbouring addresses
+    almost always resolve to the same country.
+    """
+    ip = ipaddress.ip_address(ip_address)
+    if not getattr(settings, 'GEOIP_CACHE_BY_PREFIX', True):
+        return str(ip)
+    prefix = 24 if ip.version == 4 else 48
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+
+def _is_geoip_failure(exc):
+    # An address missing from the database is an answer, not a broken reader.
+    return not isinstance(exc, geoip2.errors.AddressNotFoundError)
+
+
+def get_country_code(ip_address):
+    """
+    Return the ISO country code for an IP address, or None if it is not in
+    the GeoIP database. Results are served from the in-process cache.
+    """
+    key = _country_cache_key(ip_address)
+    found, country_code = country_cache.get(key)
+    if found:
+        return country_code
+    breaker = get_breaker('geoip', is_failure=_is_geoip_failure)
+    try:
+        country_code = breaker.call(lambda: get_geoip_reader().country(ip_address).country.iso_code)
+    except geoip2.errors.AddressNotFoundError:
+        country_code = None
+    country_cache.set(key, country_code)
+    return country_code
+
+
+def get_geoip_cache_stats():
+    """Hit/miss counters for the GeoIP country cache of this worker."""
+    return country_cache.stats()
+
 def get_client_ip(request):
     """Get the client's IP address from the request."""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -16,80 +138,133 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
-def is_nigerian_user(request):
+COUNTRY_SESSION_KEY = 'portal_client_country'
+
+# Values CDNs use for "unknown" (Cloudflare: XX) and Tor exit nodes (T1).
+UNKNOWN_COUNTRY_CODES = {'', 'XX', 'T1'}
+
+def get_header_country(request):
     """
-    Determine if the user is from Nigeria based on their IP address.
-    Returns True if Nigerian, False otherwise.
+    Return the country code set by a trusted CDN/load balancer in the
+    GEOIP_COUNTRY_HEADER request header, or None if not configured or unknown.
     """
-    try:
+    header = getattr(settings, 'GEOIP_COUNTRY_HEADER', None)
+    if not header:
+        return None
+    value = request.META.get('HTTP_' + header.upper().replace('-', '_'), '').strip().upper()
+    return None if value in UNKNOWN_COUNTRY_CODES else value
+
+def get_client_country(request):
+    """
+    Return the visitor's ISO country code, or None if it can't be determined.
+
+    The trusted proxy header is used when present, otherwise the IP is looked
+    up in GeoIP. The answer is memoised in the session so repeat page views
+    skip classification entirely.
+    """
+    session = getattr(request, 'session', None)
+    if session is not None and COUNTRY_SESSION_KEY in session:
+        return session[COUNTRY_SESSION_KEY] or None
+
+    country_code = get_header_country(request)
+    if country_code is None:
         ip_address = get_client_ip(request)
-        
         # Skip for local development IPs
         if ip_address in ['127.0.0.1', 'localhost', '::1']:
-            # For testing, you can force a value here
-            return False  # Change to True for testing Nigerian flow
-        
-        reader = geoip2.database.Reader(settings.GEOIP_PATH)
-        response = reader.country(ip_address)
-        country_code = response.country.iso_code
-        reader.close()
-        
-        return country_code == 'NG'
+            # For testing, you can force a value here (e.g. 'NG')
+            country_code = None
+        else:
+            country_code = get_country_code(ip_address.strip())
+
+    if session is not None:
+        session[COUNTRY_SESSION_KEY] = country_code or ''
+    return country_code
+
+def is_nigerian_user(request):
+    """
+    Determine if the user is from Nigeria based on their country header or IP address.
+    Returns True if Nigerian, False otherwise.
+    """
+    try:
+        return get_client_country(request) == 'NG'
+    except CircuitOpenError:
+        return False
     except Exception as e:
         logger.error(f"Error detecting country: {e}")
         # Default to False if detection fails
         return False
 
-def get_usd_to_ngn_rate():
+def guarded_send_mail(subject, message, from_email, recipient_list, fail_silently=False, **kwargs):
     """
-    Fetch current USD to NGN exchange rate from Flutterwave.
-    Returns the rate or a fallback rate if API fails.
+    send_mail() behind the 'smtp' circuit breaker. While the circuit is open
+    mail is dropped (and logged) immediately instead of waiting on the SMTP
+    server; otherwise failures are raised unless fail_silently is set.
     """
     try:
-        url = "https://api.flutterwave.com/v3/rates"
-        headers = {
-            "Authorization": f"Bearer {settings.FLUTTERWAVE_SECRET_KEY}"
-        }
-        params = {
-            "from": "USD",
-            "to": "NGN",
-            "amount": "1"
-        }
-        
-        response = requests.get(url, headers=headers, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data.get('status') == 'success':
-            rate = Decimal(str(data['data']['to']['rate']))
-            return rate
-        else:
-            logger.warning("Flutterwave rate API returned non-success status")
-            return Decimal('1650.00')  # Fallback rate
-            
+        return get_breaker('smtp').call(
+            send_mail, subject, message, from_email, recipient_list, fail_silently=False, **kwargs
+        )
+    except CircuitOpenError:
+        logger.warning(f"SMTP circuit is open; dropped mail '{subject}' to {recipient_list}")
+        return 0
     except Exception as e:
-        logger.error(f"Error fetching exchange rate: {e}")
-        return Decimal('1650.00')  # Fallback rate
+        if not fail_silently:
+            raise
+        logger.error(f"Error sending mail '{subject}': {e}")
+        return 0
 
-def convert_usd_to_ngn(usd_amount):
-    """Convert USD amount to NGN using current exchange rate."""
-    rate = get_usd_to_ngn_rate()
+def convert_usd_to_ngn(usd_amount, rate=None):
+    """Convert USD amount to NGN using the given or the current cached exchange rate."""
+    if rate is None:
+        rate = get_usd_to_ngn_rate()
     return (Decimal(str(usd_amount)) * rate).quantize(Decimal('0.01'))
 
+class CurrencyQuote:
+    """
+    A snapshot of the visitor's location and the exchange rate, resolved once
+    per request, that can then price any number of USD amounts.
+    """
+    def __init__(self, is_nigerian, exchange_rate):
+        self.is_nigerian = is_nigerian
+        self.exchange_rate = exchange_rate
+        self.primary_currency = 'NGN' if is_nigerian else 'USD'
+        self.secondary_currency = 'USD' if is_nigerian else 'NGN'
+
+    def price(self, usd_amount, ngn_amount=None):
+        """
+        Currency context for a single USD amount. Pass ngn_amount when it has
+        already been priced (e.g. from the price table).
+        """
+        if ngn_amount is None:
+            ngn_amount = convert_usd_to_ngn(usd_amount, self.exchange_rate)
+        return {
+            'is_nigerian': self.is_nigerian,
+            'usd_amount': usd_amount,
+            'ngn_amount': ngn_amount,
+            'exchange_rate': self.exchange_rate,
+            'primary_currency': self.primary_currency,
+            'secondary_currency': self.secondary_currency,
+        }
+
+    def price_fee(self, fee_price):
+        """Currency context for a {'usd': ..., 'ngn': ...} entry of the price table."""
+        return self.price(fee_price['usd'], fee_price['ngn'])
+
+
+def get_currency_quote(request):
+    """
+    Return the CurrencyQuote for this request, creating it on first use so the
+    GeoIP lookup and rate read happen only once per request.
+    """
+    quote = getattr(request, '_currency_quote', None)
+    if quote is None:
+        quote = CurrencyQuote(is_nigerian_user(request), get_usd_to_ngn_rate())
+        request._currency_quote = quote
+    return quote
+
 def get_currency_context(request, usd_amount):
     """
     Get currency context for templates.
     Returns dictionary with currency information and user location.
     """
-    is_nigerian = is_nigerian_user(request)
-    exchange_rate = get_usd_to_ngn_rate()
-    ngn_amount = convert_usd_to_ngn(usd_amount)
-    
-    return {
-        'is_nigerian': is_nigerian,
-        'usd_amount': usd_amount,
-        'ngn_amount': ngn_amount,
-        'exchange_rate': exchange_rate,
-        'primary_currency': 'NGN' if is_nigerian else 'USD',
-        'secondary_currency': 'USD' if is_nigerian else 'NGN',
-    }
\ No newline at end of file
+    return get_currency_quote(request).price(usd_amount)
@@ -1,31 +1,51 @@
 # portal/views.py
 
+import logging
+import os
 import uuid
-from .utils import get_currency_context, is_nigerian_user
+from .utils import get_currency_quote, get_geoip_cache_stats, guarded_send_mail
+from .autosave import apply_changes
+from .inventory import (
+    DocumentInventory, STUDENT_DOCUMENT_UPLOADS, STUDENT_REQUIRED_UPLOADS,
+    WORK_DOCUMENT_UPLOADS, WORK_REQUIRED_UPLOADS,
+)
+from .ledger import SUMMARY_FIELDS, PaymentLedger, refresh_payment_summary
+from .middleware import full_application
+from .uploads import (
+    FIELD_UPLOAD_LIMITS, UploadError, add_rejected_upload_errors, append_chunk, clean_upload, complete_upload,
+    discard_session, inspect_uploads, store_upload, upload_fields,
+)
+from .storage import IMMUTABLE_CACHE_CONTROL, is_content_addressed
+from .pricing import STUDENT_PURPOSES, WORK_PURPOSES, price_for_purpose
 import json
 import requests
-from decimal import Decimal
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from django.views.static import serve
 from django.http import JsonResponse, HttpResponse
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.urls import reverse
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.contrib.admin.views.decorators import staff_member_required
 from django.template.loader import get_template
 from xhtml2pdf import pisa
+from .breakers import CircuitOpenError, breaker_metrics
+from .flutterwave import FlutterwaveError, get_flutterwave_client, is_outage_error
 from .models import (
-    UserProfile, Application, WorkApplication, Country, Document, 
-    Payment, Testimonial, FeeStructure
+    UserProfile, Application, WorkApplication, Document,
+    Payment, Testimonial, UploadSession, profile_fields
 )
 from .forms import (
     StudentApplicationForm, WorkApplicationForm, DocumentUploadForm, 
     TestimonialForm
 )
 
+logger = logging.getLogger(__name__)
+
 # --- Authentication ---
 def signup_choice_view(request):
     return render(request, 'account/signup_choice.html')
@@ -33,15 +53,24 @@ def signup_choice_view(request):
 # --- Main Dashboard Router ---
 @login_required
 def dashboard(request):
-    profile, _ = UserProfile.objects.get_or_create(user=request.user)
+    profile = request.applicant.get_profile()
     if profile.account_type == UserProfile.AccountType.STUDENT:
         return student_dashboard(request)
     else:
         return worker_dashboard(request)
 
+def _payment_summary(application):
+    """Dashboard context: the next payment due (its label) and the USD still outstanding."""
+    ledger = PaymentLedger(application)
+    next_purpose = ledger.next_payable_purpose()
+    return {
+        'next_payment': Payment.PaymentPurpose(next_purpose).label if next_purpose else None,
+        'amount_outstanding': ledger.amount_outstanding(),
+    }
+
 # --- Student Dashboard & Views ---
 def student_dashboard(request):
-    application, _ = Application.objects.get_or_create(user=request.user)
+    application = request.applicant.get_student_application()
     ALL_STEPS = [
         {'id': Application.ApplicationStatus.STEP_1_APPLICATION_FORM, 'title': 'Application Form', 'number': 1, 'url_name': 'portal:student_application_form'},
         {'id': Application.ApplicationStatus.STEP_2_ADMISSION_FEE, 'title': 'Admission Form', 'number': 2, 'url_name': 'portal:student_document_submission'},
@@ -67,54 +96,46 @@ def student_dashboard(request):
             step_info['status'] = 'pending'
         processed_steps.append(step_info)
     context = { 'application': application, 'steps': processed_steps }
+    context.update(_payment_summary(application))
     return render(request, 'portal/dashboard_student.html', context)
 
 @login_required
+@full_application
+@inspect_uploads
 def student_application_form_view(request):
-    application, _ = Application.objects.get_or_create(user=request.user)
-    payment_made = Payment.objects.filter(
-        application=application, 
-        purpose=Payment.PaymentPurpose.STUDENT_APP_FEE, 
-        status=Payment.PaymentStatus.SUCCESSFUL
-    ).exists()
+    application = request.applicant.get_student_application()
+    inventory = DocumentInventory(application)
+    payment_made = PaymentLedger(application).is_paid(Payment.PaymentPurpose.STUDENT_APP_FEE)
     
-    # Get the default fee from the FeeStructure model
-    default_fee = FeeStructure.objects.filter(fee_type='STUDENT_APP_FEE').first()
-    default_fee_amount = default_fee.amount if default_fee else Decimal('15.00')
-
-    # Use the application's custom fee if it exists, otherwise use the default
-    application_fee_amount = application.custom_application_fee or default_fee_amount
+    # Custom fee if set, otherwise the default, read from the precomputed price table
+    application_fee = price_for_purpose(Payment.PaymentPurpose.STUDENT_APP_FEE, application)
+    application_fee_amount = application_fee['usd']
     
-    currency_context = get_currency_context(request, application_fee_amount)
+    currency_context = get_currency_quote(request).price_fee(application_fee)
     
     
 
     if request.method == 'POST':
+        # Before the form is bound: if a parallel upload inserted the row, the
+        # instance is reloaded from it, which would drop the form's values
+        request.applicant.save_if_new(application)
         form = StudentApplicationForm(request.POST, request.FILES, instance=application)
+        add_rejected_upload_errors(request, form)
         
         is_payment_submission = 'submit_payment' in request.POST
 
         if is_payment_submission:
             if not application.passport_photograph and 'passport_photograph_upload' not in request.FILES:
                 form.add_error('passport_photograph_upload', 'Passport photograph is required to proceed.')
-            if not application.documents.filter(document_type=Document.DocumentType.INTERNATIONAL_PASSPORT).exists() and 'international_passport_upload' not in request.FILES:
-                form.add_error('international_passport_upload', 'International passport is required to proceed.')
-            if not application.documents.filter(document_type=Document.DocumentType.SCHOOL_CERTIFICATE).exists() and 'school_certificate_upload' not in request.FILES:
-                form.add_error('school_certificate_upload', 'School certificate is required to proceed.')
-            if not application.documents.filter(document_type=Document.DocumentType.BIRTH_CERTIFICATE).exists() and 'birth_certificate_upload' not in request.FILES:
-                form.add_error('birth_certificate_upload', 'Birth certificate is required to proceed.')
+            for field_name, message in inventory.missing_uploads(STUDENT_REQUIRED_UPLOADS, request.FILES):
+                form.add_error(field_name, message)
 
         if form.is_valid():
             application_instance = form.save(commit=False)
             if 'passport_photograph_upload' in request.FILES:
                 application_instance.passport_photograph = request.FILES['passport_photograph_upload']
             application_instance.save()
-            document_uploads = {
-                'international_passport_upload': Document.DocumentType.INTERNATIONAL_PASSPORT,
-                'school_certificate_upload': Document.DocumentType.SCHOOL_CERTIFICATE,
-                'birth_certificate_upload': Document.DocumentType.BIRTH_CERTIFICATE,
-            }
-            for field_name, doc_type in document_uploads.items():
+            for field_name, doc_type in STUDENT_DOCUMENT_UPLOADS.items():
                 if field_name in request.FILES:
                     Document.objects.update_or_create(
                         application=application_instance, document_type=doc_type,
@@ -126,42 +147,105 @@ def student_application_form_view(request):
     else:
         form = StudentApplicationForm(instance=application)
     
-    existing_docs = { doc.document_type: doc for doc in application.documents.all() }
     context = {
         'form': form, 'payment_made': payment_made,
-        'existing_docs': existing_docs, 'doc_types': Document.DocumentType,
+        'existing_docs': inventory.by_type, 'doc_types': Document.DocumentType,
         'application_fee_amount': application_fee_amount
     }
 
     context.update(currency_context)
     return render(request, 'portal/student_application_form.html', context)
 
+def _autosave(request, application, form_class):
+    try:
+        changes = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'errors': {'__all__': ['Invalid JSON']}}, status=400)
+    if not isinstance(changes, dict):
+        return JsonResponse({'success': False, 'errors': {'__all__': ['Expected an object of changed fields']}}, status=400)
+    saved, errors = apply_changes(form_class, application, changes)
+    if errors:
+        return JsonResponse({'success': False, 'saved': saved, 'errors': errors}, status=400)
+    return JsonResponse({'success': True, 'saved': saved})
+
+@login_required
+@require_POST
+def student_application_autosave(request):
+    """Saves the fields of the student application form changed since the last save, sent as JSON."""
+    return _autosave(request, request.applicant.get_student_application(), StudentApplicationForm)
+
+def _upload(request, application, form_class, field_name):
+    if field_name not in upload_fields(application):
+        return JsonResponse({'success': False, 'errors': {'__all__': ['Unknown upload field']}}, status=400)
+    # Sent under its own field name, so the upload handler applies that field's limit
+    uploaded_file = request.FILES.get(field_name)
+    rejected = getattr(request, 'rejected_uploads', {})
+    if field_name in rejected:
+        return JsonResponse({'success': False, 'errors': {field_name: rejected[field_name]}}, status=400)
+    try:
+        uploaded_file = clean_upload(form_class, field_name, uploaded_file)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'errors': {field_name: e.messages}}, status=400)
+    request.applicant.save_if_new(application)
+    stored = store_upload(application, field_name, uploaded_file)
+    return JsonResponse({'success': True, 'message': 'File uploaded successfully!', 'name': stored.name, 'url': stored.url})
+
+def _start_resumable_upload(request, application):
+    try:
+        data = json.loads(request.body)
+        field_name, filename, size = data['field_name'], os.path.basename(str(data['filename'])), int(data['size'])
+    except (json.JSONDecodeError, TypeError, KeyError, ValueError):
+        return JsonResponse({'success': False, 'errors': {'__all__': ['Expected field_name, filename and size']}}, status=400)
+    if field_name not in upload_fields(application):
+        return JsonResponse({'success': False, 'errors': {'__all__': ['Unknown upload field']}}, status=400)
+    if size <= 0 or not filename:
+        return JsonResponse({'success': False, 'errors': {field_name: ['The submitted file is empty.']}}, status=400)
+    try:
+        FIELD_UPLOAD_LIMITS[field_name].check_size(size)
+    except UploadError as e:
+        return JsonResponse({'success': False, 'errors': {field_name: [e.message]}}, status=e.status)
+
+    request.applicant.save_if_new(application)
+    owner = 'application' if isinstance(application, Application) else 'work_application'
+    session = UploadSession.objects.create(**{owner: application}, field_name=field_name, filename=filename[-255:], size=size)
+    return JsonResponse({
+        'success': True, 'url': reverse('portal:upload_session', args=[session.pk]),
+        'offset': 0, 'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+    }, status=201)
+
 @login_required
+@require_POST
+@inspect_uploads
+def student_application_upload(request, field_name):
+    """Stores one file of the student application form, sent on its own so uploads run in parallel."""
+    return _upload(request, request.applicant.get_student_application(), StudentApplicationForm, field_name)
+
+@login_required
+@require_POST
+def student_application_resumable_upload(request):
+    """Starts a chunked upload of one file of the student application form, see upload_session_view."""
+    return _start_resumable_upload(request, request.applicant.get_student_application())
+
+@login_required
+@inspect_uploads
 def student_document_submission_view(request):
-    application = request.user.student_application
-    admin_document = Document.objects.filter(
-        application=application, 
-        is_admin_upload=True, 
-        document_type=Document.DocumentType.BLANK_ADMISSION_FORM
-    ).order_by('-uploaded_at').first()
+    application = request.applicant.get_student_application()
+    inventory = DocumentInventory(application)
+    admin_document = inventory.latest(Document.DocumentType.BLANK_ADMISSION_FORM, is_admin_upload=True)
     
-    payment_made = Payment.objects.filter(
-        application=application, 
-        purpose=Payment.PaymentPurpose.ADMISSION_FEE, 
-        status=Payment.PaymentStatus.SUCCESSFUL
-    ).exists()
+    payment_made = PaymentLedger(application).is_paid(Payment.PaymentPurpose.ADMISSION_FEE)
     
-    default_fee = FeeStructure.objects.filter(fee_type='ADMISSION_FEE').first()
-    default_fee_amount = default_fee.amount if default_fee else Decimal('1000.00')
-
-    # Use the application's custom fee if it exists, otherwise use the default
-    admission_fee_amount = application.custom_admission_fee or default_fee_amount
+    # Custom fee if set, otherwise the default, read from the precomputed price table
+    admission_fee = price_for_purpose(Payment.PaymentPurpose.ADMISSION_FEE, application)
+    admission_fee_amount = admission_fee['usd']
 
-    currency_context = get_currency_context(request, admission_fee_amount)
+    currency_context = get_currency_quote(request).price_fee(admission_fee)
 
     if request.method == 'POST':
         form = DocumentUploadForm(request.POST, request.FILES)
+        add_rejected_upload_errors(request, form)
         if form.is_valid():
+            request.applicant.save_if_new(application)
             Document.objects.update_or_create(
                 application=application,
                 document_type=Document.DocumentType.FILLED_ADMISSION_FORM,
@@ -172,11 +256,10 @@ def student_document_submission_view(request):
             return JsonResponse({'success': False, 'errors': form.errors}, status=400)
             
     form = DocumentUploadForm()
-    existing_docs = { doc.document_type: doc for doc in application.documents.all() }
     context = {
         'form': form, 'admin_document': admin_document, 
         'application': application, 'payment_made': payment_made,
-        'existing_docs': existing_docs, 'doc_types': Document.DocumentType,
+        'existing_docs': inventory.by_type, 'doc_types': Document.DocumentType,
         'admission_fee_amount': admission_fee_amount
     }
     context.update(currency_context)
@@ -184,44 +267,31 @@ def student_document_submission_view(request):
 
 @login_required
 def student_agency_fee_view(request):
-    application = request.user.student_application
-    admission_letter = Document.objects.filter(application=application, document_type=Document.DocumentType.ADMISSION_LETTER, is_admin_upload=True).first()
-    full_payment = Payment.objects.filter(application=application, purpose=Payment.PaymentPurpose.AGENCY_FEE_FULL, status=Payment.PaymentStatus.SUCCESSFUL).exists()
-    half_payment_count = Payment.objects.filter(application=application, purpose=Payment.PaymentPurpose.AGENCY_FEE_HALF, status=Payment.PaymentStatus.SUCCESSFUL).count()
-    
-    payment_status = 'none'
-    if full_payment or half_payment_count >= 2:
-        payment_status = 'full_paid'
-    elif half_payment_count == 1:
-        payment_status = 'half_paid'
+    application = request.applicant.get_student_application()
+    admission_letter = DocumentInventory(application).latest(Document.DocumentType.ADMISSION_LETTER, is_admin_upload=True)
+    payment_status = PaymentLedger(application).agency_fee_status()
         
-    # Get the default fee from the FeeStructure model
-    default_fee = FeeStructure.objects.filter(fee_type='AGENCY_FEE').first()
-    default_fee_amount = default_fee.amount if default_fee else Decimal('500.00')
-
-    # Use the application's custom fee if it exists, otherwise use the default
-    total_agency_fee = application.custom_agency_fee or default_fee_amount
-    half_agency_fee = total_agency_fee * Decimal('0.50')
+    # Custom fee if set, otherwise the default, read from the precomputed price table
+    full_agency_fee = price_for_purpose(Payment.PaymentPurpose.AGENCY_FEE_FULL, application)
+    half_agency_fee = price_for_purpose(Payment.PaymentPurpose.AGENCY_FEE_HALF, application)
 
-    full_currency_context = get_currency_context(request, total_agency_fee)
-    half_currency_context = get_currency_context(request, half_agency_fee)
-
-    context.update({
-        'full_currency': full_currency_context,
-        'half_currency': half_currency_context,
-    })
+    # One quote prices both buttons, so location and rate are resolved once
+    quote = get_currency_quote(request)
 
     context = {
         'application': application, 'admission_letter': admission_letter,
-        'payment_status': payment_status, 'total_agency_fee': total_agency_fee,  # Add total fee to context
-        'half_agency_fee': half_agency_fee 
+        'payment_status': payment_status, 'total_agency_fee': full_agency_fee['usd'],  # Add total fee to context
+        'half_agency_fee': half_agency_fee['usd'],
+        'full_currency': quote.price_fee(full_agency_fee),
+        'half_currency': quote.price_fee(half_agency_fee),
     }
     return render(request, 'portal/student_agency_fee.html', context)
 
 @login_required
 def student_visa_application_view(request):
-    application = request.user.student_application
+    application = request.applicant.get_student_application()
     if request.method == 'POST':
+        request.applicant.save_if_new(application)
         if Testimonial.objects.filter(application=application).exists():
             return JsonResponse({'success': False, 'message': 'You have already submitted a testimonial.'}, status=400)
         form = TestimonialForm(request.POST)
@@ -234,8 +304,9 @@ def student_visa_application_view(request):
             return JsonResponse({'success': True, 'message': 'Thank you for your feedback!'})
         else:
             return JsonResponse({'success': False, 'errors': form.errors}, status=400)
-    visa_updates = application.visa_updates.all()
-    testimonial = Testimonial.objects.filter(application=application).first()
+    # An application that hasn't been saved yet has no updates or testimonial
+    visa_updates = application.visa_updates.all() if application.pk else []
+    testimonial = Testimonial.objects.filter(application=application).first() if application.pk else None
     form = TestimonialForm(instance=testimonial)
     context = {
         'application': application, 'visa_updates': visa_updates,
@@ -245,7 +316,7 @@ def student_visa_application_view(request):
 
 # --- Worker Dashboard & Views ---
 def worker_dashboard(request):
-    application, _ = WorkApplication.objects.get_or_create(user=request.user)
+    application = request.applicant.get_work_application()
     ALL_STEPS = [
         {'id': WorkApplication.WorkApplicationStatus.STEP_1_APPLICATION_FORM, 'title': 'Application Form', 'number': 1, 'url_name': 'portal:work_application_form'},
         {'id': WorkApplication.WorkApplicationStatus.STEP_2_EMPLOYMENT_FORM, 'title': 'Employment Processing Form', 'number': 2, 'url_name': 'portal:work_employment_form'},
@@ -271,45 +342,42 @@ def worker_dashboard(request):
             step_info['status'] = 'pending'
         processed_steps.append(step_info)
     context = {'application': application, 'steps': processed_steps}
+    context.update(_payment_summary(application))
     return render(request, 'portal/dashboard_worker.html', context)
 
 @login_required
+@full_application
+@inspect_uploads
 def work_application_form_view(request):
-    application, _ = WorkApplication.objects.get_or_create(user=request.user)
-    payment_made = Payment.objects.filter(
-        work_application=application, 
-        purpose=Payment.PaymentPurpose.WORK_APP_FEE, 
-        status=Payment.PaymentStatus.SUCCESSFUL
-    ).exists()
+    application = request.applicant.get_work_application()
+    inventory = DocumentInventory(application)
+    payment_made = PaymentLedger(application).is_paid(Payment.PaymentPurpose.WORK_APP_FEE)
     
-    default_fee = FeeStructure.objects.filter(fee_type='WORK_APP_FEE').first()
-    default_fee_amount = default_fee.amount if default_fee else Decimal('30.00')
+    # Custom fee if set, otherwise the default, read from the precomputed price table
+    application_fee = price_for_purpose(Payment.PaymentPurpose.WORK_APP_FEE, application)
+    application_fee_amount = application_fee['usd']
 
-    # Use the application's custom fee if it exists, otherwise use the default
-    application_fee_amount = application.custom_application_fee or default_fee_amount
-
-    currency_context = get_currency_context(request, application_fee_amount)
+    currency_context = get_currency_quote(request).price_fee(application_fee)
 
     
     if request.method == 'POST':
+        # Before the form is bound: if a parallel upload inserted the row, the
+        # instance is reloaded from it, which would drop the form's values
+        request.applicant.save_if_new(application)
         form = WorkApplicationForm(request.POST, request.FILES, instance=application)
+        add_rejected_upload_errors(request, form)
         is_payment_submission = 'submit_payment' in request.POST
         if is_payment_submission:
             if not application.passport_photograph and 'passport_photograph_upload' not in request.FILES:
                 form.add_error('passport_photograph_upload', 'Passport photograph is required to proceed.')
-            if not application.documents.filter(document_type=Document.DocumentType.INTERNATIONAL_PASSPORT).exists() and 'international_passport_upload' not in request.FILES:
-                form.add_error('international_passport_upload', 'International passport is required to proceed.')
+            for field_name, message in inventory.missing_uploads(WORK_REQUIRED_UPLOADS, request.FILES):
+                form.add_error(field_name, message)
         if form.is_valid():
             application_instance = form.save(commit=False)
             if 'passport_photograph_upload' in request.FILES:
                 application_instance.passport_photograph = request.FILES['passport_photograph_upload']
             application_instance.save()
-            document_uploads = {
-                'international_passport_upload': Document.DocumentType.INTERNATIONAL_PASSPORT,
-                'educational_certificate_upload': Document.DocumentType.SCHOOL_CERTIFICATE,
-                'work_experience_upload': Document.DocumentType.WORK_EXPERIENCE_LETTER,
-            }
-            for field_name, doc_type in document_uploads.items():
+            for field_name, doc_type in WORK_DOCUMENT_UPLOADS.items():
                 if field_name in request.FILES:
                     Document.objects.update_or_create(
                         work_application=application_instance, document_type=doc_type,
@@ -320,36 +388,95 @@ def work_application_form_view(request):
             return JsonResponse({'success': False, 'errors': form.errors}, status=400)
     else:
         form = WorkApplicationForm(instance=application)
-    existing_docs = { doc.document_type: doc for doc in application.documents.all() }
     context = {
         'form': form, 'payment_made': payment_made,
-        'existing_docs': existing_docs, 'doc_types': Document.DocumentType,
+        'existing_docs': inventory.by_type, 'doc_types': Document.DocumentType,
         'application_fee_amount': application_fee_amount 
     }
     context.update(currency_context)
     return render(request, 'portal/work_application_form.html', context)
 
 @login_required
+@require_POST
+def work_application_autosave(request):
+    """Saves the fields of the work application form changed since the last save, sent as JSON."""
+    return _autosave(request, request.applicant.get_work_application(), WorkApplicationForm)
+
+@login_required
+@require_POST
+@inspect_uploads
+def work_application_upload(request, field_name):
+    """Stores one file of the work application form, sent on its own so uploads run in parallel."""
+    return _upload(request, request.applicant.get_work_application(), WorkApplicationForm, field_name)
+
+@login_required
+@require_POST
+def work_application_resumable_upload(request):
+    """Starts a chunked upload of one file of the work application form, see upload_session_view."""
+    return _start_resumable_upload(request, request.applicant.get_work_application())
+
+@login_required
+@require_http_methods(['GET', 'HEAD', 'PATCH', 'DELETE'])
+def upload_session_view(request, session_id):
+    """
+    A resumable upload. GET/HEAD report the bytes received so far (Upload-Offset),
+    PATCH appends the next chunk, DELETE abandons the upload. The file is
+    validated and stored once its last chunk arrives.
+    """
+    # No transaction or row lock here: a chunk can take a slow client minutes to
+    # send, and append_chunk advances the offset with a conditional update instead
+    session = get_object_or_404(UploadSession, pk=session_id, applicant=request.user)
+
+    if request.method == 'DELETE':
+        discard_session(session)
+        return JsonResponse({'success': True})
+    if request.method != 'PATCH':
+        response = JsonResponse({
+            'success': True, 'offset': session.offset, 'size': session.size, 'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+        })
+        response['Upload-Offset'] = session.offset
+        response['Upload-Length'] = session.size
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return JsonResponse({'success': False, 'errors': {'__all__': ['Upload-Offset header is required']}}, status=400)
+    try:
+        append_chunk(session, request, offset, request.headers.get('Upload-Checksum'))
+    except UploadError as e:
+        return JsonResponse({'success': False, 'offset': session.offset, 'errors': {'__all__': [e.message]}}, status=e.status)
+    if session.offset < session.size:
+        return JsonResponse({'success': True, 'offset': session.offset, 'complete': False})
+
+    field_name = session.field_name
+    form_class = StudentApplicationForm if session.application_id else WorkApplicationForm
+    try:
+        stored = complete_upload(session, form_class)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'errors': {field_name: e.messages}}, status=400)
+    return JsonResponse({
+        'success': True, 'offset': session.size, 'complete': True,
+        'message': 'File uploaded successfully!', 'name': stored.name, 'url': stored.url,
+    })
+
+@login_required
+@inspect_uploads
 def work_employment_form_view(request):
-    application = request.user.work_application
-    admin_document = Document.objects.filter(
-        work_application=application, 
-        is_admin_upload=True, 
-        document_type=Document.DocumentType.BLANK_EMPLOYMENT_FORM
-    ).order_by('-uploaded_at').first()
-    payment_made = Payment.objects.filter(
-        work_application=application, 
-        purpose=Payment.PaymentPurpose.WORK_VISA_50_PERCENT, 
-        status=Payment.PaymentStatus.SUCCESSFUL
-    ).exists()
-    fifty_percent_amount = 0
-    if application.destination_country:
-        fifty_percent_amount = application.destination_country.processing_fee * Decimal('0.50')
+    application = request.applicant.get_work_application()
+    inventory = DocumentInventory(application)
+    admin_document = inventory.latest(Document.DocumentType.BLANK_EMPLOYMENT_FORM, is_admin_upload=True)
+    payment_made = PaymentLedger(application).is_paid(Payment.PaymentPurpose.WORK_VISA_50_PERCENT)
+    fifty_percent_fee = price_for_purpose(Payment.PaymentPurpose.WORK_VISA_50_PERCENT, application)
+    fifty_percent_amount = fifty_percent_fee['usd'] if fifty_percent_fee else 0
     if request.method == 'POST':
         doc_type = request.POST.get('doc_type')
         form = DocumentUploadForm(request.POST, request.FILES)
+        add_rejected_upload_errors(request, form)
         if form.is_valid():
             document_type_enum = Document.DocumentType.RESUME_CV if doc_type == 'cv' else Document.DocumentType.FILLED_EMPLOYMENT_FORM
+            request.applicant.save_if_new(application)
             Document.objects.update_or_create(
                 work_application=application,
                 document_type=document_type_enum,
@@ -359,40 +486,31 @@ def work_employment_form_view(request):
         else:
             return JsonResponse({'success': False, 'errors': form.errors}, status=400)
     form = DocumentUploadForm()
-    existing_docs = { doc.document_type: doc for doc in application.documents.all() }
     context = {
         'form': form, 'admin_document': admin_document, 
         'application': application, 'payment_made': payment_made,
+        'destination_country': request.applicant.destination_country,
         'fifty_percent_amount': fifty_percent_amount,
-        'existing_docs': existing_docs, 'doc_types': Document.DocumentType
+        'existing_docs': inventory.by_type, 'doc_types': Document.DocumentType
     }
-    if fifty_percent_amount:
-        currency_context = get_currency_context(request, fifty_percent_amount)
+    if fifty_percent_fee:
+        currency_context = get_currency_quote(request).price_fee(fifty_percent_fee)
         context.update(currency_context)
     return render(request, 'portal/work_employment_form.html', context)
 
 @login_required
 def work_job_offer_view(request):
-    application = request.user.work_application
+    application = request.applicant.get_work_application()
     if request.method == 'POST':
         application.job_offer_accepted = True
         application.save()
         return JsonResponse({'success': True, 'message': 'Offer accepted successfully!'})
-    job_offer = Document.objects.filter(work_application=application, document_type=Document.DocumentType.JOB_OFFER, is_admin_upload=True).first()
-    fifty_paid = Payment.objects.filter(work_application=application, purpose=Payment.PaymentPurpose.WORK_VISA_50_PERCENT, status=Payment.PaymentStatus.SUCCESSFUL).exists()
-    final_fifty_paid = Payment.objects.filter(work_application=application, purpose=Payment.PaymentPurpose.WORK_VISA_FINAL_50_PERCENT, status=Payment.PaymentStatus.SUCCESSFUL).exists()
-    twenty_five_paid_count = Payment.objects.filter(work_application=application, purpose=Payment.PaymentPurpose.WORK_VISA_25_PERCENT, status=Payment.PaymentStatus.SUCCESSFUL).count()
-    payment_status = 'none'
-    if final_fifty_paid or twenty_five_paid_count >= 2:
-        payment_status = 'full_paid'
-    elif fifty_paid:
-        payment_status = 'half_paid'
-    remaining_50_percent = 0
-    remaining_25_percent = 0
-    if application.destination_country:
-        total_fee = application.destination_country.processing_fee
-        remaining_50_percent = total_fee * Decimal('0.50')
-        remaining_25_percent = total_fee * Decimal('0.25')
+    job_offer = DocumentInventory(application).latest(Document.DocumentType.JOB_OFFER, is_admin_upload=True)
+    payment_status = PaymentLedger(application).job_offer_status()
+    remaining_50_percent_fee = price_for_purpose(Payment.PaymentPurpose.WORK_VISA_FINAL_50_PERCENT, application)
+    remaining_25_percent_fee = price_for_purpose(Payment.PaymentPurpose.WORK_VISA_25_PERCENT, application)
+    remaining_50_percent = remaining_50_percent_fee['usd'] if remaining_50_percent_fee else 0
+    remaining_25_percent = remaining_25_percent_fee['usd'] if remaining_25_percent_fee else 0
 
     
     context = {
@@ -402,19 +520,19 @@ def work_job_offer_view(request):
         'remaining_25_percent': remaining_25_percent
     }
 
-    if remaining_50_percent:
-        full_currency_context = get_currency_context(request, remaining_50_percent)
-        half_currency_context = get_currency_context(request, remaining_25_percent)
+    if remaining_50_percent_fee:
+        quote = get_currency_quote(request)
         context.update({
-            'full_currency': full_currency_context,
-            'half_currency': half_currency_context,
+            'full_currency': quote.price_fee(remaining_50_percent_fee),
+            'half_currency': quote.price_fee(remaining_25_percent_fee),
         })
     return render(request, 'portal/work_job_offer.html', context)
 
 @login_required
 def work_visa_application_view(request):
-    application = request.user.work_application
+    application = request.applicant.get_work_application()
     if request.method == 'POST':
+        request.applicant.save_if_new(application)
         if Testimonial.objects.filter(work_application=application).exists():
             return JsonResponse({'success': False, 'message': 'You have already submitted a testimonial.'}, status=400)
         form = TestimonialForm(request.POST)
@@ -427,17 +545,14 @@ def work_visa_application_view(request):
             return JsonResponse({'success': True, 'message': 'Thank you for your feedback!'})
         else:
             return JsonResponse({'success': False, 'errors': form.errors}, status=400)
-    twenty_five_paid_count = Payment.objects.filter(
-        work_application=application, 
-        purpose__in=[Payment.PaymentPurpose.WORK_VISA_25_PERCENT, Payment.PaymentPurpose.WORK_VISA_REMAINING_25_PERCENT], 
-        status=Payment.PaymentStatus.SUCCESSFUL
-    ).count()
-    final_payment_needed = (twenty_five_paid_count == 1)
-    final_25_percent_amount = 0
-    if application.destination_country:
-        final_25_percent_amount = application.destination_country.processing_fee * Decimal('0.25')
-    visa_updates = application.visa_updates.all()
-    testimonial = Testimonial.objects.filter(work_application=application).first()
+    # Paid 25% of the processing fee at the job offer step, not the other 50%
+    next_purpose = PaymentLedger(application).next_payable_purpose()
+    final_payment_needed = next_purpose == Payment.PaymentPurpose.WORK_VISA_REMAINING_25_PERCENT
+    final_25_percent_fee = price_for_purpose(Payment.PaymentPurpose.WORK_VISA_REMAINING_25_PERCENT, application)
+    final_25_percent_amount = final_25_percent_fee['usd'] if final_25_percent_fee else 0
+    # An application that hasn't been saved yet has no updates or testimonial
+    visa_updates = application.visa_updates.all() if application.pk else []
+    testimonial = Testimonial.objects.filter(work_application=application).first() if application.pk else None
     form = TestimonialForm(instance=testimonial)
     context = {
         'application': application, 'visa_updates': visa_updates,
@@ -446,8 +561,8 @@ def work_visa_application_view(request):
         'final_25_percent_amount': final_25_percent_amount
     }
 
-    if final_25_percent_amount:
-        currency_context = get_currency_context(request, final_25_percent_amount)
+    if final_25_percent_fee:
+        currency_context = get_currency_quote(request).price_fee(final_25_percent_fee)
         context.update(currency_context)
         
     return render(request, 'portal/work_visa_application.html', context)
@@ -462,76 +577,48 @@ def initiate_payment(request):
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
-    fees = {fee.fee_type: fee.amount for fee in FeeStructure.objects.all()}
-    profile = request.user.profile
+    applicant = request.applicant
     application = None
     work_application = None
     
-    if profile.account_type == UserProfile.AccountType.STUDENT:
-        application = request.user.student_application
+    if applicant.is_student:
+        application = applicant.get_student_application()
         customer_email = application.email
         customer_phone = application.phone_number
         customer_name = application.full_name
+        allowed_purposes = STUDENT_PURPOSES
     else:
-        work_application = request.user.work_application
+        work_application = applicant.get_work_application()
         customer_email = work_application.email
         customer_phone = work_application.contact_number
         customer_name = work_application.full_name
+        allowed_purposes = WORK_PURPOSES
 
-    currency = 'USD'
-    
-    if purpose == 'STUDENT_APP_FEE':
-        # Use custom fee if available, otherwise use global default
-        amount = application.custom_application_fee or fees.get('STUDENT_APP_FEE', Decimal('15.00'))
-        currency = 'USD'
-        payment_purpose = Payment.PaymentPurpose.STUDENT_APP_FEE
-    elif purpose == 'ADMISSION_FEE':
-        amount = application.custom_admission_fee or fees.get('ADMISSION_FEE', Decimal('1000.00'))
-        payment_purpose = Payment.PaymentPurpose.ADMISSION_FEE
-    elif purpose == 'AGENCY_FEE_HALF':
-        total_agency_fee = application.custom_agency_fee or fees.get('AGENCY_FEE', Decimal('500.00'))
-        amount = total_agency_fee * Decimal('0.50')
-        payment_purpose = Payment.PaymentPurpose.AGENCY_FEE_HALF
-    elif purpose == 'AGENCY_FEE_FULL':
-        amount = application.custom_agency_fee or fees.get('AGENCY_FEE', Decimal('500.00'))
-        payment_purpose = Payment.PaymentPurpose.AGENCY_FEE_FULL
-    elif purpose == 'WORK_APP_FEE':
-        amount = work_application.custom_application_fee or fees.get('WORK_APP_FEE', Decimal('30.00'))
-        payment_purpose = Payment.PaymentPurpose.WORK_APP_FEE
-    elif purpose == 'WORK_VISA_50_PERCENT':
-        if not work_application or not work_application.destination_country: return JsonResponse({'error': 'Destination country not selected.'}, status=400)
-        amount = work_application.destination_country.processing_fee * Decimal('0.50')
-        payment_purpose = Payment.PaymentPurpose.WORK_VISA_50_PERCENT
-    elif purpose == 'WORK_VISA_FINAL_50_PERCENT':
-        if not work_application or not work_application.destination_country: return JsonResponse({'error': 'Destination country not selected.'}, status=400)
-        amount = work_application.destination_country.processing_fee * Decimal('0.50')
-        payment_purpose = Payment.PaymentPurpose.WORK_VISA_FINAL_50_PERCENT
-    elif purpose == 'WORK_VISA_25_PERCENT':
-        if not work_application or not work_application.destination_country: return JsonResponse({'error': 'Destination country not selected.'}, status=400)
-        amount = work_application.destination_country.processing_fee * Decimal('0.25')
-        payment_purpose = Payment.PaymentPurpose.WORK_VISA_25_PERCENT
-    elif purpose == 'WORK_VISA_REMAINING_25_PERCENT':
-        if not work_application or not work_application.destination_country:
-            return JsonResponse({'error': 'Destination country not selected.'}, status=400)
-        amount = work_application.destination_country.processing_fee * Decimal('0.25')
-        payment_purpose = Payment.PaymentPurpose.WORK_VISA_REMAINING_25_PERCENT
-    else:
+    if purpose not in allowed_purposes:
         return JsonResponse({'error': 'Invalid payment purpose'}, status=400)
+    payment_purpose = Payment.PaymentPurpose(purpose)
+
+    # Custom fee if set, otherwise the default, read from the precomputed price table
+    price = price_for_purpose(payment_purpose, application or work_application)
+    if price is None:
+        return JsonResponse({'error': 'Destination country not selected.'}, status=400)
 
     tx_ref = f"HTG-{request.user.id}-{uuid.uuid4().hex[:6].upper()}"
 
     payment_currency = data.get('currency', 'USD')  # Get currency from frontend
     if payment_currency == 'NGN':
-        from .utils import convert_usd_to_ngn
-        # Convert to NGN if user chose NGN payment
-        amount = convert_usd_to_ngn(amount)
+        # Charge the NGN amount if user chose NGN payment
+        amount = price['ngn']
         currency = 'NGN'
     else:
+        amount = price['usd']
         currency = 'USD'
         
+    applicant.save_if_new(application or work_application)
     Payment.objects.create(
         application=application, work_application=work_application,
-        amount=amount, purpose=payment_purpose, tx_ref=tx_ref
+        amount=amount, currency=currency, amount_usd=price['usd'],
+        purpose=payment_purpose, tx_ref=tx_ref
     )
     
     redirect_url = request.build_absolute_uri(reverse('portal:payment_callback'))
@@ -550,54 +637,51 @@ def flutterwave_webhook(request):
     if not tx_ref or not transaction_id:
         return JsonResponse({'status': 'error', 'message': 'Missing transaction reference or ID'}, status=400)
     
-    url = f"https://api.flutterwave.com/v3/transactions/{transaction_id}/verify"
-    headers = {"Authorization": f"Bearer {settings.FLUTTERWAVE_SECRET_KEY}"}
-    
     try:
-        response = requests.get(url, headers=headers, verify=False)
-        response.raise_for_status()
-        data = response.json()
-        if data.get('status') == 'success':
-            payment_data = data.get('data', {})
-            payment = Payment.objects.get(tx_ref=payment_data.get('tx_ref'))
-            
-            if float(payment_data.get('amount')) == float(payment.amount) and payment.status == Payment.PaymentStatus.PENDING:
+        payment_data = get_flutterwave_client().verify_transaction(transaction_id)
+        if payment_data:
+            user = None
+            with transaction.atomic():
+                # Locking the payment makes a repeated webhook wait and then see it is no longer pending.
+                # Only the application's workflow columns are needed to advance it.
+                payment = Payment.objects.select_for_update(of=('self',)).select_related(
+                    'application__user', 'work_application__user',
+                ).defer(
+                    *profile_fields(Application, 'application__'),
+                    *profile_fields(WorkApplication, 'work_application__'),
+                ).get(tx_ref=payment_data.get('tx_ref'))
+
+                if float(payment_data.get('amount')) != float(payment.amount) or payment.status != Payment.PaymentStatus.PENDING:
+                    return redirect('portal:dashboard')
                 payment.status = Payment.PaymentStatus.SUCCESSFUL
                 payment.save()
-                
-                user = None
-                if payment.application:
-                    application = payment.application
-                    user = application.user
-                    if payment.purpose == Payment.PaymentPurpose.STUDENT_APP_FEE:
-                        application.status = Application.ApplicationStatus.STEP_2_ADMISSION_FEE
-                    elif payment.purpose == Payment.PaymentPurpose.ADMISSION_FEE:
-                        application.status = Application.ApplicationStatus.STEP_3_AGENCY_FEE
-                    elif payment.purpose in [Payment.PaymentPurpose.AGENCY_FEE_FULL, Payment.PaymentPurpose.AGENCY_FEE_HALF]:
-                        application.status = Application.ApplicationStatus.STEP_4_VISA_APPLICATION
-                    application.save()
-                
-                elif payment.work_application:
-                    application = payment.work_application
+
+                application = payment.application or payment.work_application
+                if application:
                     user = application.user
-                    if payment.purpose == Payment.PaymentPurpose.WORK_APP_FEE:
-                        application.status = WorkApplication.WorkApplicationStatus.STEP_2_EMPLOYMENT_FORM
-                    elif payment.purpose == Payment.PaymentPurpose.WORK_VISA_50_PERCENT:
-                        application.status = WorkApplication.WorkApplicationStatus.STEP_3_JOB_OFFER
-                    elif payment.purpose in [Payment.PaymentPurpose.WORK_VISA_FINAL_50_PERCENT, Payment.PaymentPurpose.WORK_VISA_25_PERCENT, Payment.PaymentPurpose.WORK_VISA_REMAINING_25_PERCENT]:
-                        application.status = WorkApplication.WorkApplicationStatus.STEP_4_VISA_APPLICATION
-                    application.save()
-
-                if user:
-                    context = {'user': user, 'payment': payment, 'dashboard_url': request.build_absolute_uri(reverse('portal:dashboard'))}
-                    user_email_body = render_to_string('portal/emails/payment_successful_user.txt', context)
-                    send_mail(subject='Your Payment to Hadey Travels Global was Successful!', message=user_email_body, from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[user.email], fail_silently=True)
-                    admin_email_body = render_to_string('portal/emails/payment_successful_admin.txt', context)
-                    send_mail(subject=f'New Payment Received: {payment.get_purpose_display()} from {user.username}', message=admin_email_body, from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[settings.ADMIN_EMAIL], fail_silently=True)
-                
-                return redirect('portal:dashboard')
-    except (requests.RequestException, Payment.DoesNotExist) as e:
-        pass
+                    # Summary columns and status move together with the payment
+                    ledger = refresh_payment_summary(application)
+                    # Move to the step unlocked by everything paid so far, including this payment
+                    update_fields = SUMMARY_FIELDS + ['updated_at']
+                    if ledger.advance_status():
+                        update_fields.append('status')
+                    application.save(update_fields=update_fields)
+
+            if user:
+                context = {'user': user, 'payment': payment, 'dashboard_url': request.build_absolute_uri(reverse('portal:dashboard'))}
+                user_email_body = render_to_string('portal/emails/payment_successful_user.txt', context)
+                guarded_send_mail(subject='Your Payment to Hadey Travels Global was Successful!', message=user_email_body, from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[user.email], fail_silently=True)
+                admin_email_body = render_to_string('portal/emails/payment_successful_admin.txt', context)
+                guarded_send_mail(subject=f'New Payment Received: {payment.get_purpose_display()} from {user.username}', message=admin_email_body, from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[settings.ADMIN_EMAIL], fail_silently=True)
+
+            return redirect('portal:dashboard')
+    except (requests.RequestException, FlutterwaveError, CircuitOpenError, Payment.DoesNotExist) as e:
+        # Not a 2xx, so Flutterwave delivers the callback again; 503 while it is unreachable
+        outage = isinstance(e, CircuitOpenError) or is_outage_error(e)
+        logger.warning(f"Could not confirm Flutterwave transaction {transaction_id} (tx_ref {tx_ref}): {e!r}")
+        return JsonResponse(
+            {'status': 'error', 'message': 'Payment could not be verified'}, status=503 if outage else 400,
+        )
     return redirect('portal:dashboard')
     
     
@@ -610,7 +694,7 @@ def generate_pdf_view(request, app_type, app_id):
     context = {}
 
     if app_type == 'student':
-        app = get_object_or_404(Application, id=app_id)
+        app = get_object_or_404(Application.objects.select_related('user', 'country_of_interest'), id=app_id)
         context['title'] = 'Student Application Summary'
         context['sections'] = {
             'Personal Information': {
@@ -634,11 +718,11 @@ def generate_pdf_view(request, app_type, app_id):
                 'Preferred Program': app.preferred_program,
                 'Previous School': app.previous_school,
                 'Applying From': app.country_applying_from,
-                'Applying To': app.country_of_interest,
+                'Applying To': app.country_of_interest.name if app.country_of_interest else app.country_of_interest_legacy or "N/A",
             }
         }
     elif app_type == 'work':
-        app = get_object_or_404(WorkApplication, id=app_id)
+        app = get_object_or_404(WorkApplication.objects.select_related('user', 'destination_country'), id=app_id)
         context['title'] = 'Work Application Summary'
         context['sections'] = {
             'Personal Information': {
@@ -676,3 +760,25 @@ def generate_pdf_view(request, app_type, app_id):
        return HttpResponse('We had some errors <pre>' + html + '</pre>')
     return response
 
+
+@staff_member_required
+def metrics_view(request):
+    """
+    Returns runtime counters for this worker process as JSON, so caches and
+    external dependencies can be checked under load.
+    """
+    return JsonResponse({
+        'geoip_cache': get_geoip_cache_stats(),
+        'circuit_breakers': breaker_metrics(),
+    })
+
+
+def media_view(request, path):
+    """
+    Serves MEDIA_ROOT in development, like django.views.static.serve. Files in
+    content-addressed storage never change, so they are cached for good.
+    """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_content_addressed(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response